@@ -173,6 +173,157 @@ def getCoordinateNDC(x, canvas, vert=False):
     else:
         return (x - canvas.GetX1()) / (canvas.GetX2() - canvas.GetX1())
 
+#########
+
+def batchedModel(xvals, parms, func=None, npar=1):
+    # xvals[0] is the eta bin index (centers of an integer axis), xvals[1] the pt,
+    # each eta bin has its own set of npar parameters for the same 1D function func
+    parms2d = tf.reshape(parms, [-1, npar])
+    ieta = tf.cast(xvals[0], tf.int32)
+    return func([xvals[1]], tf.unstack(tf.gather(parms2d, ieta), axis=-1))
+
+def evalModel(func, xvals, parms):
+    # evaluate func for arrays of parameters, with the parameters on the last axis of parms,
+    # the output has the leading dimensions of parms and the points of xvals on the last axis
+    return np.asarray(func([np.asarray(xvals)], np.moveaxis(parms, -1, 0)[..., None]))
+
+def fitBatched(boost_hist, func, params):
+    # boost_hist has the eta bin index on the first axis and pt on the second one,
+    # all eta bins are fitted at once as independent problems (the hessian is block diagonal)
+    neta = boost_hist.axes[0].size
+    npar = len(params)
+    res = narf.fitutils.fit_hist(boost_hist, partial(batchedModel, func=func, npar=npar), np.tile(params, neta))
+    xvals = np.reshape(np.asarray(res["x"], dtype=np.float64), (neta, npar))
+    cov = np.reshape(np.asarray(res["cov"], dtype=np.float64), (neta, npar, neta, npar))
+    cov = cov[np.arange(neta), :, np.arange(neta), :]
+    # chi2 of each eta bin, the fit only returns the total one
+    pulls = (boost_hist.values() - evalModel(func, boost_hist.axes[1].centers, xvals)) / np.sqrt(boost_hist.variances())
+    chi2 = np.sum(pulls * pulls, axis=-1)
+    # status and covstatus are those of the global fit, so they are the same for all eta bins
+    return [{"x"         : xvals[i],
+             "cov"       : cov[i],
+             "status"    : res["status"],
+             "covstatus" : res["covstatus"],
+             "loss_val"  : chi2[i],
+             } for i in range(neta)]
+
+def getEigenVariationBands(func, xvals, cov, ptvals, clip):
+    # nominal function, hessian eigen variations and their quadrature sum for all eta bins at once
+    npar = xvals.shape[-1]
+    e, v = np.linalg.eigh(cov)
+    # shift[ieta, ivar] = sqrt(e[ieta, ivar]) * v[ieta, :, ivar]
+    shift = np.sqrt(e)[..., None] * np.swapaxes(v, -1, -2)
+    altParameters = np.concatenate([xvals[:, None, :] + shift, xvals[:, None, :] - shift], axis=1)
+    nomi = clip(evalModel(func, ptvals, xvals))
+    alt = clip(evalModel(func, ptvals, altParameters))
+    diff = alt[:, :npar] - nomi[:, None]
+    err = np.sqrt(np.sum(diff * diff, axis=1))
+    return nomi, err, alt
+
+def fitTurnOnBatched(histos, mc, histosAlt=None,
+                     step=None,
+                     fitRange=None,
+                     widthPtSmooth=0.2,
+                     efficiencyFitPolDegree=4,
+):
+    # fit the pt dependence for all eta bins of histos (dictionary eta bin -> TH1) at once, with the same functions as fitTurnOnTF,
+    # returns for each eta bin the fit results (in the format of narf.fitutils.fit_hist) and the eigen variation bands,
+    # to be passed to fitTurnOnTF as batchedFitResults (which then only makes the plots)
+
+    doingSF = True if mc == "SF" else False
+    doSpline = True if efficiencyFitPolDegree < 0 else False
+
+    keys = sorted(histos.keys())
+    histo = histos[keys[0]]
+    originalMinFitRange = histo.GetXaxis().GetBinLowEdge(1)
+    originalMaxFitRange = histo.GetXaxis().GetBinLowEdge(1+histo.GetNbinsX())
+    minFitRange = originalMinFitRange
+    maxFitRange = originalMaxFitRange
+    if fitRange != None:
+        if fitRange[1] > 0:
+            maxFitRange = fitRange[1]
+        if fitRange[0] > 0:
+            minFitRange = fitRange[0]
+    xFitRange = maxFitRange - minFitRange
+
+    s = hist.tag.Slicer()
+    def makeBatchedHist(hs):
+        hpt = [narf.root_to_hist(hs[k]) for k in keys]
+        hpt = [h[{0 : s[complex(0,minFitRange):complex(0,maxFitRange+0.001)]}] for h in hpt]
+        h = hist.Hist(hist.axis.Integer(0, len(keys), underflow=False, overflow=False, name="etaBin"),
+                      hpt[0].axes[0],
+                      storage=hist.storage.Weight())
+        h.values()[...] = np.stack([x.values() for x in hpt])
+        h.variances()[...] = np.stack([x.variances() for x in hpt])
+        return h
+
+    boost_hist = makeBatchedHist(histos)
+    boost_hist_alt = makeBatchedHist(histosAlt) if histosAlt else None
+
+    fitres = {}
+    funcs = {}
+    if doingSF:
+        if step == "tracking" and histo.GetNbinsX() == 4: # use pol2 only with 4 bins, otherwise pol3
+            global pol2_tf_scaled
+            if pol2_tf_scaled == None:
+                pol2_tf_scaled = partial(pol2_root, xLowVal=minFitRange, xFitRange=xFitRange)
+            defaultFunc = "pol2_tf"
+            funcs[defaultFunc] = pol2_tf_scaled
+            params = np.array([1.0, 0.0, 0.0])
+        else:
+            global pol3_tf_scaled
+            if pol3_tf_scaled == None:
+                pol3_tf_scaled = partial(pol3_root, xLowVal=minFitRange, xFitRange=xFitRange)
+            defaultFunc = "pol3_tf"
+            funcs[defaultFunc] = pol3_tf_scaled
+            params = np.array([1.0, 0.0, 0.0, 0.0])
+        fitres[defaultFunc] = fitBatched(boost_hist, funcs[defaultFunc], params)
+        if boost_hist_alt is not None:
+            altFunc = defaultFunc.replace("_tf", "_alt_tf")
+            funcs[altFunc] = funcs[defaultFunc]
+            fitres[altFunc] = fitBatched(boost_hist_alt, funcs[altFunc], params)
+    else:
+        defaultFunc = "polN_tf"
+        fitres["erf"] = fitBatched(boost_hist, antiErf_tf if step == "antiiso" else erf_tf, np.array([1.0, 35.0, 3.0]))
+        # splines are not fitted, they are made directly by fitTurnOnTF
+        if not doSpline:
+            global polN_tf_scaled
+            if polN_tf_scaled == None:
+                polN_tf_scaled = partial(polN_root_, xLowVal=minFitRange, xFitRange=xFitRange, degree=efficiencyFitPolDegree)
+            funcs[defaultFunc] = polN_tf_scaled
+            params = np.array([1.0] + [0.0 for i in range(efficiencyFitPolDegree)])
+            fitres[defaultFunc] = fitBatched(boost_hist, funcs[defaultFunc], params)
+            if boost_hist_alt is not None:
+                funcs["polN_alt_tf"] = funcs[defaultFunc]
+                fitres["polN_alt_tf"] = fitBatched(boost_hist_alt, funcs["polN_alt_tf"], params)
+
+    ret = {k : {fr : fitres[fr][i] for fr in fitres} for i,k in enumerate(keys)}
+
+    if defaultFunc in fitres:
+        # same fine pt binning as the band in fitTurnOnTF
+        nbins = int(math.ceil((originalMaxFitRange-originalMinFitRange))/widthPtSmooth)
+        ptedges = np.linspace(originalMinFitRange, originalMaxFitRange, nbins+1)
+        ptvals = 0.5 * (ptedges[1:] + ptedges[:-1])
+        def clip(vals):
+            # protect against efficiency becoming larger than 1.0, as in fitTurnOnTF
+            vals = np.maximum(0.001, vals)
+            return vals if doingSF else np.where(vals >= 1.0, 0.9995, vals)
+        xvals = np.stack([r["x"] for r in fitres[defaultFunc]])
+        cov = np.stack([r["cov"] for r in fitres[defaultFunc]])
+        nomi, err, alt = getEigenVariationBands(funcs[defaultFunc], xvals, cov, ptvals, clip)
+        nomiAlt = None
+        altFunc = defaultFunc.replace("_tf", "_alt_tf")
+        if altFunc in fitres:
+            xvalsAlt = np.stack([r["x"] for r in fitres[altFunc]])
+            nomiAlt = clip(evalModel(funcs[altFunc], ptvals, xvalsAlt))
+        for i,k in enumerate(keys):
+            ret[k]["band"] = {"nomi" : nomi[i],
+                              "err"  : err[i],
+                              "vars" : alt[i],
+                              "alt"  : None if nomiAlt is None else nomiAlt[i],
+                              }
+    return ret
+
 
 def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit=True,
                 step=None,
@@ -185,7 +336,8 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
                 histoAlt = None,
                 efficiencyFitPolDegree=4,
                 addCurve=None,
-                addCurveLegEntry=""
+                addCurveLegEntry="",
+                batchedFitResults=None
 ):
 
     doingSF = True if mc == "SF" else False
@@ -297,6 +449,12 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
     
     xFitRange = maxFitRange - minFitRange
 
+    def fitHist(name, bhist, func, params):
+        # with the batched mode all eta bins were already fitted together by fitTurnOnBatched
+        if batchedFitResults is not None:
+            return batchedFitResults[name]
+        return narf.fitutils.fit_hist(bhist, func, params)
+
     if doingSF:
 
         if step == "tracking" and histo.GetNbinsX() == 4: # use pol2 only with 4 bins, otherwise pol3
@@ -305,7 +463,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
             if pol2_tf_scaled == None:
                 pol2_tf_scaled = partial(pol2_root, xLowVal=minFitRange, xFitRange=xFitRange)
             params = np.array([1.0, 0.0, 0.0])
-            res_tf1_pol2 = narf.fitutils.fit_hist(boost_hist, pol2_tf_scaled, params)
+            res_tf1_pol2 = fitHist("pol2_tf", boost_hist, pol2_tf_scaled, params)
             # for plotting purpose define the TF1 in the original range
             tf1_pol2 = ROOT.TF1("tf1_pol2", pol2_tf_scaled, minFitRange, maxFitRange, len(params))
             tf1_pol2.SetParameters( np.array( res_tf1_pol2["x"], dtype=np.float64 ) )
@@ -323,7 +481,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
             defaultFunc = "pol2_tf"
             if histoAlt:
                 params = np.array([1.0, 0.0, 0.0])
-                res_tf1_pol2_alt = narf.fitutils.fit_hist(boost_hist_alt, pol2_tf_scaled, params)
+                res_tf1_pol2_alt = fitHist("pol2_alt_tf", boost_hist_alt, pol2_tf_scaled, params)
                 tf1_pol2_alt = ROOT.TF1("tf1_pol2_alt", pol2_tf_scaled, minFitRange, maxFitRange, len(params))
                 tf1_pol2_alt.SetParameters( np.array( res_tf1_pol2_alt["x"], dtype=np.float64 ) )
                 tf1_pol2_alt.SetLineWidth(2)
@@ -338,7 +496,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
             if pol3_tf_scaled == None:
                 pol3_tf_scaled = partial(pol3_root, xLowVal=minFitRange, xFitRange=xFitRange)
             params = np.array([1.0, 0.0, 0.0, 0.0])
-            res_tf1_pol3 = narf.fitutils.fit_hist(boost_hist, pol3_tf_scaled, params)
+            res_tf1_pol3 = fitHist("pol3_tf", boost_hist, pol3_tf_scaled, params)
             tf1_pol3 = ROOT.TF1("tf1_pol3", pol3_tf_scaled, minFitRange, maxFitRange, len(params))
             tf1_pol3.SetParameters( np.array( res_tf1_pol3["x"], dtype=np.float64 ) )
             tf1_pol3.SetLineWidth(3)
@@ -363,7 +521,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
             defaultFunc = "pol3_tf"
             if histoAlt:
                 params = np.array([1.0, 0.0, 0.0, 0.0])
-                res_tf1_pol3_alt = narf.fitutils.fit_hist(boost_hist_alt, pol3_tf_scaled, params)
+                res_tf1_pol3_alt = fitHist("pol3_alt_tf", boost_hist_alt, pol3_tf_scaled, params)
                 tf1_pol3_alt = ROOT.TF1("tf1_pol3_alt", pol3_tf_scaled, minFitRange, maxFitRange, len(params))
                 tf1_pol3_alt.SetParameters( np.array( res_tf1_pol3_alt["x"], dtype=np.float64 ) )
                 tf1_pol3_alt.SetLineWidth(2)
@@ -381,10 +539,10 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
 
         if step == "antiiso":
             tf1_erf = ROOT.TF1("tf1_erf","1.0 - [0] * (1.0 + TMath::Erf((x-[1])/[2]))", minFitRange, maxFitRange)
-            res_tf1_erf = narf.fitutils.fit_hist(boost_hist, antiErf_tf, np.array([1.0, 35.0, 3.0]))
+            res_tf1_erf = fitHist("erf", boost_hist, antiErf_tf, np.array([1.0, 35.0, 3.0]))
         else:
             tf1_erf = ROOT.TF1("tf1_erf","[0] * (1.0 + TMath::Erf((x-[1])/[2]))", minFitRange, maxFitRange)
-            res_tf1_erf = narf.fitutils.fit_hist(boost_hist, erf_tf, np.array([1.0, 35.0, 3.0]))
+            res_tf1_erf = fitHist("erf", boost_hist, erf_tf, np.array([1.0, 35.0, 3.0]))
         tf1_erf.SetParameters( np.array( res_tf1_erf["x"], dtype=np.float64 ) )
         tf1_erf.SetLineWidth(2)
         tf1_erf.SetLineStyle(ROOT.kDashed)
@@ -401,7 +559,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
             if polN_tf_scaled == None:
                 polN_tf_scaled = partial(polN_root_, xLowVal=minFitRange, xFitRange=xFitRange, degree=efficiencyFitPolDegree)
             params = np.array([1.0] + [0.0 for i in range(efficiencyFitPolDegree)])
-            res_tf1_polN = narf.fitutils.fit_hist(boost_hist, polN_tf_scaled, params)
+            res_tf1_polN = fitHist("polN_tf", boost_hist, polN_tf_scaled, params)
             tf1_polN = ROOT.TF1(f"tf1_pol{efficiencyFitPolDegree}", polN_tf_scaled, minFitRange, maxFitRange, len(params))
             tf1_polN.SetParameters( np.array( res_tf1_polN["x"], dtype=np.float64 ) )
             tf1_polN.SetLineWidth(3)
@@ -435,7 +593,7 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
                 res_tf1_polN_alt = None
             else:
                 params = np.array([1.0] + [0.0 for i in range(efficiencyFitPolDegree)])
-                res_tf1_polN_alt = narf.fitutils.fit_hist(boost_hist_alt, polN_tf_scaled, params)
+                res_tf1_polN_alt = fitHist("polN_alt_tf", boost_hist_alt, polN_tf_scaled, params)
                 tf1_polN_alt = ROOT.TF1("tf1_polN_alt", polN_tf_scaled, minFitRange, maxFitRange, len(params))
                 tf1_polN_alt.SetParameters( np.array( res_tf1_polN_alt["x"], dtype=np.float64 ) )
                 tf1_polN_alt.SetLineWidth(2)
@@ -494,69 +652,83 @@ def fitTurnOnTF(histo, key, outdir, mc, channel="el", hist_chosenFunc=0, drawFit
         hband.SetFillColor(ROOT.kGray)
     #hband.SetLineColor(fitFunction[defaultFunc]["func"].GetLineColor())
     #hband.SetFillStyle(3001)
-    for ib in range(1, hband.GetNbinsX()+1):
-        pt = hband.GetBinCenter(ib)
-        val = max(0.001, fitFunction[defaultFunc]["func"].Eval(pt))
-        # protect against efficiency becoming larger than 1.0
-        # usually it happens because of the pol3 extrapolation for very high pt, which is not used for the analysis
-        # for MC set to slightly less than 1.0 to avoid issues with antiiso when doing 1-eff and then data/MC ratio (do the same for data just in case)
-        if val >= 1.0 and not doingSF:
-            val = 0.9995
-        hband.SetBinContent(ib, val)
-        if hist_nomiAndAlt_etapt:
-            # assuming the pt binning is the same, which it should, although the code should be made more robust
-            hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 1, val)
-
-    
-    # store all variations for faster access below
-    altParameters = np.array([np.zeros(npar, dtype=np.float64)] * (npar * 2), dtype=np.float64)
-    if not doSpline:
-        # diagonalize and get eigenvalues and eigenvectors
-        e, v = np.linalg.eigh(fitres_TF[defaultFunc]["cov"])
-        #print(altParameters)
-        for ivar in range(npar):
-            shift = np.sqrt(e[ivar]) * v[:, ivar]
-            altParameters[ivar]      = fitres_TF[defaultFunc]["x"] + shift
-            altParameters[ivar+npar] = fitres_TF[defaultFunc]["x"] - shift
-
-    tf1_func_alt = ROOT.TF1()
-    tf1_func_alt.SetName("tf1_func_alt")
-    fitFunction[defaultFunc]["func"].Copy(tf1_func_alt)
-    tf1_func_alt.SetLineWidth(2)
     if hist_nomiAndAlt_etapt is not None:
         lastSystBin = hist_nomiAndAlt_etapt.GetNbinsZ()
-    for ib in range(1, hband.GetNbinsX()+1):
-        pt = hband.GetBinCenter(ib)
-        err = 0.0
-        for ivar in range(npar):
-            # set parameters for a given hessian
-            tf1_func_alt.SetParameters(altParameters[ivar]) # this is for Up variations, Down ones could not be the mirror image
-            funcVal = max(0.001, tf1_func_alt.Eval(pt))
-            if funcVal >= 1.0 and not doingSF:
-                funcVal = 0.9995
-            diff = funcVal - hband.GetBinContent(ib)
-            err += diff * diff
+    band = None if batchedFitResults is None else batchedFitResults.get("band", None)
+    if band is not None:
+        # nominal, eigen variations and band were already computed for all eta bins by fitTurnOnBatched
+        for ib in range(1, hband.GetNbinsX()+1):
+            hband.SetBinContent(ib, band["nomi"][ib-1])
+            hband.SetBinError(ib, band["err"][ib-1])
             if hist_nomiAndAlt_etapt is not None:
-                # now fill TH3, also with down variations
-                hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 2+ivar, funcVal)
-                # repeat for Down variations
-                tf1_func_alt.SetParameters(altParameters[ivar+npar])
+                hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 1, band["nomi"][ib-1])
+                hist_nomiAndAlt_etapt.SetBinError(key+1, ib, 1, band["err"][ib-1])
+                for ivar in range(2*npar):
+                    hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 2+ivar, band["vars"][ivar][ib-1])
+                if band["alt"] is not None:
+                    hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, lastSystBin, band["alt"][ib-1])
+    else:
+        for ib in range(1, hband.GetNbinsX()+1):
+            pt = hband.GetBinCenter(ib)
+            val = max(0.001, fitFunction[defaultFunc]["func"].Eval(pt))
+            # protect against efficiency becoming larger than 1.0
+            # usually it happens because of the pol3 extrapolation for very high pt, which is not used for the analysis
+            # for MC set to slightly less than 1.0 to avoid issues with antiiso when doing 1-eff and then data/MC ratio (do the same for data just in case)
+            if val >= 1.0 and not doingSF:
+                val = 0.9995
+            hband.SetBinContent(ib, val)
+            if hist_nomiAndAlt_etapt:
+                # assuming the pt binning is the same, which it should, although the code should be made more robust
+                hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 1, val)
+
+    
+        # store all variations for faster access below
+        altParameters = np.array([np.zeros(npar, dtype=np.float64)] * (npar * 2), dtype=np.float64)
+        if not doSpline:
+            # diagonalize and get eigenvalues and eigenvectors
+            e, v = np.linalg.eigh(fitres_TF[defaultFunc]["cov"])
+            #print(altParameters)
+            for ivar in range(npar):
+                shift = np.sqrt(e[ivar]) * v[:, ivar]
+                altParameters[ivar]      = fitres_TF[defaultFunc]["x"] + shift
+                altParameters[ivar+npar] = fitres_TF[defaultFunc]["x"] - shift
+
+        tf1_func_alt = ROOT.TF1()
+        tf1_func_alt.SetName("tf1_func_alt")
+        fitFunction[defaultFunc]["func"].Copy(tf1_func_alt)
+        tf1_func_alt.SetLineWidth(2)
+        for ib in range(1, hband.GetNbinsX()+1):
+            pt = hband.GetBinCenter(ib)
+            err = 0.0
+            for ivar in range(npar):
+                # set parameters for a given hessian
+                tf1_func_alt.SetParameters(altParameters[ivar]) # this is for Up variations, Down ones could not be the mirror image
                 funcVal = max(0.001, tf1_func_alt.Eval(pt))
                 if funcVal >= 1.0 and not doingSF:
                     funcVal = 0.9995
-                hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 2+ivar+npar, funcVal)
-        err = math.sqrt(err)
-        hband.SetBinError(ib, err)
-        if hist_nomiAndAlt_etapt is not None:
-            hist_nomiAndAlt_etapt.SetBinError(key+1, ib, 1, err)
-            if histoAlt:
-                for f in fitFunction.keys():
-                    if "_alt_tf" in f:
-                        funcVal = max(0.001, fitFunction[f]["func"].Eval(pt))
-                        if funcVal >= 1.0 and not doingSF:
-                            funcVal = 0.9995
-                        hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, lastSystBin, funcVal)
-        
+                diff = funcVal - hband.GetBinContent(ib)
+                err += diff * diff
+                if hist_nomiAndAlt_etapt is not None:
+                    # now fill TH3, also with down variations
+                    hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 2+ivar, funcVal)
+                    # repeat for Down variations
+                    tf1_func_alt.SetParameters(altParameters[ivar+npar])
+                    funcVal = max(0.001, tf1_func_alt.Eval(pt))
+                    if funcVal >= 1.0 and not doingSF:
+                        funcVal = 0.9995
+                    hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, 2+ivar+npar, funcVal)
+            err = math.sqrt(err)
+            hband.SetBinError(ib, err)
+            if hist_nomiAndAlt_etapt is not None:
+                hist_nomiAndAlt_etapt.SetBinError(key+1, ib, 1, err)
+                if histoAlt:
+                    for f in fitFunction.keys():
+                        if "_alt_tf" in f:
+                            funcVal = max(0.001, fitFunction[f]["func"].Eval(pt))
+                            if funcVal >= 1.0 and not doingSF:
+                                funcVal = 0.9995
+                            hist_nomiAndAlt_etapt.SetBinContent(key+1, ib, lastSystBin, funcVal)
+
     hband.Draw("E4SAME")
     # redraw to have them on top
     for f in fitFunction.keys():
@@ -1009,6 +1181,8 @@ def runFiles(args):
             
         cmd = f"python scripts/analysisTools/w_mass_13TeV/smoothLeptonScaleFactors.py {inputFile} {args.outdir[0]} -c {charge} -s {step}"
         cmd += f" --input-hist-names '{args.inputHistNames}' --input-hist-names-alt '{args.inputHistNamesAlt}'"
+        if args.batchedFit:
+            cmd += " --batched-fit"
         ## now we no longer smooth efficiencies, but keep commented in case we need it again
         # if step in ["iso", "isonotrig", "antiiso", "antiisonotrig"]:
         #     cmd += f" --no-skip-eff --fit-pol-degree-efficiency {args.fitPolDegreeEfficiency}"
@@ -1035,6 +1209,7 @@ if __name__ == "__main__":
     parser.add_argument(    '--input-hist-names-alt', dest='inputHistNamesAlt', default='EffDataAltSig2D,SF2D_dataAltSig', type=str, help='Pass comma separated list of 2  names for alternate variations, for eff(data),SF, to be used instead of the default names')
     parser.add_argument(     '--fit-pol-degree-efficiency'  , dest='fitPolDegreeEfficiency', default=4, type=int, help='Degree for polynomial used in the fits to efficiencies (-1 will use a spline)')
     parser.add_argument(     '--no-skip-eff', dest='skipEff', action="store_false", help='Do not skip efficiency smoothing (default is to do only SF to save time and if one only wants to smooth SF directly)')
+    parser.add_argument(     '--batched-fit', dest='batchedFit', action="store_true", help='Fit all eta bins of each step at once as independent problems, and compute the eigen variation bands with arrays (ROOT is then only used for plotting)')
     # utility option to print commands to do all files
     parser.add_argument('-d',  '--dryRun', action='store_true', help='Do not execute commands, just print them')
     parser.add_argument(     '--run-all', dest='runAll', action="store_true", help='Make and run commands to run all steps specified in --merge-steps')
@@ -1230,6 +1405,10 @@ if __name__ == "__main__":
 
     if not args.skipEff:
         hmcpt = make1Dhist("hmcpt", hmc, ptbins, label)
+        batchedFitResults = {}
+        if args.batchedFit:
+            batchedFitResults = fitTurnOnBatched(hmcpt, "MC", step=args.step, fitRange=args.ptFitRange,
+                                                 widthPtSmooth=args.widthPt, efficiencyFitPolDegree=args.fitPolDegreeEfficiency)
         ###########################
         # first MC
         ###########################
@@ -1243,7 +1422,8 @@ if __name__ == "__main__":
                                       etabins=etabins,
                                       widthPtSmooth=args.widthPt,
                                       hist_nomiAndAlt_etapt=hist_effMC_nomiAndAlt_etapt,
-                                      efficiencyFitPolDegree=args.fitPolDegreeEfficiency
+                                      efficiencyFitPolDegree=args.fitPolDegreeEfficiency,
+                                      batchedFitResults=batchedFitResults.get(key, None)
 
             )
             for ipt in range(1, hmcSmoothCheck_origBinPt.GetNbinsY()+1):
@@ -1257,6 +1437,10 @@ if __name__ == "__main__":
         ###########################
         hdatapt = make1Dhist("hdatapt", hdata, ptbins, label)
         hdataptAlt = make1Dhist("hdataptAlt", hdataAlt, ptbins, label)
+        batchedFitResults = {}
+        if args.batchedFit:
+            batchedFitResults = fitTurnOnBatched(hdatapt, "Data", histosAlt=hdataptAlt, step=args.step, fitRange=args.ptFitRange,
+                                                 widthPtSmooth=args.widthPt, efficiencyFitPolDegree=args.fitPolDegreeEfficiency)
         for key in hdatapt:
 
             bestFitFunc = fitTurnOnTF(hdatapt[key],key,outdir, "Data",channel=channel,hist_chosenFunc=hist_chosenFunc, 
@@ -1268,7 +1452,8 @@ if __name__ == "__main__":
                                       widthPtSmooth=args.widthPt,
                                       hist_nomiAndAlt_etapt=hist_effData_nomiAndAlt_etapt,
                                       histoAlt=hdataptAlt[key],
-                                      efficiencyFitPolDegree=args.fitPolDegreeEfficiency
+                                      efficiencyFitPolDegree=args.fitPolDegreeEfficiency,
+                                      batchedFitResults=batchedFitResults.get(key, None)
 
             )
             for ipt in range(1,hdataSmoothCheck_origBinPt.GetNbinsY()+1):
@@ -1288,6 +1473,10 @@ if __name__ == "__main__":
     # ###########################
     # # now direct SF smoothing
     # ###########################
+    batchedFitResults = {}
+    if args.batchedFit:
+        batchedFitResults = fitTurnOnBatched(hsfpt, "SF", histosAlt=hsfptAlt, step=args.step, fitRange=args.ptFitRange,
+                                             widthPtSmooth=args.widthPt)
     for key in hsfpt:
         smoothSFfromEffiTMP = None
         if not args.skipEff:
@@ -1303,7 +1492,8 @@ if __name__ == "__main__":
                                   hist_nomiAndAlt_etapt=hist_SF_nomiAndAlt_etapt,
                                   histoAlt=hsfptAlt[key],
                                   addCurve=smoothSFfromEffiTMP,
-                                  addCurveLegEntry=f"SF from pol{args.fitPolDegreeEfficiency} effi"
+                                  addCurveLegEntry=f"SF from pol{args.fitPolDegreeEfficiency} effi",
+                                  batchedFitResults=batchedFitResults.get(key, None)
         )
         for ipt in range(1,hsfSmoothCheck_origBinPt.GetNbinsY()+1):
             ptval = hsfSmoothCheck_origBinPt.GetYaxis().GetBinCenter(ipt)
@@ -1687,6 +1877,10 @@ if __name__ == "__main__":
         # ###########################
         # # now SF
         # ###########################
+        batchedFitResults = {}
+        if args.batchedFit:
+            batchedFitResults = fitTurnOnBatched(hsfpt_anti, "SF", histosAlt=hsfptAlt_anti, step="anti"+args.step, fitRange=args.ptFitRange,
+                                                 widthPtSmooth=args.widthPt)
         for key in hsfpt_anti:
             antiisoTMP = nomiAntiisoSFfromSmoothIsoEffi.ProjectionY(f"antiisoTMP_{key}", key+1, key+1, "e")
             bestFitFunc = fitTurnOnTF(hsfpt_anti[key],key, outdir+f"/anti{args.step}_fromSmoothEffi", "SF", 
@@ -1697,7 +1891,8 @@ if __name__ == "__main__":
                                       widthPtSmooth=args.widthPt,
                                       histoAlt=hsfptAlt_anti[key],
                                       addCurve=antiisoTMP,
-                                      addCurveLegEntry=f"SF from pol{args.fitPolDegreeEfficiency} {args.step} effi"
+                                      addCurveLegEntry=f"SF from pol{args.fitPolDegreeEfficiency} {args.step} effi",
+                                      batchedFitResults=batchedFitResults.get(key, None)
             )
 
     # prepare antiiso or antitrigger SF using direct SF smoothing and W MC truth efficiencies
@@ -1741,6 +1936,10 @@ if __name__ == "__main__":
         # ###########################
         # # now SF
         # ###########################
+        batchedFitResults = {}
+        if args.batchedFit:
+            batchedFitResults = fitTurnOnBatched(hsfpt_anti, "SF", histosAlt=hsfptAlt_anti, step="anti"+args.step, fitRange=args.ptFitRange,
+                                                 widthPtSmooth=args.widthPt)
         for key in hsfpt_anti:
             antiisoTMP = nomiAntiSFfromSFandEffi.ProjectionY(f"antiisoTMP2_{key}", key+1, key+1, "e")
             bestFitFunc = fitTurnOnTF(hsfpt_anti[key],key, outdir+f"/anti{args.step}_fromSFandEffi", "SF", 
@@ -1751,7 +1950,8 @@ if __name__ == "__main__":
                                       widthPtSmooth=args.widthPt,
                                       histoAlt=hsfptAlt_anti[key],
                                       addCurve=antiisoTMP,
-                                      addCurveLegEntry=f"From {args.step} SF and W MC effi"
+                                      addCurveLegEntry=f"From {args.step} SF and W MC effi",
+                                      batchedFitResults=batchedFitResults.get(key, None)
             )
 
     ###########################
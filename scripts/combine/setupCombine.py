@@ -52,6 +52,13 @@ def make_parser(parser=None):
     parser.add_argument("--noColorLogger", action="store_true", help="Do not use logging with colors")
     parser.add_argument("--hdf5", action="store_true", help="Write out datacard in hdf5")
     parser.add_argument("--sparse", action="store_true", help="Write out datacard in sparse mode (only for when using hdf5)")
+    parser.add_argument("--streaming", action="store_true", help="Write the logk arrays of each systematic to a scratch file as soon as they are computed and assemble the output tensors in blocks of bins to bound the memory usage, implies --denseBlocks (only for when using hdf5)")
+    parser.add_argument("--nWorkers", type=int, default=1, help="Number of processes to load the shape systematics and compute the logk arrays in parallel (only for when using hdf5)")
+    parser.add_argument("--compressionThreads", type=int, default=1, help="Number of threads to compress the chunks of the hdf5 datasets (only for when using hdf5)")
+    parser.add_argument("--codec", type=str, default="gzip", choices=["gzip", "blosc2"], help="Compression of the hdf5 datasets, blosc2 uses zstd with byte shuffling and is much faster to write and read (only for when using hdf5)")
+    parser.add_argument("--denseBlocks", action="store_true", help="Write the dense logk tensor in blocks of bins aligned with the hdf5 chunks, without assembling the full tensor in memory (only for when using hdf5 without --sparse)")
+    parser.add_argument("--logkCache", type=str, default=None, help="Directory of an on disk cache of the logk arrays of each channel and shape systematic, when the datacard is regenerated only the systematics with a different configuration are recomputed (only for when using hdf5)")
+    parser.add_argument("--float32", action="store_true", help="Store the norm and logk tensors in single precision (only for when using hdf5)")
     parser.add_argument("--excludeProcGroups", type=str, nargs="*", help="Don't run over processes belonging to these groups (only accepts exact group names)", default=["QCD"])
     parser.add_argument("--filterProcGroups", type=str, nargs="*", help="Only run over processes belonging to these groups", default=[])
     parser.add_argument("-x", "--excludeNuisances", type=str, default="", help="Regular expression to exclude some systematics from the datacard")
@@ -79,12 +86,14 @@ def make_parser(parser=None):
     parser.add_argument("--decorrAxlim", type=float, default=[], nargs='*', help="Restrict axis to this range (assumes pairs of values by axis, with trailing axes optional)")
     parser.add_argument("--fitresult", type=str, default=None ,help="Use data and covariance matrix from fitresult (for making a theory fit)")
     parser.add_argument("--noMCStat", action='store_true', help="Do not include MC stat uncertainty in covariance for theory fit (only when using --fitresult)")
+    parser.add_argument("--covCholesky", action='store_true', help="Factorize the covariance matrix for the theory fit with Cholesky, the triangular factor is stored in addition to the inverse computed from it (only when using --fitresult)")
     parser.add_argument("--fakerateAxes", nargs="+", help="Axes for the fakerate binning", default=["eta","pt","charge"])
     parser.add_argument("--fakeEstimation", type=str, help="Set the mode for the fake estimation", default="extended1D", choices=["closure", "simple", "extrapolate", "extended1D", "extended2D"])
     parser.add_argument("--fakeSmoothingMode", type=str, default="full", choices=["binned", "fakerate", "full"], help="Smoothing mode for fake estimate.")
     parser.add_argument("--forceGlobalScaleFakes", default=None, type=float, help="Scale the fakes  by this factor (overriding any custom one implemented in datagroups.py in the fakeSelector).")
     parser.add_argument("--fakeMCCorr", type=str, default=[None], nargs="*", choices=["none", "pt", "eta", "mt"], help="axes to apply nonclosure correction from QCD MC. Leave empty for inclusive correction, use'none' for no correction")
     parser.add_argument("--fakeSmoothingOrder", type=int, default=2, help="Order of the polynomial for the smoothing of the fake rate or full prediction, depending on the smoothing mode")
+    parser.add_argument("--fakeCacheSize", type=float, default=1024, help="Size in MB of the in-memory cache of fake estimates, identical inputs (e.g. for systematics not affecting the fakes) reuse the cached estimate. Set to 0 to disable")
     parser.add_argument("--simultaneousABCD", action="store_true", help="Produce datacard for simultaneous fit of ABCD regions")
     parser.add_argument("--skipSumGroups", action="store_true", help="Don't add sum groups to the output to save time e.g. when computing impacts")
     parser.add_argument("--allowNegativeExpectation", action="store_true", help="Allow processes to have negative contributions")
@@ -292,6 +301,7 @@ def setup(args, inputFile, inputBaseName, inputLumiScale, fitvar, genvar=None, x
             integrate_x="mt" not in fitvar,
             simultaneousABCD=simultaneousABCD, forceGlobalScaleFakes=args.forceGlobalScaleFakes,
             )
+        datagroups.set_histselector_cache(int(args.fakeCacheSize*1024**2))
 
     # Start to create the CardTool object, customizing everything
     cardTool = CardTool.CardTool(xnorm=xnorm, simultaneousABCD=simultaneousABCD, real_data=args.realData)
@@ -1198,7 +1208,7 @@ if __name__ == "__main__":
         args.doStatOnly = True
 
     if args.hdf5:
-        writer = HDF5Writer.HDF5Writer(sparse=args.sparse)
+        writer = HDF5Writer.HDF5Writer(sparse=args.sparse, streaming=args.streaming, nWorkers=args.nWorkers, compressionThreads=args.compressionThreads, codec=args.codec, denseBlocks=args.denseBlocks, float32=args.float32, logkCache=args.logkCache)
 
         if args.baseName == "xnorm":
             writer.theoryFit = True
@@ -1220,7 +1230,7 @@ if __name__ == "__main__":
                 cardTool = setup(args, ifile, iBaseName, iLumiScale, fitvar, xnorm=True)
                 writer.add_channel(cardTool)
         if args.fitresult:
-            writer.set_fitresult(args.fitresult, mc_stat=not (args.noMCStat or args.explicitSignalMCstat))
+            writer.set_fitresult(args.fitresult, mc_stat=not (args.noMCStat or args.explicitSignalMCstat), cholesky=args.covCholesky)
 
         if len(outnames) == 1:
             outfolder, outfile = outnames[0]
@@ -100,7 +100,7 @@ cols_mT = ["lep_pt", "lep_eta", "lep_charge", "transverseMass",  "passIso"]
 axis_cutFlow = hist.axis.Regular(1, 0, 1, name = "cutFlow")
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
-corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs_lowpu], theory_corrs)
+corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs_lowpu], theory_corrs, cache_dir=args.theoryCorrCacheDir)
 
 # recoil initialization
 args.noRecoil = True
@@ -4,6 +4,7 @@ from utilities.io_tools import output_tools
 from utilities.common import background_MCprocs as bkgMCprocs,data_dir
 from wremnants.datasets.datagroups import Datagroups
 import os
+import sys
 
 analysis_label = Datagroups.analysisLabel(os.path.basename(__file__))
 parser,initargs = common.common_parser(analysis_label)
@@ -13,8 +14,13 @@ import narf
 import wremnants
 from wremnants import (helicity_utils, theory_tools, syst_tools,theory_corrections, muon_calibration, muon_prefiring, muon_selections, 
     muon_efficiencies_binned, muon_efficiencies_smooth, muon_efficiencies_veto, muon_validation, unfolding_tools, theoryAgnostic_tools, pileup, vertex)
-from wremnants.histmaker_tools import scale_to_data, aggregate_groups
-from wremnants.datasets.dataset_tools import getDatasets
+from wremnants.graph_profiler import GraphProfiler
+from wremnants.skim_tools import EventSkims
+from wremnants import multi_config
+from wremnants import cling_cache
+from wremnants.helper_registry import HelperRegistry
+from wremnants.histmaker_tools import scale_to_data, aggregate_groups, add_dataset_groups
+from wremnants.datasets.dataset_tools import getDatasets, shard_datasets
 from wremnants.helicity_utils_polvar import makehelicityWeightHelper_polvar 
 import hist
 import lz4.frame
@@ -41,10 +47,15 @@ parser.add_argument("--useGlobalOrTrackerVeto", action="store_true", help="Use g
 
 #
 
-args = parser.parse_args()
+args = multi_config.parse_args(parser)
 
 logger = logging.setup_logger(__file__, args.verbose, args.noColorLogger)
 
+if args.configs:
+    # process all configurations in a single event loop, the script is run once per configuration up to the event loop
+    multi_config.run_configs(__file__, args.configs, args)
+    sys.exit()
+
 useGlobalOrTrackerVeto = args.useGlobalOrTrackerVeto
 
 if args.selectNonPromptFromLightMesonDecay and args.selectNonPromptFromSV:
@@ -73,7 +84,7 @@ if args.makeMCefficiency:
     nbinsPtEff = axis_pt_eff_list[-1] - axis_pt_eff_list[0]
     parser = common.set_parser_default(parser, "pt", [nbinsPtEff, axis_pt_eff_list[0], axis_pt_eff_list[-1]])
 
-args = parser.parse_args()
+args = multi_config.parse_args(parser)
 
 thisAnalysis = ROOT.wrem.AnalysisType.Wmass
 isoBranch = muon_selections.getIsoBranch(args.isolationDefinition)
@@ -87,6 +98,12 @@ datasets = getDatasets(maxFiles=args.maxFiles,
                        extended = "msht20an3lo" not in args.pdfs,
                        era=era)
 
+if args.shard:
+    datasets = shard_datasets(datasets, args.shard)
+
+skims = EventSkims(args)
+datasets = skims.use_skims(datasets)
+
 # transverse boson mass cut
 mtw_min = args.mtCut
 
@@ -171,61 +188,72 @@ mTStudyForFakes_axes = [axis_eta, axis_pt, axis_charge, axis_mt_fakes, axis_pass
 axis_met = hist.axis.Regular(100, 0., 200., name = "met", underflow=False, overflow=True)
 axis_recoWpt = hist.axis.Regular(40, 0., 80., name = "recoWpt", underflow=False, overflow=True)
 
-# define helpers
-muon_prefiring_helper, muon_prefiring_helper_stat, muon_prefiring_helper_syst = muon_prefiring.make_muon_prefiring_helpers(era = era)
+# define helpers, they are only built when they are needed for the first time in build_graph
+helpers = HelperRegistry()
+helpers.register(["muon_prefiring_helper", "muon_prefiring_helper_stat", "muon_prefiring_helper_syst"], muon_prefiring.make_muon_prefiring_helpers, era = era)
 
-qcdScaleByHelicity_helper = theory_corrections.make_qcd_uncertainty_helper_by_helicity()
+helpers.register("qcdScaleByHelicity_helper", theory_corrections.make_qcd_uncertainty_helper_by_helicity)
 
 if args.noScaleFactors:
     logger.info("Running with no scale factors")
 elif args.binnedScaleFactors:
     logger.info("Using binned scale factors and uncertainties")
     # add usePseudoSmoothing=True for tests with Asimov
-    muon_efficiency_helper, muon_efficiency_helper_syst, muon_efficiency_helper_stat = muon_efficiencies_binned.make_muon_efficiency_helpers_binned(filename = data_dir + "/muonSF/allSmooth_GtoH3D.root", era = era, max_pt = axis_pt.edges[-1], usePseudoSmoothing=True)
+    helpers.register(["muon_efficiency_helper", "muon_efficiency_helper_syst", "muon_efficiency_helper_stat"], muon_efficiencies_binned.make_muon_efficiency_helpers_binned, filename = data_dir + "/muonSF/allSmooth_GtoH3D.root", era = era, max_pt = axis_pt.edges[-1], usePseudoSmoothing=True)
 else:
     logger.info("Using smoothed scale factors and uncertainties")
-    muon_efficiency_helper, muon_efficiency_helper_syst, muon_efficiency_helper_stat = muon_efficiencies_smooth.make_muon_efficiency_helpers_smooth(filename = args.sfFile, era = era, what_analysis = thisAnalysis, max_pt = axis_pt.edges[-1], isoEfficiencySmoothing = args.isoEfficiencySmoothing, smooth3D=args.smooth3dsf, isoDefinition=args.isolationDefinition)
-    muon_efficiency_veto_helper, muon_efficiency_veto_helper_syst, muon_efficiency_veto_helper_stat = muon_efficiencies_veto.make_muon_efficiency_helpers_veto(useGlobalOrTrackerVeto = useGlobalOrTrackerVeto, era = era)
+    helpers.register(["muon_efficiency_helper", "muon_efficiency_helper_syst", "muon_efficiency_helper_stat"], muon_efficiencies_smooth.make_muon_efficiency_helpers_smooth, filename = args.sfFile, era = era, what_analysis = thisAnalysis, max_pt = axis_pt.edges[-1], isoEfficiencySmoothing = args.isoEfficiencySmoothing, smooth3D=args.smooth3dsf, isoDefinition=args.isolationDefinition)
+    helpers.register(["muon_efficiency_veto_helper", "muon_efficiency_veto_helper_syst", "muon_efficiency_veto_helper_stat"], muon_efficiencies_veto.make_muon_efficiency_helpers_veto, useGlobalOrTrackerVeto = useGlobalOrTrackerVeto, era = era)
 
 logger.info(f"SF file: {args.sfFile}")
 
-muon_efficiency_helper_syst_altBkg = {}
-for es in common.muonEfficiency_altBkgSyst_effSteps:
-    altSFfile = args.sfFile.replace(".root", "_altBkg.root")
-    logger.info(f"Additional SF file for alternate syst with {es}: {altSFfile}")
-    muon_efficiency_helper_syst_altBkg[es] = muon_efficiencies_smooth.make_muon_efficiency_helpers_smooth_altSyst(filename = altSFfile, era = era,
-                                                                                                   what_analysis = thisAnalysis, max_pt = axis_pt.edges[-1],
-                                                                                                   effStep=es)
+def make_muon_efficiency_helpers_altBkg():
+    res = {}
+    for es in common.muonEfficiency_altBkgSyst_effSteps:
+        altSFfile = args.sfFile.replace(".root", "_altBkg.root")
+        logger.info(f"Additional SF file for alternate syst with {es}: {altSFfile}")
+        res[es] = muon_efficiencies_smooth.make_muon_efficiency_helpers_smooth_altSyst(filename = altSFfile, era = era,
+                                                                                       what_analysis = thisAnalysis, max_pt = axis_pt.edges[-1],
+                                                                                       effStep=es)
+    return res
 
-pileup_helper = pileup.make_pileup_helper(era = era)
-vertex_helper = vertex.make_vertex_helper(era = era)
+helpers.register("muon_efficiency_helper_syst_altBkg", make_muon_efficiency_helpers_altBkg)
+
+helpers.register("pileup_helper", pileup.make_pileup_helper, era = era)
+helpers.register("vertex_helper", vertex.make_vertex_helper, era = era)
 
 calib_filepaths = common.calib_filepaths
 closure_filepaths = common.closure_filepaths
 
-diff_weights_helper = ROOT.wrem.SplinesDifferentialWeightsHelper(calib_filepaths['tflite_file']) if (args.muonScaleVariation == 'smearingWeightsSplines' or args.validationHists) else None
+if args.muonScaleVariation == 'smearingWeightsSplines' or args.validationHists:
+    helpers.register("diff_weights_helper", ROOT.wrem.SplinesDifferentialWeightsHelper, calib_filepaths['tflite_file'])
+else:
+    helpers.register("diff_weights_helper", lambda: None)
 
-mc_jpsi_crctn_helper, data_jpsi_crctn_helper, jpsi_crctn_MC_unc_helper, jpsi_crctn_data_unc_helper = muon_calibration.make_jpsi_crctn_helpers(args, calib_filepaths, make_uncertainty_helper=True)
+helpers.register(["mc_jpsi_crctn_helper", "data_jpsi_crctn_helper", "jpsi_crctn_MC_unc_helper", "jpsi_crctn_data_unc_helper"], muon_calibration.make_jpsi_crctn_helpers, args, calib_filepaths, make_uncertainty_helper=True)
 
-z_non_closure_parametrized_helper, z_non_closure_binned_helper = muon_calibration.make_Z_non_closure_helpers(args, calib_filepaths, closure_filepaths)
+helpers.register(["z_non_closure_parametrized_helper", "z_non_closure_binned_helper"], muon_calibration.make_Z_non_closure_helpers, args, calib_filepaths, closure_filepaths)
 
-mc_calibration_helper, data_calibration_helper, calibration_uncertainty_helper = muon_calibration.make_muon_calibration_helpers(args,era=era)
+helpers.register(["mc_calibration_helper", "data_calibration_helper", "calibration_uncertainty_helper"], muon_calibration.make_muon_calibration_helpers, args, era=era)
 
-closure_unc_helper = muon_calibration.make_closure_uncertainty_helper(common.closure_filepaths["parametrized"])
-closure_unc_helper_A = muon_calibration.make_uniform_closure_uncertainty_helper(0, common.correlated_variation_base_size["A"])
-closure_unc_helper_M = muon_calibration.make_uniform_closure_uncertainty_helper(2, common.correlated_variation_base_size["M"])
+helpers.register("closure_unc_helper", muon_calibration.make_closure_uncertainty_helper, common.closure_filepaths["parametrized"])
+helpers.register("closure_unc_helper_A", muon_calibration.make_uniform_closure_uncertainty_helper, 0, common.correlated_variation_base_size["A"])
+helpers.register("closure_unc_helper_M", muon_calibration.make_uniform_closure_uncertainty_helper, 2, common.correlated_variation_base_size["M"])
 
-smearing_helper, smearing_uncertainty_helper = (None, None) if args.noSmearing else muon_calibration.make_muon_smearing_helpers()
+helpers.register(["smearing_helper", "smearing_uncertainty_helper"], (lambda: (None, None)) if args.noSmearing else muon_calibration.make_muon_smearing_helpers)
 
-bias_helper = muon_calibration.make_muon_bias_helpers(args) if args.biasCalibration else None
+if args.biasCalibration:
+    helpers.register("bias_helper", muon_calibration.make_muon_bias_helpers, args)
+else:
+    helpers.register("bias_helper", lambda: None)
 
-pixel_multiplicity_helper, pixel_multiplicity_uncertainty_helper, pixel_multiplicity_uncertainty_helper_stat = muon_calibration.make_pixel_multiplicity_helpers(reverse_variations = args.reweightPixelMultiplicity)
+helpers.register(["pixel_multiplicity_helper", "pixel_multiplicity_uncertainty_helper", "pixel_multiplicity_uncertainty_helper_stat"], muon_calibration.make_pixel_multiplicity_helpers, reverse_variations = args.reweightPixelMultiplicity)
 
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
 procsWithTheoryCorr = [d.name for d in datasets if d.name in common.vprocs]
 if len(procsWithTheoryCorr):
-    corr_helpers = theory_corrections.load_corr_helpers(procsWithTheoryCorr, theory_corrs)
+    corr_helpers = theory_corrections.load_corr_helpers(procsWithTheoryCorr, theory_corrs, cache_dir=args.theoryCorrCacheDir)
 else:
     corr_helpers = {}
     
@@ -235,9 +263,9 @@ if isTheoryAgnosticPolVar:
     theoryAgnostic_helpers_plus  = makehelicityWeightHelper_polvar(genVcharge=1,  fileTag=args.theoryAgnosticFileTag, filePath=args.theoryAgnosticFilePath)
 
 # Helper for muR and muF as polynomial variations
-muRmuFPolVar_helpers_minus = makehelicityWeightHelper_polvar(genVcharge=-1, fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
-muRmuFPolVar_helpers_plus  = makehelicityWeightHelper_polvar(genVcharge=1,  fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
-muRmuFPolVar_helpers_Z     = makehelicityWeightHelper_polvar(genVcharge=0,  fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
+helpers.register("muRmuFPolVar_helpers_minus", makehelicityWeightHelper_polvar, genVcharge=-1, fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
+helpers.register("muRmuFPolVar_helpers_plus",  makehelicityWeightHelper_polvar, genVcharge=1,  fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
+helpers.register("muRmuFPolVar_helpers_Z",     makehelicityWeightHelper_polvar, genVcharge=0,  fileTag=args.muRmuFPolVarFileTag, filePath=args.muRmuFPolVarFilePath, noUL=True)
 
 # recoil initialization
 if not args.noRecoil:
@@ -266,9 +294,9 @@ def setTheoryAgnosticGraph(df, results, dataset, reco_sel_GF, era, nominal_axes_
 
     if not args.onlyMainHistograms:
         if not args.onlyTheorySyst:
-            df = syst_tools.add_L1Prefire_unc_hists(results, df, muon_prefiring_helper_stat, muon_prefiring_helper_syst, nominal_axes_thAgn, nominal_cols_thAgn, addhelicity=True)
-            df = syst_tools.add_muon_efficiency_unc_hists(results, df, muon_efficiency_helper_stat, muon_efficiency_helper_syst, nominal_axes_thAgn, nominal_cols_thAgn, what_analysis=thisAnalysis, addhelicity=True)
-        df = syst_tools.add_theory_hists(results, df, args, dataset.name, corr_helpers, qcdScaleByHelicity_helper, nominal_axes_thAgn, nominal_cols_thAgn, for_wmass=True, addhelicity=True)
+            df = syst_tools.add_L1Prefire_unc_hists(results, df, helpers.muon_prefiring_helper_stat, helpers.muon_prefiring_helper_syst, nominal_axes_thAgn, nominal_cols_thAgn, addhelicity=True)
+            df = syst_tools.add_muon_efficiency_unc_hists(results, df, helpers.muon_efficiency_helper_stat, helpers.muon_efficiency_helper_syst, nominal_axes_thAgn, nominal_cols_thAgn, what_analysis=thisAnalysis, addhelicity=True)
+        df = syst_tools.add_theory_hists(results, df, args, dataset.name, corr_helpers, helpers.qcdScaleByHelicity_helper, nominal_axes_thAgn, nominal_cols_thAgn, for_wmass=True, addhelicity=True)
     else:
         #FIXME: hardcoded to keep mass weights, this would be done in add_theory_hists
         df = syst_tools.define_mass_weights(df, dataset.name)
@@ -281,6 +309,7 @@ smearing_weights_procs = []
 
 def build_graph(df, dataset):
     logger.info(f"build graph for dataset: {dataset.name}")
+    df = skims.wrap(df, dataset)
     results = []
     isW = dataset.name in common.wprocs
     isWmunu = dataset.name in ["WplusmunuPostVFP", "WminusmunuPostVFP"]
@@ -299,8 +328,8 @@ def build_graph(df, dataset):
 
     apply_theory_corr = theory_corrs and dataset.name in corr_helpers
 
-    cvh_helper = data_calibration_helper if dataset.is_data else mc_calibration_helper
-    jpsi_helper = data_jpsi_crctn_helper if dataset.is_data else mc_jpsi_crctn_helper
+    cvh_helper = helpers.data_calibration_helper if dataset.is_data else helpers.mc_calibration_helper
+    jpsi_helper = helpers.data_jpsi_crctn_helper if dataset.is_data else helpers.mc_jpsi_crctn_helper
 
     if dataset.is_data:
         df = df.DefinePerSample("weight", "1.0")
@@ -335,7 +364,7 @@ def build_graph(df, dataset):
                 axes = [*nominal_axes, *unfolding_axes] 
                 cols = [*nominal_cols, *unfolding_cols]
             
-            unfolding_tools.add_xnorm_histograms(results, df, args, dataset.name, corr_helpers, qcdScaleByHelicity_helper, unfolding_axes, unfolding_cols)
+            unfolding_tools.add_xnorm_histograms(results, df, args, dataset.name, corr_helpers, helpers.qcdScaleByHelicity_helper, unfolding_axes, unfolding_cols)
 
     if isWorZ:
         df = theory_tools.define_prefsr_vars(df)
@@ -360,7 +389,7 @@ def build_graph(df, dataset):
                 if isFloatingPOIsTheoryAgnostic:
                     axes = [*nominal_axes, *theoryAgnostic_axes]
                     cols = [*nominal_cols, *theoryAgnostic_cols]
-                    theoryAgnostic_tools.add_xnorm_histograms(results, df, args, dataset.name, corr_helpers, qcdScaleByHelicity_helper, theoryAgnostic_axes, theoryAgnostic_cols)
+                    theoryAgnostic_tools.add_xnorm_histograms(results, df, args, dataset.name, corr_helpers, helpers.qcdScaleByHelicity_helper, theoryAgnostic_axes, theoryAgnostic_cols)
 
     if not args.makeMCefficiency and not args.noTrigger:
         # remove trigger, it will be part of the efficiency selection for passing trigger
@@ -369,7 +398,7 @@ def build_graph(df, dataset):
     if args.halfStat:
         df = df.Filter("event % 2 == 1") # test with odd/even events
 
-    df = muon_calibration.define_corrected_muons(df, cvh_helper, jpsi_helper, args, dataset, smearing_helper, bias_helper)
+    df = muon_calibration.define_corrected_muons(df, cvh_helper, jpsi_helper, args, dataset, helpers.smearing_helper, helpers.bias_helper)
 
     df = muon_selections.select_veto_muons(df, nMuons=1, useGlobalOrTrackerVeto = useGlobalOrTrackerVeto)
     df = muon_selections.select_good_muons(df, template_minpt, template_maxpt, dataset.group, nMuons=1,
@@ -425,6 +454,9 @@ def build_graph(df, dataset):
             for reco_type in ['crctd', 'cvh', 'uncrct', 'gen_smeared']:
                 df = muon_validation.define_reco_over_gen_cols(df, reco_type)
 
+    # the selected events and the columns defined so far can be written to or read from a skim
+    df = skims.checkpoint(df, dataset)
+
     df = df.Define("goodMuons_ptJet0", "Jet_pt[Muon_jetIdx[goodMuons][0]]")
 
     df = df.Define("goodMuons_relIso0", f"{isoBranch}[goodMuons][0]")
@@ -452,9 +484,9 @@ def build_graph(df, dataset):
     if dataset.is_data:
         df = df.DefinePerSample("nominal_weight", "1.0")            
     else:
-        df = df.Define("weight_pu", pileup_helper, ["Pileup_nTrueInt"])
-        df = df.Define("weight_vtx", vertex_helper, ["GenVtx_z", "Pileup_nTrueInt"])
-        df = df.Define("weight_newMuonPrefiringSF", muon_prefiring_helper, ["Muon_correctedEta", "Muon_correctedPt", "Muon_correctedPhi", "Muon_correctedCharge", "Muon_looseId"])
+        df = df.Define("weight_pu", helpers.pileup_helper, ["Pileup_nTrueInt"])
+        df = df.Define("weight_vtx", helpers.vertex_helper, ["GenVtx_z", "Pileup_nTrueInt"])
+        df = df.Define("weight_newMuonPrefiringSF", helpers.muon_prefiring_helper, ["Muon_correctedEta", "Muon_correctedPt", "Muon_correctedPhi", "Muon_correctedCharge", "Muon_looseId"])
 
         if era == "2016PostVFP":
             weight_expr = "weight_pu*weight_newMuonPrefiringSF*L1PreFiringWeight_ECAL_Nom"
@@ -472,11 +504,11 @@ def build_graph(df, dataset):
             columnsForSF.remove("goodMuons_uT0")
 
         if not isQCDMC and not args.noScaleFactors:
-            df = df.Define("weight_fullMuonSF_withTrackingReco", muon_efficiency_helper, columnsForSF)
+            df = df.Define("weight_fullMuonSF_withTrackingReco", helpers.muon_efficiency_helper, columnsForSF)
             weight_expr += "*weight_fullMuonSF_withTrackingReco"
             
             if isZveto and not args.noGenMatchMC:
-                df = df.Define("weight_vetoSF_nominal", muon_efficiency_veto_helper, ["unmatched_postfsrMuon_pt","unmatched_postfsrMuon_eta","unmatched_postfsrMuon_charge"])
+                df = df.Define("weight_vetoSF_nominal", helpers.muon_efficiency_veto_helper, ["unmatched_postfsrMuon_pt","unmatched_postfsrMuon_eta","unmatched_postfsrMuon_charge"])
                 weight_expr += "*weight_vetoSF_nominal"
 
         # prepare inputs for pixel multiplicity helpers
@@ -491,7 +523,7 @@ def build_graph(df, dataset):
         pixel_multiplicity_cols = ["goodMuons_triggerCat", "goodMuons_eta", "goodMuons_pt", "goodMuons_charge", f"goodMuons_{cvhName}NValidPixelHits"]
 
         if args.reweightPixelMultiplicity:
-            df = df.Define("weight_pixel_multiplicity", pixel_multiplicity_helper, pixel_multiplicity_cols)
+            df = df.Define("weight_pixel_multiplicity", helpers.pixel_multiplicity_helper, pixel_multiplicity_cols)
             weight_expr += "*weight_pixel_multiplicity"
             
         logger.debug(f"Exp weight defined: {weight_expr}")
@@ -633,19 +665,20 @@ def build_graph(df, dataset):
         results.append(df.HistoBoost("nominal", axes, [*cols, "nominal_weight_helicity"], tensor_axes=[axis_helicity]))
         setTheoryAgnosticGraph(df, results, dataset, reco_sel_GF, era, axes, cols, args)
         # End graph here only for standard theory agnostic analysis, otherwise use same loop as traditional analysis
+        skims.book(dataset)
         return results, weightsum
 
     if isWorZ and not hasattr(dataset, "out_of_acceptance"):
         theoryAgnostic_helpers_cols = ["qtOverQ", "absYVgen", "chargeVgen", "csSineCosThetaPhigen", "nominal_weight"]
         # assume to have same coeffs for plus and minus (no reason for it not to be the case)
         if dataset.name == "WplusmunuPostVFP" or dataset.name == "WplustaunuPostVFP":
-            helpers_class = muRmuFPolVar_helpers_plus
+            helpers_class = helpers.muRmuFPolVar_helpers_plus
             process_name = "W"
         elif dataset.name == "WminusmunuPostVFP" or dataset.name == "WminustaunuPostVFP":
-            helpers_class = muRmuFPolVar_helpers_minus
+            helpers_class = helpers.muRmuFPolVar_helpers_minus
             process_name = "W"
         elif dataset.name == "ZmumuPostVFP" or dataset.name == "ZtautauPostVFP":
-            helpers_class = muRmuFPolVar_helpers_Z
+            helpers_class = helpers.muRmuFPolVar_helpers_Z
             process_name = "Z"
         for coeffKey in helpers_class.keys():
             logger.debug(f"Creating muR/muF histograms with polynomial variations for {coeffKey}")
@@ -689,15 +722,15 @@ def build_graph(df, dataset):
 
         if not args.onlyTheorySyst:
             if not isQCDMC and not args.noScaleFactors:
-                df = syst_tools.add_muon_efficiency_unc_hists(results, df, muon_efficiency_helper_stat, muon_efficiency_helper_syst, axes, cols, 
+                df = syst_tools.add_muon_efficiency_unc_hists(results, df, helpers.muon_efficiency_helper_stat, helpers.muon_efficiency_helper_syst, axes, cols, 
                                                               what_analysis=thisAnalysis, smooth3D=args.smooth3dsf, storage_type=storage_type)
                 for es in common.muonEfficiency_altBkgSyst_effSteps:
-                    df = syst_tools.add_muon_efficiency_unc_hists_altBkg(results, df, muon_efficiency_helper_syst_altBkg[es], axes, cols, 
+                    df = syst_tools.add_muon_efficiency_unc_hists_altBkg(results, df, helpers.muon_efficiency_helper_syst_altBkg[es], axes, cols, 
                                                                          what_analysis=thisAnalysis, step=es, storage_type=storage_type)
                 if isZveto and not args.noGenMatchMC:
-                    df = syst_tools.add_muon_efficiency_veto_unc_hists(results, df, muon_efficiency_veto_helper_stat, muon_efficiency_veto_helper_syst, axes, cols, storage_type=storage_type)
+                    df = syst_tools.add_muon_efficiency_veto_unc_hists(results, df, helpers.muon_efficiency_veto_helper_stat, helpers.muon_efficiency_veto_helper_syst, axes, cols, storage_type=storage_type)
 
-            df = syst_tools.add_L1Prefire_unc_hists(results, df, muon_prefiring_helper_stat, muon_prefiring_helper_syst, axes, cols, storage_type=storage_type)
+            df = syst_tools.add_L1Prefire_unc_hists(results, df, helpers.muon_prefiring_helper_stat, helpers.muon_prefiring_helper_syst, axes, cols, storage_type=storage_type)
             # luminosity, as shape variation despite being a flat scaling to facilitate propagation to fakes
             df = syst_tools.add_luminosity_unc_hists(results, df, args, axes, cols, storage_type=storage_type)
 
@@ -706,7 +739,7 @@ def build_graph(df, dataset):
 
         if isWorZ:
 
-            df = syst_tools.add_theory_hists(results, df, args, dataset.name, corr_helpers, qcdScaleByHelicity_helper, axes, cols, for_wmass=True, storage_type=storage_type)
+            df = syst_tools.add_theory_hists(results, df, args, dataset.name, corr_helpers, helpers.qcdScaleByHelicity_helper, axes, cols, for_wmass=True, storage_type=storage_type)
 
             # Don't think it makes sense to apply the mass weights to scale leptons from tau decays
             if not args.onlyTheorySyst and not "tau" in dataset.name:
@@ -725,70 +758,70 @@ def build_graph(df, dataset):
                     f"{reco_sel_GF}_genEta",
                     f"{reco_sel_GF}_genCharge"
                 ]
-                if diff_weights_helper:
-                    df = df.Define(f'{reco_sel_GF}_response_weight', diff_weights_helper, [*input_kinematics])
+                if helpers.diff_weights_helper:
+                    df = df.Define(f'{reco_sel_GF}_response_weight', helpers.diff_weights_helper, [*input_kinematics])
                     input_kinematics.append(f'{reco_sel_GF}_response_weight')
 
                 # muon scale variation from stats. uncertainty on the jpsi massfit
                 df = muon_calibration.add_jpsi_crctn_stats_unc_hists(
                     args, df, axes, results, cols, cols_gen_smeared,
-                    calib_filepaths, jpsi_crctn_data_unc_helper, smearing_weights_procs,
+                    calib_filepaths, helpers.jpsi_crctn_data_unc_helper, smearing_weights_procs,
                     reco_sel_GF, dataset.name, isW, storage_type=storage_type
                 )
                 # add the ad-hoc Z non-closure nuisances from the jpsi massfit to muon scale unc
                 df = muon_calibration.add_jpsi_crctn_Z_non_closure_hists(
                     args, df, axes, results, cols, cols_gen_smeared,
-                    z_non_closure_parametrized_helper, z_non_closure_binned_helper, reco_sel_GF, storage_type=storage_type
+                    helpers.z_non_closure_parametrized_helper, helpers.z_non_closure_binned_helper, reco_sel_GF, storage_type=storage_type
                 )
                 # add nuisances from the data/MC resolution mismatch
-                df = muon_calibration.add_resolution_uncertainty(df, axes, results, cols, smearing_uncertainty_helper, reco_sel_GF, storage_type=storage_type)
+                df = muon_calibration.add_resolution_uncertainty(df, axes, results, cols, helpers.smearing_uncertainty_helper, reco_sel_GF, storage_type=storage_type)
                 if args.validationHists:
                     df = muon_validation.make_hists_for_muon_scale_var_weights(
                         df, axes, results, cols, cols_gen_smeared
                     )
 
                 # add pixel multiplicity uncertainties
-                df = df.Define("nominal_pixelMultiplicitySyst_tensor", pixel_multiplicity_uncertainty_helper, [*pixel_multiplicity_cols, "nominal_weight"])
-                hist_pixelMultiplicitySyst = df.HistoBoost("nominal_pixelMultiplicitySyst", axes, [*cols, "nominal_pixelMultiplicitySyst_tensor"], tensor_axes = pixel_multiplicity_uncertainty_helper.tensor_axes, storage=hist.storage.Double())
+                df = df.Define("nominal_pixelMultiplicitySyst_tensor", helpers.pixel_multiplicity_uncertainty_helper, [*pixel_multiplicity_cols, "nominal_weight"])
+                hist_pixelMultiplicitySyst = df.HistoBoost("nominal_pixelMultiplicitySyst", axes, [*cols, "nominal_pixelMultiplicitySyst_tensor"], tensor_axes = helpers.pixel_multiplicity_uncertainty_helper.tensor_axes, storage=hist.storage.Double())
                 results.append(hist_pixelMultiplicitySyst)
 
                 if args.pixelMultiplicityStat:
-                    df = df.Define("nominal_pixelMultiplicityStat_tensor", pixel_multiplicity_uncertainty_helper_stat, [*pixel_multiplicity_cols, "nominal_weight"])
-                    hist_pixelMultiplicityStat = df.HistoBoost("nominal_pixelMultiplicityStat", axes, [*cols, "nominal_pixelMultiplicityStat_tensor"], tensor_axes = pixel_multiplicity_uncertainty_helper_stat.tensor_axes, storage=hist.storage.Double())
+                    df = df.Define("nominal_pixelMultiplicityStat_tensor", helpers.pixel_multiplicity_uncertainty_helper_stat, [*pixel_multiplicity_cols, "nominal_weight"])
+                    hist_pixelMultiplicityStat = df.HistoBoost("nominal_pixelMultiplicityStat", axes, [*cols, "nominal_pixelMultiplicityStat_tensor"], tensor_axes = helpers.pixel_multiplicity_uncertainty_helper_stat.tensor_axes, storage=hist.storage.Double())
                     results.append(hist_pixelMultiplicityStat)
 
                 # extra uncertainties from non-closure stats
-                df = df.Define("muonScaleClosSyst_responseWeights_tensor_splines", closure_unc_helper,
+                df = df.Define("muonScaleClosSyst_responseWeights_tensor_splines", helpers.closure_unc_helper,
                     [*input_kinematics, "nominal_weight"]
                 )
                 nominal_muonScaleClosSyst_responseWeights = df.HistoBoost(
                     "nominal_muonScaleClosSyst_responseWeights", axes,
                     [*cols, "muonScaleClosSyst_responseWeights_tensor_splines"],
-                    tensor_axes = closure_unc_helper.tensor_axes,
+                    tensor_axes = helpers.closure_unc_helper.tensor_axes,
                     storage = hist.storage.Double()
                 )
                 results.append(nominal_muonScaleClosSyst_responseWeights)
 
                 # extra uncertainties for A (fully correlated)
-                df = df.Define("muonScaleClosASyst_responseWeights_tensor_splines", closure_unc_helper_A,
+                df = df.Define("muonScaleClosASyst_responseWeights_tensor_splines", helpers.closure_unc_helper_A,
                     [*input_kinematics, "nominal_weight"]
                 )
                 nominal_muonScaleClosASyst_responseWeights = df.HistoBoost(
                     "nominal_muonScaleClosASyst_responseWeights", axes,
                     [*cols, "muonScaleClosASyst_responseWeights_tensor_splines"],
-                    tensor_axes = closure_unc_helper_A.tensor_axes,
+                    tensor_axes = helpers.closure_unc_helper_A.tensor_axes,
                     storage = hist.storage.Double()
                 )
                 results.append(nominal_muonScaleClosASyst_responseWeights)
 
                 # extra uncertainties for M (fully correlated)
-                df = df.Define("muonScaleClosMSyst_responseWeights_tensor_splines", closure_unc_helper_M,
+                df = df.Define("muonScaleClosMSyst_responseWeights_tensor_splines", helpers.closure_unc_helper_M,
                     [*input_kinematics, "nominal_weight"]
                 )
                 nominal_muonScaleClosMSyst_responseWeights = df.HistoBoost(
                     "nominal_muonScaleClosMSyst_responseWeights", axes,
                     [*cols, "muonScaleClosMSyst_responseWeights_tensor_splines"],
-                    tensor_axes = closure_unc_helper_M.tensor_axes,
+                    tensor_axes = helpers.closure_unc_helper_M.tensor_axes,
                     storage = hist.storage.Double()
                 )
                 results.append(nominal_muonScaleClosMSyst_responseWeights)
@@ -797,6 +830,9 @@ def build_graph(df, dataset):
 
             df = df.Define("Muon_cvhMomCov", "wrem::splitNestedRVec(Muon_cvhMomCov_Vals, Muon_cvhMomCov_Counts)")
 
+    # the skim is written with the columns read by the graph
+    skims.book(dataset)
+
     if hasattr(dataset, "out_of_acceptance"):
         # Rename dataset to not overwrite the original one
         if len(smearing_weights_procs) > 0 and smearing_weights_procs[-1] == dataset.name:
@@ -810,9 +846,19 @@ if args.sequentialEventLoops:
 else:
     dataset_sets = [datasets]
 
-for loop_datasets in dataset_sets:
-    resultdict = narf.build_and_run(loop_datasets, build_graph)
-    if not args.onlyMainHistograms and args.muonScaleVariation == 'smearingWeightsGaus' and not isFloatingPOIsTheoryAgnostic:
+if args.profileGraph:
+    profiler = GraphProfiler()
+    build_graph = profiler.wrap_build_graph(build_graph)
+
+def postprocess(loop_datasets, resultdict):
+    skims.finalize(resultdict)
+    helpers.report()
+    cling_cache.record_instantiations([helpers.built_helpers(), corr_helpers])
+    extra_meta_info = {"graph_profile": profiler.report()} if args.profileGraph else None
+    if args.shard and not args.onlyMainHistograms and args.muonScaleVariation == 'smearingWeightsGaus' and not isFloatingPOIsTheoryAgnostic:
+        # the transport uses ratios of histograms and is only correct after summing the shards
+        logger.warning(f"Smearing weights are not transported for partial outputs, use 'hadd_hdf5.py --transportSmearingWeights {' '.join(smearing_weights_procs)}' to merge the shards")
+    elif not args.onlyMainHistograms and args.muonScaleVariation == 'smearingWeightsGaus' and not isFloatingPOIsTheoryAgnostic:
         logger.debug("Apply smearingWeights")
         muon_calibration.transport_smearing_weights_to_reco(
             resultdict,
@@ -822,12 +868,17 @@ for loop_datasets in dataset_sets:
     if args.validationHists:
         muon_validation.muon_scale_variation_from_manual_shift(resultdict)
 
-    if not args.noScaleToData and not args.sequentialEventLoops:
+    if args.shard:
+        # partial output, scaling and aggregation is done when merging the shards
+        add_dataset_groups(loop_datasets, resultdict)
+    elif not args.noScaleToData and not args.sequentialEventLoops:
         scale_to_data(resultdict)
         aggregate_groups(loop_datasets, resultdict, groups_to_aggregate)
 
     fout = f"{os.path.basename(__file__).replace('py', 'hdf5')}"
-    fout = output_tools.write_analysis_output(resultdict, fout, args)
+    fout = output_tools.write_analysis_output(resultdict, fout, args, extra_meta_info=extra_meta_info)
     if not args.appendOutputFile:
         args.appendOutputFile = fout
-    resultdict = None
+
+for loop_datasets in dataset_sets:
+    multi_config.build_and_run(loop_datasets, build_graph, postprocess)
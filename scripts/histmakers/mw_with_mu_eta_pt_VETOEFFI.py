@@ -84,7 +84,7 @@ bias_helper = muon_calibration.make_muon_bias_helpers(args) if args.biasCalibrat
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
 procsWithTheoryCorr = [d.name for d in datasets if d.name in common.vprocs]
 if len(procsWithTheoryCorr):
-    corr_helpers = theory_corrections.load_corr_helpers(procsWithTheoryCorr, theory_corrs)
+    corr_helpers = theory_corrections.load_corr_helpers(procsWithTheoryCorr, theory_corrs, cache_dir=args.theoryCorrCacheDir)
 else:
     corr_helpers = {}
 
@@ -2,6 +2,7 @@ from utilities import boostHistHelpers as hh, common, logging, differential
 from utilities.io_tools import output_tools
 from wremnants.datasets.datagroups import Datagroups
 import os
+import sys
 
 analysis_label = Datagroups.analysisLabel(os.path.basename(__file__))
 parser,initargs = common.common_parser(analysis_label)
@@ -11,8 +12,12 @@ import narf
 import wremnants
 from wremnants import (theory_tools,syst_tools,theory_corrections, muon_validation, muon_calibration, muon_prefiring, muon_selections, unfolding_tools, 
     muon_efficiencies_binned, muon_efficiencies_smooth, pileup, vertex)
-from wremnants.histmaker_tools import scale_to_data, aggregate_groups
-from wremnants.datasets.dataset_tools import getDatasets
+from wremnants.graph_profiler import GraphProfiler
+from wremnants.skim_tools import EventSkims
+from wremnants import multi_config
+from wremnants import cling_cache
+from wremnants.histmaker_tools import scale_to_data, aggregate_groups, add_dataset_groups
+from wremnants.datasets.dataset_tools import getDatasets, shard_datasets
 import hist
 import lz4.frame
 import math
@@ -32,14 +37,19 @@ parser = common.set_parser_default(parser, "aggregateGroups", ["Diboson", "Top",
 parser = common.set_parser_default(parser, "excludeProcs", ["QCD"])
 parser = common.set_parser_default(parser, "pt", common.get_default_ptbins(analysis_label))
 
-args = parser.parse_args()
+args = multi_config.parse_args(parser)
 isUnfolding = args.analysisMode == "unfolding"
 isPoiAsNoi = isUnfolding and args.poiAsNoi
 
-args = parser.parse_args()
+args = multi_config.parse_args(parser)
 
 logger = logging.setup_logger(__file__, args.verbose, args.noColorLogger)
 
+if args.configs:
+    # process all configurations in a single event loop, the script is run once per configuration up to the event loop
+    multi_config.run_configs(__file__, args.configs, args)
+    sys.exit()
+
 
 thisAnalysis = ROOT.wrem.AnalysisType.Dilepton if args.useDileptonTriggerSelection else ROOT.wrem.AnalysisType.Wlike
 isoBranch = muon_selections.getIsoBranch(args.isolationDefinition)
@@ -52,6 +62,12 @@ datasets = getDatasets(maxFiles=args.maxFiles,
                        extended = "msht20an3lo" not in args.pdfs,
                        era = era)
 
+if args.shard:
+    datasets = shard_datasets(datasets, args.shard)
+
+skims = EventSkims(args)
+datasets = skims.use_skims(datasets)
+
 # dilepton invariant mass cuts
 mass_min, mass_max = common.get_default_mz_window()
 
@@ -167,10 +183,11 @@ pixel_multiplicity_helper, pixel_multiplicity_uncertainty_helper, pixel_multipli
 
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
-corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs], theory_corrs)
+corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs], theory_corrs, cache_dir=args.theoryCorrCacheDir)
 
 def build_graph(df, dataset):
     logger.info(f"build graph for dataset: {dataset.name}")
+    df = skims.wrap(df, dataset)
     results = []
     isW = dataset.name in common.wprocs
     isZ = dataset.name in common.zprocs
@@ -267,7 +284,10 @@ def build_graph(df, dataset):
         df = df.Define("muonsPlus_eta0",  "trigMuon_isNegative ? nonTrigMuons_eta0 : trigMuons_eta0")
         df = df.Define("muonsMinus_mom4", "trigMuon_isNegative ? trigMuons_mom4 : nonTrigMuons_mom4")
         df = df.Define("muonsPlus_mom4",  "trigMuon_isNegative ? nonTrigMuons_mom4 : trigMuons_mom4")
-    
+
+    # the selected events and the columns defined so far can be written to or read from a skim
+    df = skims.checkpoint(df, dataset)
+
     df = df.Define("ptll", "ll_mom4.pt()")
     df = df.Define("yll", "ll_mom4.Rapidity()")
     df = df.Define("absYll", "std::fabs(yll)")
@@ -598,6 +618,9 @@ def build_graph(df, dataset):
                     results, df, args.muonCorrEtaBins, args.muonCorrMag, isW, axes, cols,
                     muon_eta="trigMuons_eta0") ## FIXME: what muon to choose ?
 
+    # the skim is written with the columns read by the graph
+    skims.book(dataset)
+
     if hasattr(dataset, "out_of_acceptance"):
         # Rename dataset to not overwrite the original one
         dataset.name = dataset.name+"OOA"
@@ -605,10 +628,32 @@ def build_graph(df, dataset):
     return results, weightsum
 
 logger.debug(f"Datasets are {[d.name for d in datasets]}")
-resultdict = narf.build_and_run(datasets, build_graph)
-
-if not args.noScaleToData:
-    scale_to_data(resultdict)
-    aggregate_groups(datasets, resultdict, args.aggregateGroups)
-
-output_tools.write_analysis_output(resultdict, f"{os.path.basename(__file__).replace('py', 'hdf5')}", args)
+if args.profileGraph:
+    profiler = GraphProfiler()
+    build_graph = profiler.wrap_build_graph(build_graph)
+
+def postprocess(datasets, resultdict):
+    skims.finalize(resultdict)
+    cling_cache.record_instantiations([
+        muon_prefiring_helper, muon_prefiring_helper_stat, muon_prefiring_helper_syst, qcdScaleByHelicity_helper,
+        muon_efficiency_helper, muon_efficiency_helper_syst, muon_efficiency_helper_stat, muon_efficiency_helper_syst_altBkg,
+        pileup_helper, vertex_helper, diff_weights_helper,
+        mc_jpsi_crctn_helper, data_jpsi_crctn_helper, mc_jpsi_crctn_unc_helper, data_jpsi_crctn_unc_helper,
+        z_non_closure_parametrized_helper, z_non_closure_binned_helper,
+        mc_calibration_helper, data_calibration_helper, calibration_uncertainty_helper,
+        closure_unc_helper, closure_unc_helper_A, closure_unc_helper_M, smearing_helper, smearing_uncertainty_helper,
+        smearinggradhelper, bias_helper,
+        pixel_multiplicity_helper, pixel_multiplicity_uncertainty_helper, pixel_multiplicity_uncertainty_helper_stat, corr_helpers,
+    ])
+    extra_meta_info = {"graph_profile": profiler.report()} if args.profileGraph else None
+
+    if args.shard:
+        # partial output, scaling and aggregation is done when merging the shards
+        add_dataset_groups(datasets, resultdict)
+    elif not args.noScaleToData:
+        scale_to_data(resultdict)
+        aggregate_groups(datasets, resultdict, args.aggregateGroups)
+
+    output_tools.write_analysis_output(resultdict, f"{os.path.basename(__file__).replace('py', 'hdf5')}", args, extra_meta_info=extra_meta_info)
+
+multi_config.build_and_run(datasets, build_graph, postprocess)
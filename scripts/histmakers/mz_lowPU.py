@@ -92,7 +92,7 @@ axes_mT = [axis_mt]
 cols_mT = ["transverseMass"]
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
-corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs_lowpu], theory_corrs)
+corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs_lowpu], theory_corrs, cache_dir=args.theoryCorrCacheDir)
 
 # recoil initialization
 args.noRecoil = True
@@ -3,6 +3,7 @@ from utilities.io_tools import output_tools
 from utilities.common import data_dir
 from wremnants.datasets.datagroups import Datagroups
 import os
+import sys
 
 analysis_label = Datagroups.analysisLabel(os.path.basename(__file__))
 parser,initargs = common.common_parser(analysis_label)
@@ -11,8 +12,12 @@ import ROOT
 import narf
 from wremnants import (theory_tools,syst_tools,theory_corrections, muon_validation, muon_calibration, muon_selections, muon_prefiring, 
     muon_efficiencies_binned, muon_efficiencies_smooth, unfolding_tools, theoryAgnostic_tools, helicity_utils, pileup, vertex)
-from wremnants.histmaker_tools import scale_to_data, aggregate_groups
-from wremnants.datasets.dataset_tools import getDatasets
+from wremnants.graph_profiler import GraphProfiler
+from wremnants.skim_tools import EventSkims
+from wremnants import multi_config
+from wremnants import cling_cache
+from wremnants.histmaker_tools import scale_to_data, aggregate_groups, add_dataset_groups
+from wremnants.datasets.dataset_tools import getDatasets, shard_datasets
 from wremnants.helicity_utils_polvar import makehelicityWeightHelper_polvar 
 import hist
 import lz4.frame
@@ -29,7 +34,12 @@ logger = logging.setup_logger(__file__, initargs.verbose, initargs.noColorLogger
 parser = common.set_parser_default(parser, "aggregateGroups", ["Diboson", "Top", "Wtaunu", "Wmunu"])
 parser = common.set_parser_default(parser, "excludeProcs", ["QCD"])
 
-args = parser.parse_args()
+args = multi_config.parse_args(parser)
+
+if args.configs:
+    # process all configurations in a single event loop, the script is run once per configuration up to the event loop
+    multi_config.run_configs(__file__, args.configs, args)
+    sys.exit()
 
 isUnfolding = args.analysisMode == "unfolding"
 isPoiAsNoi = isUnfolding and args.poiAsNoi
@@ -45,6 +55,12 @@ datasets = getDatasets(maxFiles=args.maxFiles,
                        extended = "msht20an3lo" not in args.pdfs,
                        era=era)
 
+if args.shard:
+    datasets = shard_datasets(datasets, args.shard)
+
+skims = EventSkims(args)
+datasets = skims.use_skims(datasets)
+
 # dilepton invariant mass cuts
 mass_min, mass_max = common.get_default_mz_window()
 
@@ -126,7 +142,7 @@ bias_helper = muon_calibration.make_muon_bias_helpers(args) if args.biasCalibrat
 pixel_multiplicity_helper, pixel_multiplicity_uncertainty_helper, pixel_multiplicity_uncertainty_helper_stat = muon_calibration.make_pixel_multiplicity_helpers(reverse_variations = args.reweightPixelMultiplicity)
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
-corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs], theory_corrs)
+corr_helpers = theory_corrections.load_corr_helpers([d.name for d in datasets if d.name in common.vprocs], theory_corrs, cache_dir=args.theoryCorrCacheDir)
 
 # helpers for muRmuF MiNNLO polynomial variations
 
@@ -142,6 +158,7 @@ if not args.noRecoil:
 
 def build_graph(df, dataset):
     logger.info(f"build graph for dataset: {dataset.name}")
+    df = skims.wrap(df, dataset)
     results = []
     isW = dataset.name in common.wprocs
     isZ = dataset.name in common.zprocs
@@ -212,6 +229,9 @@ def build_graph(df, dataset):
 
     df = muon_selections.apply_triggermatching_muon(df, dataset, "trigMuons", era=era)
 
+    # the selected events and the columns defined so far can be written to or read from a skim
+    df = skims.checkpoint(df, dataset)
+
     if dataset.is_data:
         df = df.DefinePerSample("nominal_weight", "1.0")
     else:
@@ -493,16 +513,41 @@ def build_graph(df, dataset):
 
             ####################################################
 
+    # the skim is written with the columns read by the graph
+    skims.book(dataset)
+
     if hasattr(dataset, "out_of_acceptance"):
         # Rename dataset to not overwrite the original one
         dataset.name = dataset.name+"OOA"
 
     return results, weightsum
 
-resultdict = narf.build_and_run(datasets, build_graph)
-
-if not args.noScaleToData:
-    scale_to_data(resultdict)
-    aggregate_groups(datasets, resultdict, args.aggregateGroups)
-
-output_tools.write_analysis_output(resultdict, f"{os.path.basename(__file__).replace('py', 'hdf5')}", args)
+if args.profileGraph:
+    profiler = GraphProfiler()
+    build_graph = profiler.wrap_build_graph(build_graph)
+
+def postprocess(datasets, resultdict):
+    skims.finalize(resultdict)
+    cling_cache.record_instantiations([
+        muon_prefiring_helper, muon_prefiring_helper_stat, muon_prefiring_helper_syst, qcdScaleByHelicity_helper,
+        muon_efficiency_helper, muon_efficiency_helper_syst, muon_efficiency_helper_stat, muon_efficiency_helper_syst_altBkg,
+        pileup_helper, vertex_helper, diff_weights_helper,
+        mc_jpsi_crctn_helper, data_jpsi_crctn_helper, mc_jpsi_crctn_unc_helper, data_jpsi_crctn_unc_helper,
+        z_non_closure_parametrized_helper, z_non_closure_binned_helper,
+        mc_calibration_helper, data_calibration_helper, calibration_uncertainty_helper,
+        closure_unc_helper, closure_unc_helper_A, closure_unc_helper_M, smearing_helper, smearing_uncertainty_helper, bias_helper,
+        pixel_multiplicity_helper, pixel_multiplicity_uncertainty_helper, pixel_multiplicity_uncertainty_helper_stat, corr_helpers,
+        muRmuFPolVar_helpers_minus, muRmuFPolVar_helpers_plus, muRmuFPolVar_helpers_Z,
+    ])
+    extra_meta_info = {"graph_profile": profiler.report()} if args.profileGraph else None
+
+    if args.shard:
+        # partial output, scaling and aggregation is done when merging the shards
+        add_dataset_groups(datasets, resultdict)
+    elif not args.noScaleToData:
+        scale_to_data(resultdict)
+        aggregate_groups(datasets, resultdict, args.aggregateGroups)
+
+    output_tools.write_analysis_output(resultdict, f"{os.path.basename(__file__).replace('py', 'hdf5')}", args, extra_meta_info=extra_meta_info)
+
+multi_config.build_and_run(datasets, build_graph, postprocess)
@@ -102,7 +102,7 @@ axis_absetal_gen = hist.axis.Regular(24, 0, 2.4, name = "abseta")
 axis_ptl_gen = hist.axis.Regular(34, 26., 60., name = "pt")
 
 theory_corrs = [*args.theoryCorr, *args.ewTheoryCorr]
-corr_helpers = theory_corrections.load_corr_helpers(common.vprocs, theory_corrs)
+corr_helpers = theory_corrections.load_corr_helpers(common.vprocs, theory_corrs, cache_dir=args.theoryCorrCacheDir)
 
 def build_graph(df, dataset):
     logger.info("build graph")
@@ -35,6 +35,7 @@ parser.add_argument("--select", type=int, nargs="*", default=[],
     help="Select specific bins of the selectionAxis e.g. '0 1' to select the first bin of the first axis and second bin of the second axis")
 parser.add_argument("--hists", type=str, nargs='*', default=None, 
     help="List of hists to plot; dash separated for unrolled hists")
+parser.add_argument("--jobs", type=int, default=1, help="Number of processes to make the plots in parallel")
 
 # variations
 parser.add_argument("--varName", type=str, nargs='*', default=[], help="Name of variation hist")
@@ -64,6 +65,9 @@ add_ratio=not args.noRatio
 
 outdir = output_tools.make_plot_dir(args.outpath, args.outfolder, eoscp=args.eoscp)
 
+# independent plots, made right away or at the end in parallel with --jobs
+plot_tasks = plot_tools.PlotTasks(args.jobs)
+
 
 def make_plots(hists_proc, hist_data, *opts, **info):
     # make full unrollsed plot and lower dimensional projections
@@ -88,11 +92,12 @@ def make_plots(hists_proc, hist_data, *opts, **info):
         
         logger.info(f"Make plot(s) with axes {axes_names}")
 
-        make_plot(hists_proc, hist_data, axes_names=axes_names, *opts, **info)
+        plot_tasks.add(make_plot, hists_proc, hist_data, *opts, axes_names=axes_names, **info)
 
 
 def make_plot(hists_proc, hist_data, hists_syst_up, hists_syst_dn, axes_names, 
-    selections=None, selection_edges=None, channel="", colors=[], labels=[], procs=[], rlabel="1/Pred.", density=False, legtext_size=20
+    selections=None, selection_edges=None, channel="", colors=[], labels=[], procs=[], rlabel="1/Pred.", density=False, legtext_size=20,
+    lumi=None
 ):
     if any(x in axes_names for x in ["ptll", "mll", "ptVgen", "ptVGen"]):
         # in case of variable bin width normalize to unit
@@ -123,6 +128,7 @@ def make_plot(hists_proc, hist_data, hists_syst_up, hists_syst_dn, axes_names,
     else:
         hists_pred = [hh.sumHists(h_stack)]
 
+    outfiles = []
     # loop over all processes if plots for each process is requested, or inclusive otherwise
     for i, h_pred in enumerate(hists_pred):
 
@@ -274,9 +280,7 @@ def make_plot(hists_proc, hist_data, hists_syst_up, hists_syst_dn, axes_names,
         # offset_text.set_position((-0.08,1.02))
 
         if args.cmsDecor:
-            lumi = float(f"{channel_info['lumi']:.3g}") if not density else None
-            
-            hep.cms.label(ax=ax1, lumi=lumi, fontsize=legtext_size*scale, 
+            hep.cms.label(ax=ax1, lumi=float(f"{lumi:.3g}") if not density else None, fontsize=legtext_size*scale, 
                 label= args.cmsDecor, data=hist_data is not None)
 
         outfile = "hist_"
@@ -291,14 +295,9 @@ def make_plot(hists_proc, hist_data, hists_syst_up, hists_syst_dn, axes_names,
         if args.postfix:
             outfile += f"_{args.postfix}"
         plot_tools.save_pdf_and_png(outdir, outfile)
+        outfiles.append(outfile)
 
-        # stack_yields = 
-        # unstacked_yields = 
-        plot_tools.write_index_and_log(outdir, outfile, 
-            # yield_tables={"Stacked processes" : stack_yields, "Unstacked processes" : unstacked_yields},
-            analysis_meta_info={"setupCombine" : indata.metadata["meta_info"]},
-            args=args,
-        )
+    return outfiles
 
 
 for channel, channel_info in indata.channel_info.items():
@@ -339,7 +338,7 @@ for channel, channel_info in indata.channel_info.items():
         hist_data.values(flow=True)[...] = hist_data_tmp.values(flow=True)
         hist_data.variances(flow=True)[...] = hist_data_tmp.values(flow=True)
 
-    info = dict(channel=channel, labels=labels,colors=colors, procs=procs)
+    info = dict(channel=channel, labels=labels,colors=colors, procs=procs, lumi=channel_info['lumi'])
 
     # make plots in slices (e.g. for charge plus an minus separately)
     selection_axes = [hists_proc[0].axes[n] for n in args.selectionAxes if n in hists_proc[0].axes.name]
@@ -370,5 +369,15 @@ for channel, channel_info in indata.channel_info.items():
     else:
         make_plots(hists_proc, hist_data, hists_syst_dn, hists_syst_up, **info)
 
+# the index and logs are written once all plots are made
+for outfile in itertools.chain(*plot_tasks.run()):
+    # stack_yields = 
+    # unstacked_yields = 
+    plot_tools.write_index_and_log(outdir, outfile, 
+        # yield_tables={"Stacked processes" : stack_yields, "Unstacked processes" : unstacked_yields},
+        analysis_meta_info={"setupCombine" : indata.metadata["meta_info"]},
+        args=args,
+    )
+
 if output_tools.is_eosuser_path(args.outpath) and args.eoscp:
     output_tools.copy_to_eos(outdir, args.outpath, args.outfolder)
@@ -161,9 +161,26 @@ if args.noData:
 # TODO: In should select the correct hist for the transform, not just the first
 transforms = syst_tools.syst_transform_map(nominalName, args.hists[0])
 
+def pairedVariationOp(proc, name, entry, tmap, requested, pending):
+    # the variations of a pair (e.g. up and down of a pdf set) are computed together when the histogram is loaded
+    #   for the first of them, the other one is kept until it is loaded
+    def op(h):
+        key = (proc, name, entry)
+        if key in pending:
+            return pending.pop(key)
+        hvars = tmap["variations"](h)
+        for other, hvar in zip(tmap["pair"], hvars):
+            if other != entry and (other, name) in requested:
+                pending[(proc, name, other)] = hvar
+        return hvars[tmap["pair"].index(entry)]
+    return op
+
 if addVariation:
     logger.info(f"Adding variation {args.varName}")
     varLabels = padArray(args.varLabel, args.varName)
+    # transforms and histograms of the variations, for the transforms that compute pairs of variations
+    requested = set(zip(entries, [n if n != "" else nominalName for n in args.varName]))
+    pendingVariations = {}
     # If none matplotlib will pick a random color
     ncols = len(args.varName) if not args.doubleColors else int(len(args.varName)/2)
     colors = args.colors if args.colors else [colormaps["tab10" if ncols < 10 else "tab20"](int(i/2) if args.doubleColors else i) for i in range(len(args.varName))]
@@ -193,7 +210,10 @@ if addVariation:
                 varname = name+str(entry)
 
             if not requiresNominal:
-                load_op = {p : action for p in transform_procs}
+                if do_transform and "variations" in tmap:
+                    load_op = {p : pairedVariationOp(p, name, entry, tmap, requested, pendingVariations) for p in transform_procs}
+                else:
+                    load_op = {p : action for p in transform_procs}
         else:
             varname = name
 
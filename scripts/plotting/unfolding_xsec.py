@@ -35,6 +35,7 @@ parser.add_argument("--plots", type=str, nargs="+", default=["xsec", "uncertaint
 parser.add_argument("--selectionAxes", type=str, default=["qGen", "helicitySig", "A"], 
     help="List of axes where for each bin a seperate plot is created")
 parser.add_argument("--genFlow", action='store_true', help="Show overflow/underflow pois")
+parser.add_argument("--jobs", type=int, default=1, help="Number of processes to make the plots in parallel")
 parser.add_argument("--poiTypes", type=str, nargs="+", default=["pmaskedexp", "sumpois"], help="POI types used for the plotting",
     choices=poi_type_choices)
 # specify a reference unfolding
@@ -84,6 +85,9 @@ if args.translate:
 
 outdir = output_tools.make_plot_dir(args.outpath, args.outfolder, eoscp=args.eoscp)
 
+# independent plots, made right away or at the end in parallel with --jobs
+plot_tasks = plot_tools.PlotTasks(args.jobs)
+
 if args.histfile:
     groups = Datagroups(args.histfile)
     groups.setNominalName(args.baseName)
@@ -277,12 +281,8 @@ def plot_xsec_unfolded(hist_xsec, hist_xsec_stat=None, hist_ref=None, poi_type="
         reference_yields = make_yields_df([hist_ref], ["Model"], per_bin=True)
         reference_yields["Uncertainty"] *= 0 # artificially set uncertainty on model hard coded to 0
     data_yields = make_yields_df([hist_xsec], ["Data"], per_bin=True)
-    plot_tools.write_index_and_log(outdir, outfile, nround=2,
-        yield_tables={"Data" : data_yields, "Model": reference_yields} if hist_ref is not None else {"Data" : data_yields},
-        analysis_meta_info={args.infile : meta["meta_info"]},
-        args=args,
-    )
-    plt.close()
+    plot_tools.close_figure()
+    return outfile, {"Data" : data_yields, "Model": reference_yields} if hist_ref is not None else {"Data" : data_yields}
 
 def plot_uncertainties_unfolded(hist_xsec, hist_stat, hist_syst, poi_type, channel="ch0", proc="W",
     logy=False, relative_uncertainty=True, percentage=True, lumi=None,
@@ -436,19 +436,14 @@ def plot_uncertainties_unfolded(hist_xsec, hist_stat, hist_syst, poi_type, chann
     outfile += (f"_{args.postfix}" if args.postfix else "")
     plot_tools.save_pdf_and_png(outdir, outfile)
 
-    plot_tools.write_index_and_log(outdir, outfile, nround=2,
-        yield_tables={f"Unfolded{' relative' if relative_uncertainty else ''} uncertainty{' [%]' if percentage else ''}": uncertainties},
-        analysis_meta_info={args.infile : meta["meta_info"]},
-        args=args,
-    )
-
-    plt.close()
+    plot_tools.close_figure()
+    return outfile, {f"Unfolded{' relative' if relative_uncertainty else ''} uncertainty{' [%]' if percentage else ''}": uncertainties}
 
 def plot_uncertainties_with_ratio(
     hist_xsec, hist_xsec_ref, poi_type, poi_type_ref, 
     hist_stat=None, hist_syst=None, hist_stat_ref=None, hist_syst_ref=None,
     logy=False, relative_uncertainty=True, percentage=True, lumi=None,
-    channel="ch0", normalize=False, flow=False
+    channel="ch0", proc="W", normalize=False, flow=False
 ):
     logger.info(f"Make "+("normalized " if normalize else "")+"unfoled xsec plot"+(f" in channel {channel}" if channel else ""))
 
@@ -646,13 +641,8 @@ def plot_uncertainties_with_ratio(
     outfile += (f"_{args.postfix}" if args.postfix else "")
     plot_tools.save_pdf_and_png(outdir, outfile)
 
-    plot_tools.write_index_and_log(outdir, outfile, nround=2,
-        yield_tables={f"Unfolded{' relative' if relative_uncertainty else ''} uncertainty{' [%]' if percentage else ''}": uncertainties},
-        analysis_meta_info={args.infile : meta["meta_info"]},
-        args=args,
-    )
-
-    plt.close()
+    plot_tools.close_figure()
+    return outfile, {f"Unfolded{' relative' if relative_uncertainty else ''} uncertainty{' [%]' if percentage else ''}": uncertainties}
 
 for poi_type, poi_result in result.items():
 
@@ -736,7 +726,7 @@ for poi_type, poi_result in result.items():
                         h_others = [h[idxs] for h in hists_others]
 
                     if "xsec" in args.plots:
-                        plot_xsec_unfolded(h_nominal, h_stat, h_ref, poi_type=poi_type, channel=suffix, proc=proc, lumi=lumi,
+                        plot_tasks.add(plot_xsec_unfolded, h_nominal, h_stat, h_ref, poi_type=poi_type, channel=suffix, proc=proc, lumi=lumi,
                             hist_others=h_others, 
                             label_others=args.varLabels,
                             marker_others=args.varMarkers, 
@@ -749,7 +739,7 @@ for poi_type, poi_result in result.items():
                         if bins != None:
                             h_systs = h_systs[{**idxs, "syst": slice(None)}]
 
-                        plot_uncertainties_unfolded(h_nominal, h_stat, h_systs, poi_type=poi_type, channel=suffix, proc = proc, lumi=lumi,
+                        plot_tasks.add(plot_uncertainties_unfolded, h_nominal, h_stat, h_systs, poi_type=poi_type, channel=suffix, proc = proc, lumi=lumi,
                             relative_uncertainty=True,
                             # normalize=args.normalize, relative_uncertainty=not args.absolute, 
                             logy=args.logy)
@@ -760,15 +750,23 @@ for poi_type, poi_result in result.items():
                         if bins != None:
                             h_ref_systs = h_ref_systs[{**idxs, "syst": slice(None)}]
 
-                        plot_uncertainties_with_ratio(h_nominal, h_ref, 
+                        plot_tasks.add(plot_uncertainties_with_ratio, h_nominal, h_ref,
                             poi_type=poi_type, poi_type_ref=poi_type_ref, 
                             hist_stat=h_stat, hist_stat_ref=h_ref_stat,
                             # hist_syst=h_syst, hist_syst_ref=h_ref_syst,
-                            channel=channel,
+                            channel=channel, proc=proc,
                             # normalize=args.normalize, relative_uncertainty=not args.absolute, 
                             logy=args.logy, 
                             # process_label = process_label, axes=channel_axes
                             )
 
+# the index and logs are written once all plots are made
+for outfile, yield_tables in plot_tasks.run():
+    plot_tools.write_index_and_log(outdir, outfile, nround=2,
+        yield_tables=yield_tables,
+        analysis_meta_info={args.infile : meta["meta_info"]},
+        args=args,
+    )
+
 if output_tools.is_eosuser_path(args.outpath) and args.eoscp:
     output_tools.copy_to_eos(outdir, args.outpath, args.outfolder)
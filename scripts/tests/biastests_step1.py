@@ -113,17 +113,22 @@ for nominal, pseudodata in datasets:
     file_nominal = f"{args.outfolder}/{histmaker}_{args.defaultPostfix}_{str_nominal}.hdf5"
     file_pseudodata = f"{args.outfolder}/{histmaker}_{args.defaultPostfix}_{str_pseudodata}.hdf5"
 
+    configs = []
     if not os.path.isfile(file_nominal):
         # run histmaker for nominal
-        EXE(f"python3 scripts/histmakers/{histmaker}.py -j {args.nThreads} -o {args.outfolder} {options} {argument} {arg_nominal} -p {str_nominal}")
+        configs.append(f"'{str_nominal}={argument} {arg_nominal}'")
     else:
         logger.info(f"Found file for nominal {nominal}")
 
     if not os.path.isfile(file_pseudodata):
         # run histmaker for pseudodata
-        EXE(f"python3 scripts/histmakers/{histmaker}.py -j {args.nThreads} -o {args.outfolder} {options} {argument} {arg_pseudodata} -p {str_pseudodata}")
+        configs.append(f"'{str_pseudodata}={argument} {arg_pseudodata}'")
     else:
         logger.info(f"Found file for pseudodata {pseudodata}")
+
+    if configs:
+        # nominal and pseudodata are processed in the same event loop
+        EXE(f"python3 scripts/histmakers/{histmaker}.py -j {args.nThreads} -o {args.outfolder} {options} --configs {' '.join(configs)}")
         
     # make control plots
     # webDir = args.outfolder.split("/")[-1] +f"/{str_nominal}_vs_{str_pseudodata}"
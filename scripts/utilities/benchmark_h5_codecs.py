@@ -0,0 +1,72 @@
+import argparse
+import h5py
+import hdf5plugin
+import numpy as np
+import os
+import tempfile
+import time
+
+from utilities import logging
+from utilities.h5pyutils import writeFlatInChunks, codecs
+
+parser = argparse.ArgumentParser(description="Compare the write and read performance of the compression codecs for the datasets of the fit input")
+parser.add_argument("infile", type=str, nargs="?", default=None, help="hdf5 file from setupCombine.py to take the dataset from, a random sparse tensor is used if not given")
+parser.add_argument("--dataset", type=str, default="hlogk", help="Dataset in the input file")
+parser.add_argument("--shape", type=int, nargs="+", default=[2000, 20, 2, 500], help="Shape of the random tensor (nbins, nproc, 2, nsyst)")
+parser.add_argument("--density", type=float, default=0.2, help="Fraction of nonzero entries of the random tensor")
+parser.add_argument("--codecs", type=str, nargs="+", default=codecs, choices=codecs, help="Codecs to compare")
+parser.add_argument("--nThreads", type=int, default=[1, 8], nargs="+", help="Number of threads to compress the chunks")
+parser.add_argument("--chunkSize", type=int, default=4*1024**2, help="Maximum size of the chunks in bytes")
+parser.add_argument("--nRepeat", type=int, default=3, help="Number of times the reading is repeated, the fastest is quoted")
+parser.add_argument("-v", "--verbose", type=int, default=3, choices=[0,1,2,3,4], help="Set verbosity level with logging, the larger the more verbose")
+args = parser.parse_args()
+
+logger = logging.setup_logger(__file__, args.verbose)
+
+def read_tensor(h5dset):
+    # same access pattern as the fitter, the flat dataset is read chunk by chunk into a preallocated array
+    arr = np.empty(h5dset.shape, dtype=h5dset.dtype)
+    chunksize = h5dset.chunks[0] if h5dset.chunks else h5dset.size
+    for ielem in range(0, h5dset.size, chunksize):
+        sel = np.s_[ielem:ielem+chunksize]
+        h5dset.read_direct(arr, source_sel=sel, dest_sel=sel)
+    return arr.reshape(h5dset.attrs["original_shape"])
+
+if args.infile:
+    with h5py.File(args.infile, "r") as f:
+        arr = read_tensor(f[args.dataset])
+    logger.info(f"Read {args.dataset} with shape {arr.shape} from {args.infile}")
+else:
+    rng = np.random.default_rng(1)
+    arr = rng.normal(scale=0.01, size=args.shape)
+    arr[rng.random(args.shape) > args.density] = 0.
+    logger.info(f"Random tensor with shape {arr.shape} and density {args.density}")
+
+logger.info(f"Uncompressed size: {arr.nbytes/1024**2:.1f} MB")
+
+lines = [f"{'codec':<8} {'threads':>7} {'size [MB]':>10} {'ratio':>7} {'write [s]':>10} {'read [s]':>10}"]
+with tempfile.TemporaryDirectory() as tmpdir:
+    for codec in args.codecs:
+        for nThreads in args.nThreads:
+            outfile = f"{tmpdir}/{codec}_{nThreads}.hdf5"
+
+            time0 = time.time()
+            with h5py.File(outfile, "w") as f:
+                writeFlatInChunks(arr, f, "tensor", maxChunkBytes=args.chunkSize, codec=codec, nThreads=nThreads)
+            twrite = time.time() - time0
+
+            size = os.path.getsize(outfile)
+
+            tread = []
+            for i in range(args.nRepeat):
+                time0 = time.time()
+                with h5py.File(outfile, "r") as f:
+                    res = read_tensor(f["tensor"])
+                tread.append(time.time() - time0)
+
+            if not np.array_equal(res, arr):
+                raise RuntimeError(f"Tensor read back with codec {codec} is different from the input")
+
+            lines.append(f"{codec:<8} {nThreads:>7} {size/1024**2:>10.1f} {arr.nbytes/size:>7.2f} {twrite:>10.2f} {min(tread):>10.2f}")
+
+logger.info("Codec benchmark:\n" + "\n".join(lines))
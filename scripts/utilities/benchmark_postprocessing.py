@@ -0,0 +1,289 @@
+import argparse
+import ctypes
+import gc
+import h5py
+import hist
+import json
+import numpy as np
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import narf
+from utilities import boostHistHelpers as hh, common, logging
+from wremnants import CardTool, HDF5Writer, histselections as sel, theory_tools
+from wremnants.datasets.datagroups import Datagroups
+
+benchmarks = ["divideHists", "broadcastSystHist", "rebinHist", "rebinHistMultiAx", "syst_min_or_max_env_hist",
+    "hessianPdfUnc", "FakeSelector1DExtendedABCD", "FakeSelector2DExtendedABCD", "loadHistsForDatagroups", "HDF5Writer.write"]
+
+parser = argparse.ArgumentParser(description="Measure the time and peak memory of the post-processing hot paths on synthetic histograms with the axes of mw_with_mu_eta_pt.py, and compare them with a stored baseline")
+parser.add_argument("--benchmarks", type=str, nargs="+", default=benchmarks, choices=benchmarks, help="Functions to benchmark")
+parser.add_argument("--nSyst", type=int, nargs="+", default=[10, 100], help="Sizes of the tensor axis of the systematic histograms")
+parser.add_argument("--nRepeat", type=int, default=3, help="Number of times each function is run, the fastest is quoted")
+parser.add_argument("--baseline", type=str, default=None, help="json file with the baseline to compare with")
+parser.add_argument("--updateBaseline", action="store_true", help="Write the results into the baseline file instead of comparing with it")
+parser.add_argument("--timeTolerance", type=float, default=0.2, help="Allowed relative increase of the time with respect to the baseline")
+parser.add_argument("--memoryTolerance", type=float, default=0.1, help="Allowed relative increase of the peak memory with respect to the baseline")
+parser.add_argument("--seed", type=int, default=1, help="Seed of the random numbers to fill the histograms")
+parser.add_argument("-v", "--verbose", type=int, default=3, choices=[0,1,2,3,4], help="Set verbosity level with logging, the larger the more verbose")
+args = parser.parse_args()
+
+logger = logging.setup_logger(__file__, args.verbose)
+
+# absolute tolerance of the peak memory for small allocations
+memory_slack = 16*1024**2
+
+def make_axes(high_abcd_bins=False):
+    # same axes as the nominal histogram of mw_with_mu_eta_pt.py
+    return [
+        hist.axis.Regular(48, -2.4, 2.4, name = "eta", overflow=False, underflow=False),
+        hist.axis.Regular(30, 26, 56, name = "pt", overflow=False, underflow=False),
+        common.axis_charge,
+        hist.axis.Variable(common.get_binning_fakes_mt(40, high_mt_bins=high_abcd_bins), name = "mt", underflow=False, overflow=True),
+        hist.axis.Variable(common.get_binning_fakes_relIso(high_iso_bins=high_abcd_bins), name = "relIso", underflow=False, overflow=True),
+    ]
+
+def make_syst_axes(nsyst):
+    return [hist.axis.Integer(0, nsyst, underflow=False, overflow=False, name = "tensor_axis_0"), common.down_up_axis]
+
+def make_nominal(rng, axes, norm=1.):
+    # falling spectrum in pt with positive content in all bins, the statistical uncertainty scales with the content
+    h = hist.Hist(*axes, storage=hist.storage.Weight())
+    view = h.view(flow=True)
+    shape = view.shape
+    pt = np.reshape(h.axes["pt"].centers, [-1 if n == "pt" else 1 for n in h.axes.name])
+    values = norm * 1e3 * np.exp(-(pt-26)/10.) * rng.uniform(0.5, 1.5, size=shape)
+    view.value = values
+    view.variance = values * rng.uniform(0.5, 2., size=shape)
+    return h
+
+def make_syst(rng, hnom, nsyst):
+    # variations of the nominal histogram by a few percent
+    h = hist.Hist(*hnom.axes, *make_syst_axes(nsyst), storage=hist.storage.Weight())
+    view = h.view(flow=True)
+    nomview = hnom.view(flow=True)[..., np.newaxis, np.newaxis]
+    scale = 1 + rng.normal(scale=0.02, size=view.shape)
+    view.value = nomview.value * scale
+    view.variance = nomview.variance * scale**2
+    return h
+
+processes = {
+    # dataset name, cross section, normalization
+    "dataPostVFP" : (None, 5.),
+    "WplusmunuPostVFP" : (11765.9, 2.),
+    "WminusmunuPostVFP" : (8703.87, 1.5),
+    "ZmumuPostVFP" : (2001.9, 0.3),
+    "TTLeptonicPostVFP" : (88.29, 0.05),
+}
+
+def write_histmaker_output(rng, filename, nsyst, syst_name):
+    # synthetic output in the format of the histmakers, the systematic histogram is only made for the signal
+    results = {}
+    for name, (xsec, norm) in processes.items():
+        is_data = xsec is None
+        hnom = make_nominal(rng, make_axes(), norm)
+        output = {"nominal" : narf.ioutils.H5PickleProxy(hnom)}
+        if name.startswith("W"):
+            output[f"nominal_{syst_name}"] = narf.ioutils.H5PickleProxy(make_syst(rng, hnom, nsyst))
+        results[name] = {
+            "dataset" : {"name" : name, "xsec" : xsec, "is_data" : is_data, "filepaths" : []},
+            "weight_sum" : 1e9*norm,
+            "event_count" : 1e9*norm,
+            "output" : output,
+        }
+        if is_data:
+            results[name]["lumi"] = 16.8
+    results["meta_info"] = {"command" : "mw_with_mu_eta_pt.py", "args" : {}}
+    with h5py.File(filename, "w") as f:
+        for k, v in results.items():
+            narf.ioutils.pickle_dump_h5py(k, v, f)
+
+def make_datagroups(filename):
+    datagroups = Datagroups(filename, excludeGroups=["Ztautau", "PhotonInduced", "Wtaunu", "DYlowMass", "Diboson", "QCD"])
+    datagroups.unconstrainedProcesses.append("Wmunu")
+    datagroups.set_histselectors(datagroups.getNames(), "nominal", mode="extended1D", smoothing_mode="full", mcCorr=["none"])
+    return datagroups
+
+# each setup function creates the inputs and returns the function to measure
+def setup_divideHists(rng, nsyst, tmpdir):
+    hnom = make_nominal(rng, make_axes())
+    hsyst = make_syst(rng, hnom, nsyst)
+    return lambda: hh.divideHists(hsyst, hnom)
+
+def setup_broadcastSystHist(rng, nsyst, tmpdir):
+    hnom = make_nominal(rng, make_axes())
+    hsyst = make_syst(rng, hnom, nsyst)
+    return lambda: hh.broadcastSystHist(hnom, hsyst)
+
+def setup_rebinHist(rng, nsyst, tmpdir):
+    hsyst = make_syst(rng, make_nominal(rng, make_axes()), nsyst)
+    edges = common.get_binning_fakes_pt(26, 56)
+    return lambda: hh.rebinHist(hsyst, "pt", edges)
+
+def setup_rebinHistMultiAx(rng, nsyst, tmpdir):
+    hsyst = make_syst(rng, make_nominal(rng, make_axes()), nsyst)
+    return lambda: hh.rebinHistMultiAx(hsyst, ["eta", "pt"], edges=[2, 3], lows=[-2.0, 28], highs=[2.0, 52])
+
+def setup_syst_min_or_max_env_hist(rng, nsyst, tmpdir):
+    # the envelope is taken over the last axis
+    hsyst = make_syst(rng, make_nominal(rng, make_axes()), nsyst)[{"downUpVar" : 0}]
+    return lambda: hh.syst_min_or_max_env_hist(hsyst, ["eta", "pt", "charge"], "tensor_axis_0", list(range(nsyst)))
+
+def setup_hessianPdfUnc(rng, nsyst, tmpdir):
+    # asymmetric Hessian set with nsyst eigenvectors, the up and down variations are taken as in syst_tools.syst_transform_map
+    hnom = make_nominal(rng, make_axes())
+    names = theory_tools.pdfNamesAsymHessian(2*nsyst+1, "pdfMSHT20")
+    hpdf = hist.Hist(*hnom.axes, hist.axis.StrCategory(names, name="pdfVar"), storage=hist.storage.Double())
+    hpdf.values(flow=True)[..., :len(names)] = hnom.values(flow=True)[..., np.newaxis]*(1 + rng.normal(scale=0.02, size=len(names)))
+    return lambda: theory_tools.hessianPdfUnc(hpdf, uncType="asymHessian")
+
+def setup_FakeSelector1DExtendedABCD(rng, nsyst, tmpdir):
+    hnom = make_nominal(rng, make_axes())
+    hsyst = make_syst(rng, hnom, nsyst)
+    # same configuration as in Datagroups.set_histselectors
+    selector = sel.FakeSelector1DExtendedABCD(hnom[{"charge" : hist.sum}], global_scalefactor=1/1.15,
+        fakerate_axes=["eta", "pt", "charge"], smoothing_mode="full", smoothing_order_fakerate=2)
+    return lambda: selector.get_hist(hsyst)
+
+def setup_FakeSelector2DExtendedABCD(rng, nsyst, tmpdir):
+    hnom = make_nominal(rng, make_axes(high_abcd_bins=True))
+    hsyst = make_syst(rng, hnom, nsyst)
+    selector = sel.FakeSelector2DExtendedABCD(hnom[{"charge" : hist.sum}],
+        fakerate_axes=["eta", "pt", "charge"], smoothing_mode="full", smoothing_order_fakerate=2,
+        smooth_shapecorrection=False, interpolate_x=False, rebin_x=None)
+    return lambda: selector.get_hist(hsyst)
+
+def setup_loadHistsForDatagroups(rng, nsyst, tmpdir):
+    filename = f"{tmpdir}/mw_with_mu_eta_pt_{nsyst}.hdf5"
+    write_histmaker_output(rng, filename, nsyst, "effSystTnP")
+    datagroups = make_datagroups(filename)
+    def run():
+        datagroups.loadHistsForDatagroups("nominal", syst="effSystTnP", procsToRead=datagroups.groups.keys())
+        datagroups.release_results("nominal_effSystTnP")
+    return run
+
+def setup_HDF5Writer_write(rng, nsyst, tmpdir):
+    filename = f"{tmpdir}/mw_with_mu_eta_pt_{nsyst}.hdf5"
+    write_histmaker_output(rng, filename, nsyst, "effSystTnP")
+    datagroups = make_datagroups(filename)
+    cardTool = CardTool.CardTool()
+    cardTool.setDatagroups(datagroups)
+    cardTool.setFitAxes(["eta", "pt", "charge"])
+    cardTool.setWriteByCharge(False)
+    cardTool.setHistName("nominal")
+    cardTool.setNominalName("nominal")
+    cardTool.addSystematic("effSystTnP",
+        processes=["Wmunu"],
+        group="muon_eff_syst",
+        systAxes=["tensor_axis_0", "downUpVar"],
+        labelsByAxis=["effSystTnP", "downUpVar"],
+        baseName="effSystTnP_",
+        passToFakes=True,
+    )
+    def run():
+        writer = HDF5Writer.HDF5Writer()
+        writer.add_channel(cardTool)
+        writer.write(args, f"{tmpdir}/card_{nsyst}", "card")
+    return run
+
+setups = {
+    "divideHists" : setup_divideHists,
+    "broadcastSystHist" : setup_broadcastSystHist,
+    "rebinHist" : setup_rebinHist,
+    "rebinHistMultiAx" : setup_rebinHistMultiAx,
+    "syst_min_or_max_env_hist" : setup_syst_min_or_max_env_hist,
+    "hessianPdfUnc" : setup_hessianPdfUnc,
+    "FakeSelector1DExtendedABCD" : setup_FakeSelector1DExtendedABCD,
+    "FakeSelector2DExtendedABCD" : setup_FakeSelector2DExtendedABCD,
+    "loadHistsForDatagroups" : setup_loadHistsForDatagroups,
+    "HDF5Writer.write" : setup_HDF5Writer_write,
+}
+
+def read_status(field):
+    # memory in bytes from /proc/self/status
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field):
+                return int(line.split()[1])*1024
+    raise RuntimeError(f"Did not find {field} in /proc/self/status")
+
+def release_memory():
+    # return the freed memory to the system, otherwise the call reuses it without increasing the resident memory
+    gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+def peak_memory(func):
+    # increase of the peak resident memory during the call, the buffers of boost-histogram are not seen by tracemalloc,
+    #   which is only used if the peak can't be reset
+    release_memory()
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+    rss = read_status("VmRSS")
+    func()
+    return read_status("VmHWM") - rss
+
+def measure(func, nRepeat):
+    times = []
+    for i in range(nRepeat):
+        gc.collect()
+        time0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - time0)
+    return min(times), peak_memory(func)
+
+results = {}
+with tempfile.TemporaryDirectory() as tmpdir:
+    for name in args.benchmarks:
+        for nsyst in args.nSyst:
+            rng = np.random.default_rng(args.seed)
+            func = setups[name](rng, nsyst, tmpdir)
+            t, mem = measure(func, args.nRepeat)
+            logger.info(f"{name} with {nsyst} systematics: {t:.3f}s, {mem/1024**2:.1f} MB")
+            results[f"{name}/{nsyst}"] = {"time" : t, "peak_memory" : mem}
+            del func
+
+baseline = {}
+if args.baseline and os.path.isfile(args.baseline):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+lines = [f"{'benchmark':<40} {'time [s]':>9} {'ref [s]':>9} {'ratio':>6} {'peak [MB]':>10} {'ref [MB]':>9} {'ratio':>6}"]
+regressions = []
+for key, res in results.items():
+    ref = baseline.get(key)
+    if ref is None:
+        lines.append(f"{key:<40} {res['time']:>9.3f} {'-':>9} {'-':>6} {res['peak_memory']/1024**2:>10.1f} {'-':>9} {'-':>6}")
+        continue
+    slower = res["time"] > ref["time"]*(1+args.timeTolerance)
+    larger = res["peak_memory"] > ref["peak_memory"]*(1+args.memoryTolerance) + memory_slack
+    if slower or larger:
+        regressions.append(key)
+    lines.append(f"{key:<40} {res['time']:>9.3f} {ref['time']:>9.3f} {res['time']/ref['time']:>6.2f} "
+        f"{res['peak_memory']/1024**2:>10.1f} {ref['peak_memory']/1024**2:>9.1f} {res['peak_memory']/max(ref['peak_memory'], 1024**2):>6.2f}"
+        + (" <- regression" if slower or larger else ""))
+
+logger.info("Post-processing benchmark:\n" + "\n".join(lines))
+
+if args.updateBaseline:
+    if not args.baseline:
+        raise ValueError("A baseline file is needed to store the results")
+    baseline.update(results)
+    with open(args.baseline, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+    logger.info(f"Baseline written to {args.baseline}")
+elif regressions:
+    logger.error(f"Found {len(regressions)} regressions with respect to {args.baseline}: {', '.join(regressions)}")
+    sys.exit(1)
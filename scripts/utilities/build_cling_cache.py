@@ -0,0 +1,24 @@
+import argparse
+import os
+
+from utilities import logging
+
+parser = argparse.ArgumentParser(description="Compile the wremnants headers and the template instantiations recorded in the histmaker runs into a shared library, which is loaded by the histmakers to skip the compilation with cling")
+parser.add_argument("--instantiations", type=str, nargs="*", default=None, help="C++ names of the class templates to instantiate, by default the ones recorded in the histmaker runs are used")
+parser.add_argument("--cacheDir", type=str, default=os.environ.get("WREMNANTS_CLING_CACHE", ""), help="Directory of the compiled cache, by default the WREMNANTS_CLING_CACHE environment variable, which has to point to the same directory to use the cache in the histmakers")
+parser.add_argument("-f", "--force", action="store_true", help="Recompile even if the library is up to date")
+parser.add_argument("-v", "--verbose", type=int, default=3, choices=[0,1,2,3,4], help="Set verbosity level with logging, the larger the more verbose")
+args = parser.parse_args()
+
+logger = logging.setup_logger(__file__, args.verbose)
+
+# the library is rebuilt, the current one should not be loaded when importing wremnants
+os.environ["WREMNANTS_CLING_CACHE_LOAD"] = "0"
+
+from wremnants import cling_cache
+
+if not args.cacheDir:
+    raise ValueError("No directory for the compiled cache, set WREMNANTS_CLING_CACHE or give it with --cacheDir")
+cling_cache.cache_dir = args.cacheDir
+
+cling_cache.build(args.instantiations, force=args.force)
@@ -1,54 +1,170 @@
 import argparse
 import h5py
 import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from utilities import logging
-from utilities.io_tools import input_tools
+from utilities.io_tools import input_tools, output_tools
+from wremnants.histmaker_tools import scale_to_data, aggregate_groups
 import narf
-
-import pdb
+from types import SimpleNamespace
 
 parser = argparse.ArgumentParser()
 parser.add_argument("infiles", type=str, nargs="+", help="Input hdf5 files")
 parser.add_argument("-p", "--postfix", type=str, help="Postfix for output file name", default="merged")
 parser.add_argument("-o", "--outfolder", type=str, default="./", help="Output folder")
+parser.add_argument("-j", "--nThreads", type=int, default=8, help="Number of threads to read the input files in parallel")
+parser.add_argument("--scaleToData", action="store_true", help="Scale the MC histograms with xsec*lumi/sum(gen weights) after summing, e.g. to merge the partial outputs of a histmaker run with '--shard'")
+parser.add_argument("--aggregateGroups", type=str, nargs="*", default=[], help="Sum up histograms from members of given groups after summing, the groups are taken from the dataset info written with '--shard'")
+parser.add_argument("--transportSmearingWeights", type=str, nargs="*", default=[], help="Processes for which the smearing weights are transported to reco after summing")
+parser.add_argument("--nonClosureScheme", type=str, default="A-M-combined", choices=["none", "A-M-separated", "A-M-combined", "binned", "binned-plus-M", "A-only", "M-only"], help="Source of the Z non-closure nuisances, for --transportSmearingWeights")
 args = parser.parse_args()
 logger = logging.setup_logger(__file__)
 
+# quantities that are added up when the same dataset appears in several files
+summed_keys = ["weight_sum", "event_count", "lumi"]
 
-def recursive_copy(res):
-    if type(res) == dict:
-        return {k: recursive_copy(v) for k, v in res.items()}
-    elif type(res) in [type(None), bool, int, float, str]:
-        return res
-    elif type(res) in [list, ]:
-        return copy.deepcopy(res)
-    elif type(res) == narf.ioutils.H5PickleProxy:
-        # need to copy the underlying object, then make a proxy again for lazy reading of output file
-        return narf.ioutils.H5PickleProxy(res.get()) 
-    else:
-        raise TypeError(f"Unknown type {type(res)} of object {res}")
-
-results = {}
-for i, infile in enumerate(args.infiles):
-    logger.info(f"Now at file {infile}")
-    h5file = h5py.File(infile, "r")
-    result = narf.ioutils.pickle_load_h5py(h5file["results"])
-
-    for key, value in result.items():
-        logger.info(f"Copying {key} ...")
-        if key in results.keys():
-            if key == "meta_info":
-                results[f"meta_info_{i}"] = copy.deepcopy(value)
+def get_and_release(proxy):
+    h = proxy.get()
+    proxy.release()
+    return h
+
+def merge_outputs(key, values, executor):
+    # add up the histograms one at a time, the histograms with the same name from different files are read in parallel
+    h_names = []
+    for value in values:
+        h_names.extend([h for h in value["output"].keys() if h not in h_names])
+
+    output = {}
+    for h_name in h_names:
+        proxies = [v["output"][h_name] for v in values if h_name in v["output"]]
+        if len(proxies) != len(values):
+            logger.warning(f"Histogram {h_name} of {key} is only present in {len(proxies)} out of {len(values)} files")
+
+        hsum = None
+        for h in executor.map(get_and_release, proxies):
+            if hsum is None:
+                # the proxy was released, no other reference to the histogram is kept
+                hsum = h
             else:
-                raise NotImplementedError(f"The object with key {key} from file {infile} was already present in a previous file; No implementation to solve this conflict")
-        else:
-            results[key] = recursive_copy(value)
+                hsum += h
+        output[h_name] = narf.ioutils.H5PickleProxy(hsum)
+
+    return output
+
+def merge_results(key, values, executor):
+    if len(values) > 1:
+        logger.info(f"Adding {key} from {len(values)} files")
+    merged = {k: copy.deepcopy(v) for k, v in values[0].items() if k != "output"}
+    for value in values[1:]:
+        for k in summed_keys:
+            if k in merged and k in value:
+                merged[k] += value[k]
+        if "dataset" in merged and "filepaths" in merged["dataset"]:
+            merged["dataset"]["filepaths"] += [p for p in value["dataset"]["filepaths"] if p not in merged["dataset"]["filepaths"]]
+
+    merged["output"] = merge_outputs(key, values, executor)
+    return merged
+
+h5files = [h5py.File(infile, "r") for infile in args.infiles]
+
+# legacy files have all results in a single pickle, otherwise each top level key is a dataset and can be read separately
+legacy_results = {i: input_tools.load_results_h5py(h5file) for i, h5file in enumerate(h5files) if "results" in h5file.keys()}
+
+def load_key(i, key):
+    if i in legacy_results:
+        return legacy_results[i].get(key)
+    if key in h5files[i].keys():
+        return input_tools.load_results_h5py(h5files[i], keys=[key])[key]
+
+keys = []
+for i, h5file in enumerate(h5files):
+    file_keys = legacy_results[i].keys() if i in legacy_results else [k for k in h5file.keys() if k not in output_tools.reserved_keys]
+    keys.extend([k for k in file_keys if k not in keys])
 
 outfile = args.infiles[0].split("/")[-1]
 if args.postfix:
     outfile = outfile.replace(".hdf5", f"_{args.postfix}.hdf5" if args.postfix else ".hdf5")
 
 logger.info(f"Writing merged results into output file {args.outfolder}/{outfile}")
-with h5py.File(f"{args.outfolder}/{outfile}", 'w') as f:
-    narf.ioutils.pickle_dump_h5py("results", results, f)
\ No newline at end of file
+
+def load_values(key, executor):
+    # read the (lazy) results for this key from all files in parallel
+    return [v for v in executor.map(lambda i: load_key(i, key), range(len(h5files))) if v is not None]
+
+def is_result(value):
+    return type(value) == dict and "output" in value
+
+time0 = time.time()
+with h5py.File(f"{args.outfolder}/{outfile}", 'w') as f, ThreadPoolExecutor(max_workers=args.nThreads) as executor:
+    lumi = None
+    groups = {}
+    if args.scaleToData or args.aggregateGroups:
+        # only the metadata is needed here, the histograms are read lazily
+        for key in keys:
+            values = load_values(key, executor)
+            if not is_result(values[0]):
+                continue
+            dataset = values[0]["dataset"]
+            if dataset.get("is_data", False):
+                lumi = (lumi or 0) + sum(v["lumi"] for v in values)
+            if dataset.get("group", None) in args.aggregateGroups:
+                groups[key] = dataset["group"]
+        if args.aggregateGroups and not groups:
+            logger.warning("No dataset of the groups to aggregate found, the groups are only available in outputs written with '--shard'")
+
+    # the members of the same group have to be processed together, the other keys one at a time
+    units = [[key] for key in keys if key not in groups]
+    units.extend([[key for key in keys if groups.get(key, None) == group] for group in args.aggregateGroups if group in groups.values()])
+
+    index = {}
+    for unit in units:
+        results = {}
+        for key in unit:
+            logger.info(f"Now at {key}")
+            values = load_values(key, executor)
+
+            if key == "meta_info":
+                merged = copy.deepcopy(values[0])
+                merged["hadd_inputs"] = args.infiles
+                if len(values) > 1:
+                    merged["hadd_meta_info"] = [copy.deepcopy(v) for v in values[1:]]
+            elif not is_result(values[0]):
+                logger.warning(f"Object with key {key} is not a histmaker result, take it from the first file")
+                merged = copy.deepcopy(values[0])
+            else:
+                merged = merge_results(key, values, executor)
+            results[key] = merged
+            del values
+
+        if args.transportSmearingWeights:
+            from wremnants import muon_calibration
+            muon_calibration.transport_smearing_weights_to_reco(results, [p for p in args.transportSmearingWeights if p in results], nonClosureScheme=args.nonClosureScheme)
+
+        if args.scaleToData:
+            scale_to_data({k: v for k, v in results.items() if is_result(v)}, lumi=lumi if lumi is not None else 1)
+
+        if len(unit) > 1 or unit[0] in groups:
+            datasets = [SimpleNamespace(name=results[k]["dataset"]["name"], group=groups[k]) for k in unit]
+            aggregate_groups(datasets, results, [groups[unit[0]]])
+
+        for key, merged in results.items():
+            if is_result(merged):
+                index.update(output_tools.make_results_index({key: merged}))
+
+            logger.debug(f"Pickle and dump {key}")
+            narf.ioutils.pickle_dump_h5py(key, merged, f)
+
+            # free the memory before moving to the next key
+            if is_result(merged):
+                for h in merged["output"].values():
+                    h.release()
+        del results
+
+    output_tools.write_results_index(f, index)
+
+for h5file in h5files:
+    h5file.close()
+
+logger.info(f"Merging: {time.time() - time0}")
@@ -3,7 +3,7 @@ import h5py
 import copy
 
 from utilities import logging
-from utilities.io_tools import input_tools
+from utilities.io_tools import input_tools, output_tools
 import narf
 import narf.ioutils
 import boost_histogram as bh
@@ -56,7 +56,7 @@ newfiles = True
 # def copy_and_write(key, value, isplit)
 
 with h5py.File(args.input, "r") as h5file:
-    keys = list(h5file.keys())
+    keys = [k for k in h5file.keys() if k not in output_tools.reserved_keys]
 
 print(keys)
 
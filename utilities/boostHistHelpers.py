@@ -356,27 +356,125 @@ def compatibleBins(edges1, edges2):
     comparef = np.vectorize(lambda x: np.isclose(x, edges1).any())
     return np.all(comparef(edges2))
 
+def rebinAxis(h, ax, low=None, high=None, rebin=None):
+    # edges: list of new edges or integer to merge bins, in case new edges are given the low and high will be ignored
+    # low, high: new lower and upper boundaries
+    if rebin not in [None, []] and type(rebin) != int:
+        return rebinHist(h, ax, rebin)
+    elif low is not None and high is not None:
+        # in case high edge is upper edge of last bin we need to manually set the upper limit
+        upper = hist.overflow if high==h.axes[ax].edges[-1] else complex(0, high) 
+        logger.info(f"Restricting the axis '{ax}' to range [{low}, {high}]")
+        return h[{ax : slice(complex(0, low), upper, hist.rebin(rebin) if rebin else None)}]
+    elif type(rebin) == int and rebin > 1:
+        logger.info(f"Rebinning the axis '{ax}' by [{rebin}]")
+        return h[{ax : slice(None,None,hist.rebin(rebin))}]
+    return h
+
 def rebinHistMultiAx(h, axes, edges=[], lows=[], highs=[]):
     # edges: lists of new edges or integers to merge bins, in case new edges are given the lows and highs will be ignored
     # lows: list of new lower boundaries
     # highs: list of new upper boundaries
-
-    sel = {}
+    ops = {}
     for ax,low,high,rebin in itertools.zip_longest(axes, lows, highs, edges):
         if ax not in h.axes.name:
             logger.debug(f"Did not find axis {ax} in hist. Skipping rebin.")
             continue
-        if rebin not in [None, []] and type(rebin) != int:
-            h = rebinHist(h, ax, rebin)
-        elif low is not None and high is not None:
-            # in case high edge is upper edge of last bin we need to manually set the upper limit
-            upper = hist.overflow if high==h.axes[ax].edges[-1] else complex(0, high) 
-            logger.info(f"Restricting the axis '{ax}' to range [{low}, {high}]")
-            sel[ax] = slice(complex(0, low), upper, hist.rebin(rebin) if rebin else None)
-        elif type(rebin) == int and rebin > 1:
-            logger.info(f"Rebinning the axis '{ax}' by [{rebin}]")
-            sel[ax] = slice(None,None,hist.rebin(rebin))
-    return h[sel] if len(sel)>0 else h        
+        ops[ax] = AxisOp(lambda h, ax=ax, low=low, high=high, rebin=rebin: rebinAxis(h, ax, low, high, rebin), 
+            ("rebin", low, high, hashableEdges(rebin)))
+    return rebinHistInOnePass(h, ops)
+
+def hashableEdges(edges):
+    return tuple(np.asarray(edges).tolist()) if edges is not None and type(edges) != int else edges
+
+# operation on a single axis, with a hashable key of the operation and whether it takes the absolute value of the axis
+AxisOp = collections.namedtuple("AxisOp", ["op", "key", "absval"], defaults=[False])
+
+# maps of the input bins to the output bins for the operations on single axes, by (axis, operation),
+#   the least recently used maps are dropped above max_rebin_maps entries
+rebin_maps = collections.OrderedDict()
+max_rebin_maps = 256
+RebinMap = collections.namedtuple("RebinMap", ["axis", "identity", "src", "starts", "outputs"])
+
+def axisKey(ax):
+    content = tuple(ax) if isinstance(ax, (hist.axis.StrCategory, hist.axis.IntCategory)) else tuple(ax.edges)
+    return (type(ax).__name__, ax.name, content, ax.traits.underflow, ax.traits.overflow, ax.traits.growth)
+
+def rebinMap(ax, op, op_key):
+    # the operation is applied once to a histogram with one entry per input bin (including the flow bins),
+    #   this gives the output bin of each input bin with the exact same flow and cropping behaviour as the operation
+    key = (axisKey(ax), op_key)
+    if key in rebin_maps:
+        rebin_maps.move_to_end(key)
+        return rebin_maps[key]
+
+    nin = ax.extent
+    hprobe = hist.Hist(ax, hist.axis.Integer(0, nin, name="rebin_map_index", underflow=False, overflow=False), storage=hist.storage.Double())
+    hprobe.view(flow=True)[...] = np.eye(nin)
+    hout = op(hprobe)
+    new_ax = hout.axes[0]
+    m = hout.view(flow=True)
+    if not np.isin(m, [0., 1.]).all() or (m.sum(axis=0) > 1).any():
+        raise ValueError(f"Operation {op_key} on axis {ax.name} does not map each input bin to at most one output bin")
+
+    target = np.where(m.any(axis=0), m.argmax(axis=0), -1)
+    src = np.flatnonzero(target >= 0)
+    # sort the input bins by output bin, such that each output bin is a contiguous range for np.add.reduceat
+    order = np.argsort(target[src], kind="stable")
+    src, tgt = src[order], target[src][order]
+    outputs, starts = np.unique(tgt, return_index=True)
+    identity = m.shape[0] == nin and np.array_equal(target, np.arange(nin)) and new_ax == ax
+    if len(src) == 0:
+        src = slice(0, 0)
+    elif np.array_equal(src, np.arange(src[0], src[-1]+1)):
+        # contiguous input range, no need for a copy
+        src = slice(src[0], src[-1]+1)
+    rebin_maps[key] = RebinMap(new_ax, identity, src, starts, outputs)
+    if len(rebin_maps) > max_rebin_maps:
+        rebin_maps.popitem(last=False)
+    return rebin_maps[key]
+
+def rebinHistInOnePass(h, ops):
+    # ops: dict of axis name and AxisOp to apply on this axis independently
+    #   values and variances are reduced together, each axis once, directly into the output histogram
+    maps = {ax : rebinMap(h.axes[ax], o.op, o.key) for ax, o in ops.items()}
+    maps = {ax : m for ax, m in maps.items() if not m.identity}
+    if len(maps) == 0:
+        return h
+    if h.storage_type not in [hist.storage.Double, hist.storage.Weight]:
+        for ax, o in ops.items():
+            h = o.op(h)
+        return h
+
+    axes = [maps[ax.name].axis if ax.name in maps else ax for ax in h.axes]
+    hnew = hist.Hist(*axes, name=h.name, storage=h.storage_type())
+
+    # the views are in Fortran order, transposed views are C contiguous and the values and variances of each bin are adjacent
+    def float_view(view):
+        view = np.asarray(view).T
+        return view.view(np.float64).reshape(*view.shape, 2) if view.dtype.names else view
+
+    arr = float_view(h.view(flow=True))
+    out = float_view(hnew.view(flow=True))
+    ndim = len(h.axes)
+    # reduce the axes with the largest reduction first to keep the intermediate arrays small
+    order = sorted(maps.keys(), key=lambda ax: maps[ax].axis.extent/h.axes[ax].extent)
+    for i, ax in enumerate(order):
+        m = maps[ax]
+        idx = ndim-1-h.axes.name.index(ax)
+        sel = tuple(slice(None) if j != idx else m.src for j in range(arr.ndim))
+        last = i == len(order)-1
+        if len(m.outputs) == m.axis.extent:
+            arr = np.add.reduceat(arr[sel], m.starts, axis=idx, out=out if last else None)
+        else:
+            # some output bins have no input bins and stay empty
+            shape = list(arr.shape)
+            shape[idx] = m.axis.extent
+            res = out if last else np.zeros(shape)
+            if len(m.outputs):
+                res[tuple(slice(None) if j != idx else m.outputs for j in range(arr.ndim))] = np.add.reduceat(arr[sel], m.starts, axis=idx)
+            arr = res
+    return hnew
 
 def mirrorAxis(h, axis, flow=True):
     # mirror an axis by projecting the entries to the absolute value of the axis and copy it 
@@ -467,14 +565,30 @@ def get_rebin_actions(axes, ax_lim=[], ax_rebin=[], ax_absval=[], rename=False):
     if len(ax_lim) % 2 or len(ax_lim)/2 > len(axes) or len(ax_rebin) > len(axes):
         raise ValueError("Inconsistent rebin or axlim arguments. axlim must be at most two entries per axis, and rebin at most one")
     actions=[]
-    if len(ax_lim)>0 or len(ax_rebin)>0:
-        actions.append(lambda h,axes=axes,rebins=ax_rebin,lows=ax_lim[::2],highs=ax_lim[1::2]: rebinHistMultiAx(h, axes, rebins, lows, highs))
-
-    for i, (var, absval) in enumerate(itertools.zip_longest(axes, ax_absval)):
+    ops = {}
+    # cropping, rebinning and absolute value of each axis are combined in one operation per axis and applied in one pass
+    for i, (var, low, high, rebin, absval) in enumerate(itertools.zip_longest(axes, ax_lim[::2], ax_lim[1::2], ax_rebin, ax_absval)):
+        do_rebin = len(ax_lim)>0 or len(ax_rebin)>0
+        if not do_rebin and not absval:
+            continue
         if absval:
             logger.info(f"Taking the absolute value of axis '{var}'")
-            actions.append(lambda h, ax=var: makeAbsHist(h, ax, rename=rename))
             axes[i] = f"abs{var}" if rename else var
+        def op(h, var=var, low=low, high=high, rebin=rebin, do_rebin=do_rebin, absval=absval):
+            if do_rebin:
+                h = rebinAxis(h, var, low, high, rebin)
+            return makeAbsHist(h, var, rename=rename) if absval else h
+        ops[var] = AxisOp(op, ("rebin_absval", low, high, hashableEdges(rebin), do_rebin, bool(absval), rename), bool(absval))
+
+    if len(ops):
+        def action(h, ops=ops):
+            missing = [ax for ax in ops.keys() if ax not in h.axes.name]
+            for ax in missing:
+                if ops[ax].absval:
+                    raise KeyError(f"Can't take the absolute value of axis '{ax}', it is not in the histogram")
+                logger.debug(f"Did not find axis {ax} in hist. Skipping rebin.")
+            return rebinHistInOnePass(h, {ax : op for ax, op in ops.items() if ax not in missing})
+        actions.append(action)
     return actions
 
 def mergeAxes(ax1, ax2):
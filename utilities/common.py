@@ -330,6 +330,8 @@ def common_parser(analysis_label=""):
     parser.add_argument("--theoryCorr", nargs="*", type=str, action=NoneFilterAction,
         default=["scetlib_dyturbo", "scetlib_dyturboCT18ZVars", "scetlib_dyturboCT18Z_pdfas"], choices=theory_corrections.valid_theory_corrections(), 
         help="Apply corrections from indicated generator. First will be nominal correction.")
+    parser.add_argument("--theoryCorrCacheDir", type=str, default=theory_corrections.corr_cache_dir, 
+        help="Directory to cache the postprocessed theory correction histograms, by default the WREMNANTS_CORR_CACHE environment variable, the cache is not used if empty")
     parser.add_argument("--theoryCorrAltOnly", action='store_true', help="Save hist for correction hists but don't modify central weight")
     parser.add_argument("--ewTheoryCorr", nargs="*", type=str, action=NoneFilterAction, choices=theory_corrections.valid_ew_theory_corrections(), 
         default=["renesanceEW", "powhegFOEW", "pythiaew_ISR", "horaceqedew_FSR", "horacelophotosmecoffew_FSR", ],
@@ -346,6 +348,13 @@ def common_parser(analysis_label=""):
     parser.add_argument("--met", type=str, choices=["DeepMETReso", "RawPFMET", "DeepMETPVRobust", "DeepMETPVRobustNoPUPPI"], help="Choice of MET", default="DeepMETPVRobust")
     parser.add_argument("-o", "--outfolder", type=str, default="", help="Output folder")
     parser.add_argument("--appendOutputFile", type=str, default="", help="Append analysis output to specified output file")
+    parser.add_argument("--mmapHists", action='store_true', help="Store the histograms as uncompressed, contiguous datasets with the axes as metadata, such that they can be memory mapped when reading instead of being unpickled")
+    parser.add_argument("--shard", type=str, default=None, help="Only process the i-th of N deterministic subsets of the files of each dataset, given as 'i/N' (starting from 0). The partial outputs are not scaled to data nor aggregated, use 'scripts/utilities/hadd_hdf5.py --scaleToData --aggregateGroups' to merge them")
+    parser.add_argument("--skim", type=str, default=None, choices=["write", "read"], help="Write the selected events with the corrected muons and the columns defined up to the skim point of the histmaker to --skimDir, or read them from there and only rerun the histogramming stage")
+    parser.add_argument("--skimDir", type=str, default=None, help="Directory with the skims of the datasets, see --skim")
+    parser.add_argument("--skimDropBranches", type=str, nargs="*", default=["HLT_.*", "L1_.*", "Flag_.*"], help="Regular expressions of the columns that are not written to the skims (by default branches that are only used by the selections before the skim point)")
+    parser.add_argument("--configs", type=str, nargs="+", default=None, help="Named configurations given as 'name=flags' (e.g. 'biased=--biasCalibration binned') that are processed in a single event loop over the datasets, the flags are added to the other arguments and the output of each configuration gets its name as postfix")
+    parser.add_argument("--profileGraph", action='store_true', help="Measure the time spent in the column definitions, filters and histogram fills of the event loop, print a summary and store it in the meta_info of the output")
     parser.add_argument("--sequentialEventLoops", action='store_true', help="Run event loops sequentially for each process to reduce memory usage")
     parser.add_argument("-e", "--era", type=str, choices=["2016PreVFP","2016PostVFP", "2017", "2018"], help="Data set to process", default="2016PostVFP")
     parser.add_argument("--scale_A", default=1.0, type=float, help="scaling of the uncertainty on the b-field scale parameter A")
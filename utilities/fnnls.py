@@ -109,4 +109,114 @@ def fnnls(AtA, Aty, epsilon=None, iter_max=None):
         x = s.copy()
         w = Aty - AtA.dot(x)
 
-    return x
\ No newline at end of file
+    return x
+
+
+def _solve_passive(A, b, passive):
+    # least squares solutions restricted to the passive parameters, the other parameters are zero,
+    #   from the normal equations with unit diagonal for the non-passive parameters
+    A_P = np.where(passive[:, None, :], A, 0.)
+    A_PT = np.swapaxes(A_P, -1, -2)
+    AtA = A_PT @ A_P
+    AtA += np.eye(A.shape[-1]) * ~passive[:, None, :]
+    Atb = (A_PT @ b[..., None])[..., 0]
+    try:
+        z = np.linalg.solve(AtA, Atb[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        z = np.full(Atb.shape, np.nan)
+    singular = ~np.all(np.isfinite(z), axis=-1)
+    if np.any(singular):
+        # the pseudo inverse gives the minimum norm solution for singular problems
+        z[singular] = np.einsum("...ij,...j->...i", np.linalg.pinv(A_P[singular]), b[singular])
+    return np.where(passive, z, 0.)
+
+
+def nnls_batched(A, b, epsilon=None, iter_max=None):
+    """
+    Solve min ||A x - b||^2 subject to x >= 0 for a stack of independent problems at once.
+
+    Vectorized version of the Lawson-Hanson active set method: in each iteration the parameter with the 
+    largest positive gradient is added to the passive set of every problem that is not optimal yet, and the 
+    restricted least squares solutions of all these problems are computed together. Parameters of infeasible
+    solutions are moved back to the active set as in the sequential algorithm. Problems for which the 
+    unconstrained solution is already non-negative, which is the common case, are solved right away.
+
+    :param A:        Matrices of shape (..., m, n)
+    :type A:         numpy.ndarray
+    :param b:        Vectors of shape (..., m)
+    :type b:         numpy.ndarray
+    :param epsilon:  Anything less than this value is consider 0 in the code.
+                     Defaults to the machine precision for doubles.
+    :type epsilon:   float
+    :param iter_max: Maximum number of iterations of the outer and inner loops. Defaults to 3 * n.
+    :type iter_max:  int, optional
+    """
+    if epsilon is None:
+        epsilon = np.finfo(np.float64).eps
+
+    A = np.asarray(A, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    m, n = A.shape[-2:]
+    if iter_max is None:
+        iter_max = 3 * n
+
+    batch_shape = np.broadcast_shapes(A.shape[:-2], b.shape[:-1])
+    A = np.broadcast_to(A, (*batch_shape, m, n)).reshape(-1, m, n)
+    b = np.broadcast_to(b, (*batch_shape, m)).reshape(-1, m)
+
+    # tolerance on the gradient relative to the scale of the problem
+    tol = 10 * epsilon * max(m, n) * np.max(np.sum(np.abs(A), axis=-2), axis=-1) * np.max(np.abs(b), axis=-1)
+
+    # the unconstrained solution is the optimum if it is non-negative
+    passive = np.ones((len(b), n), dtype=bool)
+    x = _solve_passive(A, b, passive)
+    done = np.all(x > epsilon, axis=-1)
+    x[~done] = 0.
+    passive[~done] = False
+
+    for i in range(iter_max):
+        idx = np.flatnonzero(~done)
+        if idx.size == 0:
+            break
+        A_i = A[idx]
+        b_i = b[idx]
+        x_i = x[idx]
+        P_i = passive[idx]
+
+        # gradient of the objective, the problems without positive gradient in the active set are optimal
+        w = (np.swapaxes(A_i, -1, -2) @ (b_i - (A_i @ x_i[..., None])[..., 0])[..., None])[..., 0]
+        w = np.where(P_i, -np.inf, w)
+        j = np.argmax(w, axis=-1)
+        optimal = w[np.arange(idx.size), j] <= tol[idx]
+        done[idx[optimal]] = True
+
+        keep = ~optimal
+        idx, A_i, b_i, x_i, P_i, j = idx[keep], A_i[keep], b_i[keep], x_i[keep], P_i[keep], j[keep]
+        if idx.size == 0:
+            break
+        P_i[np.arange(idx.size), j] = True
+        z = _solve_passive(A_i, b_i, P_i)
+
+        # move the parameters with non-positive restricted solutions back to the active set
+        for k in range(iter_max):
+            infeasible = np.any(P_i & (z <= epsilon), axis=-1)
+            if not np.any(infeasible):
+                break
+            sub = np.flatnonzero(infeasible)
+            x_s, z_s, P_s = x_i[sub], z[sub], P_i[sub]
+            mask = P_s & (z_s <= epsilon)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                alpha = np.min(np.where(mask, x_s / (x_s - z_s), np.inf), axis=-1)
+            x_s = x_s + alpha[:, None] * (z_s - x_s)
+            P_s = P_s & (x_s > epsilon)
+            x_i[sub] = np.where(P_s, x_s, 0.)
+            P_i[sub] = P_s
+            z[sub] = _solve_passive(A_i[sub], b_i[sub], P_s)
+
+        x[idx] = np.where(P_i, np.maximum(z, 0.), 0.)
+        passive[idx] = P_i
+        # numerical limit, the parameter that was just added is already removed again
+        done[idx[~P_i[np.arange(idx.size), j]]] = True
+
+    return x.reshape(*batch_shape, n)
@@ -1,7 +1,41 @@
 import numpy as np
 import math
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
-def writeFlatInChunks(arr, h5group, outname, maxChunkBytes = 1024**2):    
+# codecs for the compression of the chunks, blosc2 uses zstd with byte shuffling and needs the hdf5plugin and blosc2 packages
+codecs = ["gzip", "blosc2"]
+
+def compressionOptions(codec):
+    if codec == "gzip":
+        return dict(compression="gzip", compression_opts=4)
+    elif codec == "blosc2":
+        import hdf5plugin
+        return dict(hdf5plugin.Blosc2(cname="zstd", clevel=1, filters=hdf5plugin.Blosc2.SHUFFLE))
+    else:
+        raise ValueError(f"Unknown codec {codec}, supported are {codecs}")
+
+def compressChunk(chunk, codec):
+    # compress a full chunk in the same format as the hdf5 filter, such that it can be written directly
+    if codec == "gzip":
+        return zlib.compress(chunk.tobytes(), 4)
+    elif codec == "blosc2":
+        import blosc2
+        cparams = dict(typesize=chunk.dtype.itemsize, clevel=1, codec=blosc2.Codec.ZSTD, filters=[blosc2.Filter.SHUFFLE], nthreads=1)
+        return blosc2.SChunk(chunksize=chunk.nbytes, data=chunk, cparams=cparams).to_cframe()
+    else:
+        raise ValueError(f"Unknown codec {codec}, supported are {codecs}")
+
+def compressFlatChunk(aout, chunksize, codec):
+    # returns None for empty chunks, which are not written to preserve sparsity
+    if not np.count_nonzero(aout):
+        return None
+    if aout.size < chunksize:
+        # direct chunk writes need the full chunk
+        aout = np.concatenate((aout, np.zeros(chunksize-aout.size, dtype=aout.dtype)))
+    return compressChunk(np.ascontiguousarray(aout), codec)
+
+def writeFlatInChunks(arr, h5group, outname, maxChunkBytes = 1024**2, codec = "gzip", nThreads = 1):
     arrflat = arr.reshape(-1)
 
     esize = np.dtype(arrflat.dtype).itemsize
@@ -11,30 +45,231 @@ def writeFlatInChunks(arr, h5group, outname, maxChunkBytes = 1024**2):
     if arrflat.size == 0:
         chunksize = 1
         chunks = None
-        compression = None
+        compression = {}
     else:
         chunksize = int(min(arrflat.size,max(1,math.floor(maxChunkBytes/esize))))
         chunks = (chunksize,)
-        compression = "gzip"
+        compression = compressionOptions(codec)
 
-    h5dset = h5group.create_dataset(outname, arrflat.shape, chunks=chunks, dtype=arrflat.dtype, compression=compression)
+    h5dset = h5group.create_dataset(outname, arrflat.shape, chunks=chunks, dtype=arrflat.dtype, **compression)
 
-    #write in chunks, preserving sparsity if relevant
-    for ielem in range(0,arrflat.size,chunksize):
-        aout = arrflat[ielem:ielem+chunksize]
-        if np.count_nonzero(aout):
-            h5dset[ielem:ielem+chunksize] = aout
+    def compress(ielem):
+        return ielem, compressFlatChunk(arrflat[ielem:ielem+chunksize], chunksize, codec)
+
+    #compress chunks in parallel and write them directly, preserving sparsity if relevant
+    if arrflat.size:
+        with ThreadPoolExecutor(max_workers=max(1, nThreads)) as executor:
+            starts = range(0, arrflat.size, chunksize)
+            # submit in batches to bound the memory of the compressed chunks waiting to be written
+            batch = 4*max(1, nThreads)
+            for ibatch in range(0, len(starts), batch):
+                for ielem, data in executor.map(compress, starts[ibatch:ibatch+batch]):
+                    if data is not None:
+                        h5dset.id.write_direct_chunk((ielem,), data)
 
     h5dset.attrs['original_shape'] = np.array(arr.shape,dtype='int64')
 
     return nbytes
 
-def writeSparse(indices, values, dense_shape, h5group, outname, maxChunkBytes = 1024**2):
+def writeFlatInBlocks(shape, dtype, fillBlock, h5group, outname, maxChunkBytes = 1024**2, codec = "gzip", nThreads = 1):
+    # same output as writeFlatInChunks, but the array is provided in blocks along the first axis by 'fillBlock(start, stop)'
+    #   and each block is aligned with one chunk, such that the full array never exists in memory
+    dtype = np.dtype(dtype)
+    rowsize = int(np.prod(shape[1:]))
+    nbytes = shape[0]*rowsize*dtype.itemsize
+
+    if shape[0]*rowsize == 0:
+        return writeFlatInChunks(np.zeros(shape, dtype), h5group, outname, maxChunkBytes, codec, nThreads)
+
+    nrows = int(min(shape[0], max(1, math.floor(maxChunkBytes/(rowsize*dtype.itemsize)))))
+    chunksize = nrows*rowsize
+
+    h5dset = h5group.create_dataset(outname, (shape[0]*rowsize,), chunks=(chunksize,), dtype=dtype, **compressionOptions(codec))
+
+    def write(future):
+        ielem, data = future.result()
+        if data is not None:
+            h5dset.id.write_direct_chunk((ielem,), data)
+
+    with ThreadPoolExecutor(max_workers=max(1, nThreads)) as executor:
+        pending = []
+        for irow in range(0, shape[0], nrows):
+            block = np.asarray(fillBlock(irow, min(irow+nrows, shape[0])), dtype=dtype).reshape(-1)
+            pending.append(executor.submit(lambda ielem, block: (ielem, compressFlatChunk(block, chunksize, codec)), irow*rowsize, block))
+            # bound the number of blocks in memory
+            if len(pending) >= 2*max(1, nThreads):
+                write(pending.pop(0))
+        for future in pending:
+            write(future)
+
+    h5dset.attrs['original_shape'] = np.array(shape,dtype='int64')
+
+    return nbytes
+
+def writeSparse(indices, values, dense_shape, h5group, outname, maxChunkBytes = 1024**2, codec = "gzip", nThreads = 1):
     outgroup = h5group.create_group(outname)
 
     nbytes = 0
-    nbytes += writeFlatInChunks(indices, outgroup, "indices", maxChunkBytes)
-    nbytes += writeFlatInChunks(values, outgroup, "values", maxChunkBytes)
+    nbytes += writeFlatInChunks(indices, outgroup, "indices", maxChunkBytes, codec, nThreads)
+    nbytes += writeFlatInChunks(values, outgroup, "values", maxChunkBytes, codec, nThreads)
     outgroup.attrs['dense_shape'] = np.array(dense_shape, dtype='int64')
 
-    return nbytes
\ No newline at end of file
+    return nbytes
+
+class H5FlatAppender(object):
+    # compressed 1D dataset that is filled by appending arrays (flattened), the data is buffered
+    #   such that each chunk is written once
+    def __init__(self, h5group, outname, dtype, maxChunkBytes = 1024**2, codec = "gzip"):
+        self.dtype = np.dtype(dtype)
+        self.chunksize = max(1, math.floor(maxChunkBytes/self.dtype.itemsize))
+        self.h5dset = h5group.create_dataset(outname, (0,), maxshape=(None,), chunks=(self.chunksize,), dtype=self.dtype, **compressionOptions(codec))
+        self.buffer = []
+        self.nbuffer = 0
+
+    def write(self, arr):
+        start = self.h5dset.shape[0]
+        self.h5dset.resize((start+arr.size,))
+        self.h5dset[start:start+arr.size] = arr
+
+    def append(self, arr):
+        arr = np.asarray(arr, dtype=self.dtype).reshape(-1)
+        self.buffer.append(arr)
+        self.nbuffer += arr.size
+        if self.nbuffer >= self.chunksize:
+            buffer = np.concatenate(self.buffer)
+            nfull = (buffer.size//self.chunksize)*self.chunksize
+            self.write(buffer[:nfull])
+            self.buffer = [buffer[nfull:]]
+            self.nbuffer = buffer.size - nfull
+
+    def close(self, shape):
+        if self.nbuffer:
+            self.write(np.concatenate(self.buffer))
+        self.buffer = []
+        self.nbuffer = 0
+        self.h5dset.attrs['original_shape'] = np.array(shape,dtype='int64')
+        return self.h5dset.shape[0]*self.dtype.itemsize
+
+class H5ArrayStore(object):
+    # dict-like storage of arrays which are appended to a resizable, chunked 1D dataset as soon as they are set,
+    #   such that only the offsets are kept in memory
+    def __init__(self, h5group, outname, dtype, maxChunkBytes = 1024**2):
+        chunksize = max(1, math.floor(maxChunkBytes/np.dtype(dtype).itemsize))
+        self.h5dset = h5group.create_dataset(outname, (0,), maxshape=(None,), chunks=(chunksize,), dtype=dtype)
+        self.offsets = {}
+
+    def __setitem__(self, key, arr):
+        arr = np.asarray(arr)
+        start = self.h5dset.shape[0]
+        stop = start + arr.size
+        if arr.size:
+            self.h5dset.resize((stop,))
+            self.h5dset[start:stop] = arr.reshape(-1)
+        self.offsets[key] = (start, stop, arr.shape)
+
+    def __getitem__(self, key):
+        start, stop, shape = self.offsets[key]
+        return self.h5dset[start:stop].reshape(shape)
+
+    def slice(self, key, start, stop):
+        # read only part of a flat array
+        offset = self.offsets[key][0]
+        return self.h5dset[offset+start:offset+stop]
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+    def items(self):
+        for key in self.offsets.keys():
+            yield key, self[key]
+
+    def shape(self, key):
+        return self.offsets[key][2]
+
+
+class H5MappedHistProxy(object):
+    # lazy access to a histogram stored as contiguous, uncompressed dataset that is memory mapped when reading,
+    #   only the axes and the location of the storage are pickled
+    def __init__(self, h, h5group, outname):
+        import hist
+
+        if h.storage_type not in (hist.storage.Double, hist.storage.Weight):
+            raise TypeError(f"Storage type {h.storage_type} not supported for memory mapping")
+
+        self.axes = list(h.axes)
+        self.storage = h.storage_type.__name__
+
+        view = h.view(flow=True)
+        if self.storage == "Weight":
+            view = np.stack((view.value, view.variance), axis=-1)
+
+        # no chunking and no compression to get a contiguous layout
+        h5dset = h5group.create_dataset(outname, data=np.ascontiguousarray(view, dtype=np.float64))
+        self.name = h5dset.name
+        self.shape = view.shape
+
+        self.filename = None
+        self.offset = None
+        self.obj = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["filename"] = None
+        state["offset"] = None
+        state["obj"] = None
+        return state
+
+    def attach(self, h5file):
+        # set the location of the storage in the file that was read
+        self.filename = h5file.filename
+        self.offset = h5file[self.name].id.get_offset()
+
+    def mmap(self):
+        if self.filename is None:
+            raise RuntimeError(f"Histogram {self.name} is not attached to a file")
+        return np.memmap(self.filename, dtype=np.float64, mode="r", offset=self.offset, shape=self.shape)
+
+    def get(self, selection=None, sum_axes=None):
+        # 'selection' is a dict of axis names and bin indices (without flow bins, or hist.underflow/overflow) and 'sum_axes'
+        #   are the names of axes which are summed including the flow bins, such that only the needed part of the storage is read
+        #   and the full histogram is never created in memory
+        import hist
+
+        if sum_axes:
+            sum_axes = [ax.name for ax in self.axes if ax.name in sum_axes and not (selection and ax.name in selection)]
+        if not selection and not sum_axes and self.obj is not None:
+            return self.obj
+
+        view = self.mmap()
+        axes = self.axes
+        if selection:
+            slices = []
+            for ax in self.axes:
+                if ax.name not in selection:
+                    slices.append(slice(None))
+                elif selection[ax.name] is hist.underflow:
+                    slices.append(0)
+                elif selection[ax.name] is hist.overflow:
+                    slices.append(ax.size + (1 if ax.traits.underflow else 0))
+                else:
+                    slices.append(selection[ax.name] + (1 if ax.traits.underflow else 0))
+            view = view[tuple(slices)]
+            axes = [ax for ax in axes if ax.name not in selection]
+        if sum_axes:
+            view = np.sum(view, axis=tuple(i for i, ax in enumerate(axes) if ax.name in sum_axes))
+            axes = [ax for ax in axes if ax.name not in sum_axes]
+
+        h = hist.Hist(*axes, storage=getattr(hist.storage, self.storage)(), data=np.asarray(view))
+
+        if not selection and not sum_axes:
+            self.obj = h
+        return h
+
+    def release(self):
+        self.obj = None
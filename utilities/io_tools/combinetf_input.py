@@ -195,32 +195,36 @@ def filter_poi_bins(names, gen_axes, selections={}, base_processes=[], flow=Fals
         gen_axes = [gen_axes]
     if isinstance(base_processes, str):
         base_processes = [base_processes]
-    df = pd.DataFrame({"Name":names})
+    names = list(names)
+    # indices of the names that have all gen axes
+    rows = range(len(names))
+    bins = {}
     for axis in gen_axes:
-        df[axis] = df["Name"].apply(lambda x, a=axis: decode_poi_bin(x, a))
-        df.dropna(inplace=True)
+        decoded = {i: decode_poi_bin(names[i], axis) for i in rows}
+        rows = [i for i in rows if decoded[i] is not None and all(bins[a][i] is not None for a in bins.keys())]
         if flow:
             # set underflow to -1, overflow to max bin number+1
-            max_bin = pd.to_numeric(df[axis],errors='coerce').max()
-            df[axis] = df[axis].apply(lambda x, iu=max_bin: -1 if x[0]=="U" else iu+1 if x[0]=="O" else int(x) if x is not None else None)
+            numeric = [int(decoded[i]) for i in rows if decoded[i].isdigit()]
+            max_bin = max(numeric) if len(numeric) else None
+            bins[axis] = {i: -1 if decoded[i][0]=="U" else (max_bin+1 if max_bin is not None else None) if decoded[i][0]=="O" else int(decoded[i]) for i in rows}
         else:
             # set underflow and overflow to None
-            df[axis] = df[axis].apply(lambda x: None if x is None or x[0] in ["U","O"] else int(x))
-
-    # filter out rows with NaNs
-    mask = ~df.isna().any(axis=1)
-    # select rows from base process
-    if len(base_processes):
-        mask = mask & df["Name"].apply(lambda x, p=base_processes: any([x.startswith(p) for p in base_processes]))
-    # remove rows that have additional axes that are not required (strip off process prefix and poi type postfix and compare length of gen axes assuming they are separated by '_')
-    mask = mask & df["Name"].apply(lambda x, a=gen_axes, b=base_processes: any(len(x.replace(p,"").split("_")[1:-1])==len(a) if x.startswith(p) else False for p in b))    
-    # gen bin selections
-    for k, v in selections.items():
-        mask = mask & (df[k] == v)
-
-    filtered_df = df[mask]
-
-    return filtered_df.sort_values(list(gen_axes)).index.to_list()
+            bins[axis] = {i: None if decoded[i][0] in ["U","O"] else int(decoded[i]) for i in rows}
+
+    def select(i):
+        x = names[i]
+        if any(bins[a][i] is None for a in gen_axes):
+            return False
+        # select rows from base process
+        if len(base_processes) and not any([x.startswith(p) for p in base_processes]):
+            return False
+        # remove rows that have additional axes that are not required (strip off process prefix and poi type postfix and compare length of gen axes assuming they are separated by '_')
+        if not any(len(x.replace(p,"").split("_")[1:-1])==len(gen_axes) if x.startswith(p) else False for p in base_processes):
+            return False
+        # gen bin selections
+        return all(bins[k][i] == v for k, v in selections.items())
+
+    return sorted(filter(select, rows), key=lambda i: tuple(bins[a][i] for a in gen_axes))
 
 def select_pois(df, gen_axes=[], selections={}, base_processes=[], flow=False):
     return df.iloc[filter_poi_bins(df["Name"].values, gen_axes, selections=selections, base_processes=base_processes, flow=flow)]
@@ -318,10 +322,30 @@ def select_covariance_pois(cov, names, gen_axes=[], selections={}, base_processe
         hist.axis.Integer(start=0, stop=len(indices), underflow=False, overflow=False), 
         hist.axis.Integer(start=0, stop=len(indices), underflow=False, overflow=False), 
         storage=hist.storage.Double())
-    new_cov.view(flow=False)[...] = cov.view(flow=False)[indices, :][:, indices]
+    new_cov.view(flow=False)[...] = cov.view(flow=False)[np.ix_(indices, indices)]
 
     return new_cov
 
+def load_selected_covariance_pois(fitresult, poi_type="mu", gen_axes=[], selections={}, base_processes=[], flow=False):
+    # same as select_covariance_pois(*load_covariance_pois(...)), but the full matrix is not read if possible
+    if is_h5_file(fitresult):
+        names = load_poi_names_h5(fitresult, poi_type)
+        indices = filter_poi_bins(names, gen_axes, selections=selections, base_processes=base_processes, flow=flow)
+        values, _ = load_covariance_pois_h5(fitresult, poi_type, indices=indices)
+    elif is_root_file(fitresult):
+        values, names = load_covariance_pois_root(fitresult, poi_type)
+        indices = filter_poi_bins(names, gen_axes, selections=selections, base_processes=base_processes, flow=flow)
+        values = values[np.ix_(indices, indices)]
+    else:
+        raise IOError(f"Unknown fitresult format for object {fitresult}")
+
+    cov = hist.Hist(
+        hist.axis.Integer(start=0, stop=len(indices), underflow=False, overflow=False), 
+        hist.axis.Integer(start=0, stop=len(indices), underflow=False, overflow=False), 
+        storage=hist.storage.Double())
+    cov.view(flow=False)[...] = values
+    return cov
+
 def load_covariance_pois(fitresult, poi_type="mu"):   
     if is_root_file(fitresult):
         values, names = load_covariance_pois_root(fitresult, poi_type)
@@ -346,29 +370,40 @@ def load_covariance_pois_root(rtfile, poi_type="mu"):
     hcov = hist2d.values()
     return hcov, names
 
-def load_covariance_pois_h5(h5file, poi_type="mu"):   
-    matrix_key = f"{poi_type}_outcov"
+def load_poi_names_h5(h5file, poi_type="mu"):
     names_key = f"{poi_type}_names"
-    if matrix_key not in h5file.keys():
-        IOError(f"Matrix {matrix_key} was not found in the fit results file!")
     if names_key not in h5file.keys():
         IOError(f"Names {names_key} not found in the fit results file!")
+    return h5file[names_key][...].astype(str)
+
+def load_covariance_pois_h5(h5file, poi_type="mu", indices=None):   
+    matrix_key = f"{poi_type}_outcov"
+    if matrix_key not in h5file.keys():
+        IOError(f"Matrix {matrix_key} was not found in the fit results file!")
     
-    names = h5file[names_key][...].astype(str)
+    names = load_poi_names_h5(h5file, poi_type)
     npoi = len(names)
-    # make matrix between POIs only; assume POIs come first
-    hcov = h5file[f"{poi_type}_outcov"][:npoi,:npoi]
+    if indices is None:
+        # make matrix between POIs only; assume POIs come first
+        hcov = h5file[matrix_key][:npoi,:npoi]
+    else:
+        # read only the block spanned by the selected POIs
+        indices = np.asarray(indices, dtype=int)
+        if len(indices) == 0:
+            return np.zeros((0, 0)), names[indices]
+        lo, hi = indices.min(), indices.max()+1
+        hcov = h5file[matrix_key][lo:hi,lo:hi][np.ix_(indices-lo, indices-lo)]
+        names = names[indices]
     return hcov, names
 
 def get_theoryfit_data(fitresult, axes, base_processes = ["W"], poi_type="pmaskedexp", flow=False):
     logger.info(f"Prepare theory fit: load measured differential cross secction distribution and covariance matrix")
 
-    cov, names = load_covariance_pois(fitresult, poi_type)
-    df = read_impacts_pois(fitresult, poi_type, group=False, uncertainties=[])
-
     # select POIs 
     all_axes = [a for b in axes for a in b]
-    cov = select_covariance_pois(cov, names, gen_axes=all_axes, base_processes=base_processes, flow=flow)
+    cov = load_selected_covariance_pois(fitresult, poi_type, gen_axes=all_axes, base_processes=base_processes, flow=flow)
+
+    df = read_impacts_pois(fitresult, poi_type, group=False, uncertainties=[])
 
     # write out unfolded data as flat 1D hist for each channel
     data = []
@@ -2,6 +2,8 @@ import lz4.frame
 import pickle
 import hist
 from utilities import boostHistHelpers as hh,logging
+from utilities.io_tools import output_tools
+from utilities.h5pyutils import H5MappedHistProxy
 import numpy as np
 import os
 import json
@@ -16,11 +18,43 @@ logger = logging.child_logger(__name__)
 
 scetlib_tnp_match_expr = ["^gamma_.*[+|-]\d+", "^b_.*[+|-]\d+", "^s[+|-]\d+", "^h_.*\d+"]
 
-def load_results_h5py(h5file):
+def load_results_h5py(h5file, keys=None):
     if "results" in h5file.keys():
         return ioutils.pickle_load_h5py(h5file["results"])
     else:
-        return {k: ioutils.pickle_load_h5py(v) for k,v in h5file.items()}
+        results = {k: ioutils.pickle_load_h5py(v) for k,v in h5file.items() 
+            if k not in output_tools.reserved_keys and (keys is None or k in keys)}
+        if output_tools.mapped_hists_name in h5file.keys():
+            attach_mapped_hists(results, h5file)
+        return results
+
+def attach_mapped_hists(results, h5file):
+    # set the file location of histograms stored for memory mapping
+    for v in results.values():
+        if type(v) != dict or "output" not in v:
+            continue
+        for h in v["output"].values():
+            if isinstance(h, H5MappedHistProxy):
+                h.attach(h5file)
+
+def get_hist(h, selection=None, sum_axes=None):
+    # histogram from the output of the histmakers, with a selection of bins ({axis name : bin index}) and summed axes,
+    #   which are applied while reading for memory mapped histograms
+    if isinstance(h, H5MappedHistProxy):
+        return h.get(selection=selection, sum_axes=sum_axes)
+    if isinstance(h, ioutils.H5PickleProxy):
+        h = h.get()
+    if selection:
+        h = h[selection]
+    if sum_axes and any(ax in h.axes.name for ax in sum_axes):
+        h = h.project(*[ax for ax in h.axes.name if ax not in sum_axes])
+    return h
+
+def read_results_index(h5file):
+    # returns the index of the histmaker output, or None for files written without index
+    if output_tools.results_index_name not in h5file.keys():
+        return None
+    return json.loads(h5file[output_tools.results_index_name][()])
 
 def read_and_scale_pkllz4(fname, proc, histname, calculate_lumi=False, scale=1):
     with lz4.frame.open(fname) as f:
@@ -30,6 +64,11 @@ def read_and_scale_pkllz4(fname, proc, histname, calculate_lumi=False, scale=1):
 
 def read_hist_names(fname, proc):
     with h5py.File(fname, "r") as h5file:
+        index = read_results_index(h5file)
+        if index is not None:
+            if proc not in index:
+                raise ValueError(f"Invalid process {proc}! No output found in file {fname}")
+            return index[proc]["hists"].keys()
         results = load_results_h5py(h5file)
         if proc not in results:
             raise ValueError(f"Invalid process {proc}! No output found in file {fname}")
@@ -37,29 +76,49 @@ def read_hist_names(fname, proc):
 
 def read_keys(fname):
     with h5py.File(fname, "r") as h5file:
+        if "results" not in h5file.keys():
+            # top level keys are the keys of the results
+            return [k for k in h5file.keys() if k not in output_tools.reserved_keys]
         results = load_results_h5py(h5file)
         return results.keys()
 
 def read_xsec(fname, proc):
     with h5py.File(fname, "r") as h5file:
+        index = read_results_index(h5file)
+        if index is not None:
+            return index[proc]["dataset"]["xsec"]
         results = load_results_h5py(h5file)
         return results[proc]["dataset"]["xsec"]
 
 def read_sumw(fname, proc):
     with h5py.File(fname, "r") as h5file:
+        index = read_results_index(h5file)
+        if index is not None:
+            return index[proc]["weight_sum"]
         results = load_results_h5py(h5file)
         return results[proc]["weight_sum"]
 
-def read_and_scale(fname, proc, histname, calculate_lumi=False, scale=1, apply_xsec=True):
+def read_hist(fname, proc, histname, selection=None, sum_axes=None):
+    # read a single histogram, only the results of the given process are unpickled
     with h5py.File(fname, "r") as h5file:
-        results = load_results_h5py(h5file)
+        results = load_results_h5py(h5file, keys=[proc])
+        if proc not in results:
+            raise ValueError(f"Invalid process {proc}! No output found in file {fname}")
+        return get_hist(results[proc]["output"][histname], selection, sum_axes)
+
+def read_and_scale(fname, proc, histname, calculate_lumi=False, scale=1, apply_xsec=True, selection=None, sum_axes=None):
+    with h5py.File(fname, "r") as h5file:
+        index = read_results_index(h5file)
+        keys = None
+        if index is not None:
+            # only unpickle the requested process and the data processes needed for the luminosity
+            keys = [proc] + ([k for k, v in index.items() if v["dataset"].get("is_data", False)] if calculate_lumi else [])
+        results = load_results_h5py(h5file, keys=keys)
             
-        return load_and_scale(results, proc, histname, calculate_lumi, scale, apply_xsec)
+        return load_and_scale(results, proc, histname, calculate_lumi, scale, apply_xsec, selection, sum_axes)
 
-def load_and_scale(res_dict, proc, histname, calculate_lumi=False, scale=1., apply_xsec=True):
-    h = res_dict[proc]["output"][histname]
-    if isinstance(h, ioutils.H5PickleProxy):
-        h = h.get()
+def load_and_scale(res_dict, proc, histname, calculate_lumi=False, scale=1., apply_xsec=True, selection=None, sum_axes=None):
+    h = get_hist(res_dict[proc]["output"][histname], selection, sum_axes)
     if not res_dict[proc]["dataset"]["is_data"]:
         if apply_xsec:
             scale = res_dict[proc]["dataset"]["xsec"]/res_dict[proc]["weight_sum"]*scale
@@ -7,12 +7,15 @@ import hdf5plugin
 import h5py
 import narf
 import numpy as np
+import hist
 from utilities import common, logging
+from utilities.h5pyutils import H5MappedHistProxy
 import glob
 import shutil
 import lz4.frame
 import pickle
 import tempfile
+import json
 
 logger = logging.child_logger(__name__)
 
@@ -50,7 +53,75 @@ def writeMetaInfoToRootFile(rtfile, exclude_diff='notebooks', args=None):
         out = ROOT.TNamed(str(key), str(value))
         out.Write()
 
-def write_analysis_output(results, outfile, args):
+# name of the dataset with the json index of the histmaker output written next to the pickled results
+results_index_name = "results_index"
+# name of the group with the memory mappable histogram storages
+mapped_hists_name = "results_mmap"
+# top level keys in the output file that are not part of the results
+reserved_keys = [results_index_name, mapped_hists_name]
+
+def make_results_index(results):
+    # light weight summary of the results with metadata and histogram names, axes and sizes
+    #   that can be read without unpickling the results
+    index = {}
+    for k, v in results.items():
+        if type(v) != dict or "output" not in v:
+            continue
+
+        hists = {}
+        for h_name, h in v["output"].items():
+            obj = h.get() if isinstance(h, narf.ioutils.H5PickleProxy) else h
+            if hasattr(obj, "axes") and hasattr(obj, "view"):
+                hists[h_name] = {
+                    "axes": list(obj.axes.name),
+                    "shape": list(obj.axes.size),
+                    "storage": obj.storage_type.__name__,
+                    "nbytes": int(obj.view(flow=True).nbytes),
+                }
+            else:
+                hists[h_name] = {"type": type(obj).__name__}
+
+        index[k] = {
+            # round trip through json to drop anything that is not serializable
+            "dataset": json.loads(json.dumps(v.get("dataset", {}), default=str)),
+            "weight_sum": float(v["weight_sum"]) if "weight_sum" in v else None,
+            "event_count": float(v["event_count"]) if "event_count" in v else None,
+            "lumi": float(v["lumi"]) if "lumi" in v else None,
+            "hists": hists,
+        }
+    return index
+
+def make_mapped_results(results, h5file):
+    # replace the histograms by proxies to contiguous datasets that can be memory mapped when reading
+    mapped_results = {}
+    for k, v in results.items():
+        if type(v) != dict or "output" not in v:
+            mapped_results[k] = v
+            continue
+
+        h5group = h5file.require_group(f"{mapped_hists_name}/{k}")
+        output = {}
+        for h_name, h in v["output"].items():
+            obj = h.get() if isinstance(h, narf.ioutils.H5PickleProxy) else h
+            if hasattr(obj, "storage_type") and obj.storage_type in (hist.storage.Double, hist.storage.Weight):
+                if h_name in h5group.keys():
+                    del h5group[h_name]
+                output[h_name] = H5MappedHistProxy(obj, h5group, h_name)
+            else:
+                output[h_name] = h
+        mapped_results[k] = {**v, "output": output}
+    return mapped_results
+
+def write_results_index(h5file, index):
+    if results_index_name in h5file.keys():
+        # appending to an existing output, merge with the previous index
+        old_index = json.loads(h5file[results_index_name][()])
+        old_index.update(index)
+        index = old_index
+        del h5file[results_index_name]
+    h5file.create_dataset(results_index_name, data=json.dumps(index))
+
+def write_analysis_output(results, outfile, args, extra_meta_info=None):
     analysis_debug_output(results)
 
     to_append = []
@@ -62,6 +133,8 @@ def write_analysis_output(results, outfile, args):
         to_append.append(args.pdfs[0])
     if hasattr(args, "ptqVgen") and args.ptqVgen:
         to_append.append("vars_qtbyQ")
+    if getattr(args, "shard", None):
+        to_append.append("shard{0}of{1}".format(*args.shard.split("/")))
 
     if to_append and not args.forceDefaultName:
         outfile = outfile.replace(".hdf5", f"_{'_'.join(to_append)}.hdf5")
@@ -90,12 +163,23 @@ def write_analysis_output(results, outfile, args):
 
     time0 = time.time()
     with h5py.File(outfile, open_as) as f:
+        index = make_results_index(results)
+
+        if getattr(args, "mmapHists", False):
+            logger.info("Write histograms as contiguous datasets for memory mapping")
+            results = make_mapped_results(results, f)
+
         for k, v in results.items():
             logger.debug(f"Pickle and dump {k}")
             narf.ioutils.pickle_dump_h5py(k, v, f)
 
         if "meta_info" not in f.keys():
-            narf.ioutils.pickle_dump_h5py("meta_info", narf.ioutils.make_meta_info_dict(args=args, wd=common.base_dir), f)
+            meta_info = narf.ioutils.make_meta_info_dict(args=args, wd=common.base_dir)
+            if extra_meta_info:
+                meta_info.update(extra_meta_info)
+            narf.ioutils.pickle_dump_h5py("meta_info", meta_info, f)
+
+        write_results_index(f, index)
 
     logger.info(f"Writing output: {time.time()-time0}")
     logger.info(f"Output saved in {outfile}")
@@ -503,8 +503,6 @@ class CardTool(object):
             return {self.nominalName : hvar}
 
         systInfo = self.systematics[syst] 
-        systAxes = systInfo["systAxes"]
-        systAxesLabels = systInfo.get("labelsByAxis", systAxes)
 
         # Jan: moved above the mirror action, as this action can cause mirroring
         if systInfo["action"]:
@@ -515,6 +513,19 @@ class CardTool(object):
         if self.outfile:
             self.outfile.cd() # needed to restore the current directory in case the action opens a new root file
 
+        axNames, entries = self.systEntries(hvar, syst)
+
+        variations = [hvar[{ax : binnum for ax,binnum in zip(axNames, entry)}] for entry in entries]
+        names = self.systOutNames(hvar, syst, len(variations))
+
+        return {name : var for name,var in zip(names, variations) if name}
+
+    def systEntries(self, hvar, syst):
+        # names of the syst axes and the list of their bins for all variations, sets the output names the first time
+        systInfo = self.systematics[syst] 
+        systAxes = systInfo["systAxes"]
+        systAxesLabels = systInfo.get("labelsByAxis", systAxes)
+
         axNames = systAxes[:]
         axLabels = systAxesLabels[:]
         if hvar.axes[-1].name == "mirror":
@@ -555,14 +566,40 @@ class CardTool(object):
             if not len(systInfo["outNames"]):
                 raise RuntimeError(f"Did not find any valid variations for syst {syst}")
 
-        variations = [hvar[{ax : binnum for ax,binnum in zip(axNames, entry)}] for entry in entries]
-        if hvar.axes[-1].name == "mirror" and len(variations) == 2*len(systInfo["outNames"]):
+        return axNames, entries
+
+    def systOutNames(self, hvar, syst, nvariations):
+        systInfo = self.systematics[syst] 
+        if hvar.axes[-1].name == "mirror" and nvariations == 2*len(systInfo["outNames"]):
             systInfo["outNames"] = [n + d for n in systInfo["outNames"] for d in ["Up", "Down"]]
-        elif len(variations) != len(systInfo["outNames"]):
+        elif nvariations != len(systInfo["outNames"]):
             logger.warning(f"The number of variations doesn't match the number of names for "
-                f"syst {syst}. Found {len(systInfo['outNames'])} names and {len(variations)} variations.")
+                f"syst {syst}. Found {len(systInfo['outNames'])} names and {nvariations} variations.")
+        return systInfo["outNames"]
+
+    def hasSystTensor(self, syst):
+        # custom actions can change the axes of the histogram, and the ABCD projection needs the full histogram,
+        #   these variations are processed one by one with systHists
+        return not self.systematics[syst]["action"] and not self.simultaneousABCD
+
+    def systTensor(self, hvar, syst, axes):
+        # same variations as from systHists as a single array, with the variations as first dimension 
+        #   and the flattened bins of 'axes' (without flow) as second dimension, returns the output names and the array
+        axNames, entries = self.systEntries(hvar, syst)
+        names = self.systOutNames(hvar, syst, len(entries))
+
+        if list(hvar.axes.name) != [*axes, *axNames]:
+            hvar = hvar.project(*axes, *axNames)
+
+        flowAxes = self.systematics[syst]["systAxesFlow"]
+        def bins(ax, flow):
+            underflow = int(ax.traits.underflow)
+            return slice(None) if flow else slice(underflow, underflow+ax.size)
+        sel = tuple(bins(ax, ax.name in flowAxes and ax.name in axNames) for ax in hvar.axes)
 
-        return {name : var for name,var in zip(systInfo["outNames"], variations) if name}
+        values = hvar.values(flow=True)[sel]
+        values = np.moveaxis(values, list(range(len(axes), values.ndim)), list(range(len(axNames))))
+        return names, values.reshape(len(entries), -1)
 
     def getLogk(self, hvar, hnom, kfac=1., logkepsilon=math.log(1e-3)):
         # check if there is a sign flip between systematic and nominal
@@ -707,6 +744,44 @@ class CardTool(object):
                     logger.warning(f"syst {name} has Up/Down variation with {up_nBinsSystSameAsNomi:.1%}/{down_nBinsSystSameAsNomi:.1%} of bins equal to nominal")
 
 
+    def checkSystsTensor(self, names, values, nominal, proc, thresh=0.25, skipSameSide=False, skipOneAsNomi=False):
+        # same checks as checkSysts for all variations at once, on the output of systTensor and the flattened nominal bins
+        index = {name : i for i, name in enumerate(names) if name}
+        var_names = sorted(set([name.replace("Up", "").replace("Down", "") for name in index.keys()]))
+        if len(var_names) != len(index)/2:
+            raise ValueError(f"Invalid syst names for process {proc}! Expected an up/down variation for each syst. "
+                f"Found systs {var_names} and outNames {list(index.keys())}")
+
+        finite = np.all(np.isfinite(values), axis=-1)
+        if not np.all(finite):
+            bad = [name for name, i in index.items() if not finite[i]]
+            errMsg = f"One or more NAN or Inf values encountered in {len(bad)} variations, e.g. {bad[0]}"
+            logger.error(errMsg)
+            raise RuntimeError(errMsg)
+
+        up = values[[index[name+"Up"] for name in var_names]]
+        down = values[[index[name+"Down"] for name in var_names]]
+        nCellsWithoutOverflows = nominal.size
+
+        up_sameAsNomi = np.isclose(up, nominal, rtol=1e-07, atol=1e-08)
+        if not skipSameSide:
+            up_relsign = np.sign(up-nominal)
+            down_relsign = np.sign(down-nominal)
+            # protect against yields very close to nominal, for which it can be sign != 0 but should be treated as 0
+            vars_sameside = (up_relsign != 0) & (up_relsign == down_relsign) & np.logical_not(up_sameAsNomi)
+            perc_sameside = np.count_nonzero(vars_sameside, axis=-1)/nCellsWithoutOverflows
+            for name, perc in zip(var_names, perc_sameside):
+                if perc > thresh:
+                    logger.warning(f"{perc:.1%} bins are one sided for syst {name} and process {proc}!")
+
+        up_nBinsSystSameAsNomi = np.count_nonzero(up_sameAsNomi, axis=-1)/nCellsWithoutOverflows
+        down_nBinsSystSameAsNomi = np.count_nonzero(np.isclose(down, nominal, rtol=1e-06, atol=1e-08), axis=-1)/nCellsWithoutOverflows
+        varEqNomiThreshold = 1.0
+        for name, upSame, downSame in zip(var_names, up_nBinsSystSameAsNomi, down_nBinsSystSameAsNomi):
+            if upSame >= varEqNomiThreshold or downSame >= varEqNomiThreshold:
+                if not skipOneAsNomi or (upSame >= varEqNomiThreshold and downSame >= varEqNomiThreshold):
+                    logger.warning(f"syst {name} has Up/Down variation with {upSame:.1%}/{downSame:.1%} of bins equal to nominal")
+
     def writeForProcess(self, h, proc, syst, check_systs=True):
         hnom = None
         systInfo = None
@@ -6,29 +6,42 @@ import time
 import numpy as np
 import hist
 import h5py
-from utilities.h5pyutils import writeFlatInChunks, writeSparse
+from utilities.h5pyutils import writeFlatInChunks, writeFlatInBlocks, writeSparse, H5ArrayStore, H5FlatAppender
+from wremnants.logk_cache import LogkCache
 import math
 import pandas as pd
+import scipy.linalg
 import os
+import multiprocessing
 import narf
 import re
 from collections import defaultdict
 
 logger = logging.child_logger(__name__)
 
+# arguments shared with forked worker processes for loading the systematics in parallel
+_worker_args = None
+
+def _load_shape_systematic(isyst):
+    writer, chan, chanInfo, systematics, axes, forceNonzero, check_systs = _worker_args
+    systKey, syst = systematics[isyst]
+    return writer.load_shape_systematic(chan, chanInfo, systKey, syst, axes, forceNonzero, check_systs)
+
 class HDF5Writer(object):
     # keeps multiple card tools and writes them out in a single file to fit (appending the histograms)
-    def __init__(self, card_name="card", sparse=False):
+    def __init__(self, card_name="card", sparse=False, streaming=False, nWorkers=1, compressionThreads=1, codec="gzip", denseBlocks=False, float32=False, logkCache=None):
         self.cardName = card_name
         # settings for writing out hdf5 files
         self.dtype="float64"
         self.chunkSize=4*1024**2
+        self.codec=codec
         self.logkepsilon=math.log(1e-3) #numerical cutoff in case of zeros in systematic variations
 
         self.theoryFit = False
         self.theoryFitData = None
         self.theoryFitDataCov = None
         self.theoryFitMCStat = True # Whether or not to include the MC stat uncertainty in the thoery fit (in the covariance matrix)
+        self.theoryFitCholesky = False # Whether or not to factorize the covariance matrix with Cholesky instead of inverting it explicitly
 
         self.dict_noigroups = defaultdict(lambda: set())
         self.dict_noigroups_masked = defaultdict(lambda: set())
@@ -52,6 +65,23 @@ class HDF5Writer(object):
 
         self.sparse = sparse
 
+        # write logk arrays into a scratch file as soon as they are booked instead of keeping them in memory
+        self.streaming = streaming
+        self.scratch = None
+
+        # number of processes to load the shape systematics in parallel
+        self.nWorkers = nWorkers
+        # number of threads to compress the chunks of the output datasets
+        self.compressionThreads = compressionThreads
+
+        # write the dense logk tensor in blocks of bins without assembling it in memory, always done when streaming
+        self.denseBlocks = denseBlocks or streaming
+        # precision of the stored norm and logk tensors, the computations are done with self.dtype
+        self.storageDtype = "float32" if float32 else self.dtype
+
+        # directory of the on disk cache of the logk arrays, only the systematics which changed are recomputed
+        self.logkCache = LogkCache(logkCache) if logkCache else None
+
 
     def init_data_dicts(self):
         channels = self.get_channels()
@@ -77,7 +107,19 @@ class HDF5Writer(object):
             self.dict_logkhalfdiff = {c : {} for c in channels}
 
     def init_data_dicts_channel(self, channel, processes):
-        if self.sparse:
+        if self.streaming:
+            def make_stores(name, dtype):
+                return {p : H5ArrayStore(self.scratch.require_group(f"{channel}/{p}"), name, dtype, maxChunkBytes=self.chunkSize) for p in processes}
+
+            if self.sparse:
+                self.dict_logkavg_indices[channel] = make_stores("logkavg_indices", "int64")
+                self.dict_logkavg_values[channel] = make_stores("logkavg_values", self.dtype)
+                self.dict_logkhalfdiff_indices[channel] = make_stores("logkhalfdiff_indices", "int64")
+                self.dict_logkhalfdiff_values[channel] = make_stores("logkhalfdiff_values", self.dtype)
+            else:
+                self.dict_logkavg[channel] = make_stores("logkavg", self.dtype)
+                self.dict_logkhalfdiff[channel] = make_stores("logkhalfdiff", self.dtype)
+        elif self.sparse:
             self.dict_logkavg_indices[channel] = {p : {} for p in processes}
             self.dict_logkavg_values[channel] = {p : {} for p in processes}
             self.dict_logkhalfdiff_indices[channel] = {p : {} for p in processes}
@@ -86,13 +128,14 @@ class HDF5Writer(object):
             self.dict_logkavg[channel] = {p : {} for p in processes}
             self.dict_logkhalfdiff[channel] = {p : {} for p in processes}
 
-    def set_fitresult(self, fitresult_filename, poi_type="pmaskedexp", gen_flow=False, mc_stat=True):
+    def set_fitresult(self, fitresult_filename, poi_type="pmaskedexp", gen_flow=False, mc_stat=True, cholesky=False):
         if poi_type != "pmaskedexp":
             raise NotImplementedError("Theoryfit currently only supported for poi_type='pmaskedexp'")
         if len(self.get_channels()) > 1:
             logger.warning("Theoryfit for more than one channels is currently experimental")
         self.theoryFit = True
         self.theoryFitMCStat = mc_stat
+        self.theoryFitCholesky = cholesky
         base_processes = ["W" if c.datagroups.mode == "w_mass" else "Z" for c in self.get_channels().values()]
         axes = [c.fit_axes for c in self.get_channels().values()]
         fitresult = combinetf_input.get_fitresult(fitresult_filename)
@@ -141,7 +184,25 @@ class HDF5Writer(object):
         else:
             return h.values(flow=flow).flatten().astype(self.dtype)
 
-    def write(self, 
+    def write(self, args, outfolder, outfilename, **kwargs):
+        if not os.path.isdir(outfolder):
+            os.makedirs(outfolder)
+
+        if not self.streaming:
+            return self._write(args, outfolder, outfilename, **kwargs)
+
+        scratchpath = f"{outfolder}/{outfilename}_scratch.hdf5"
+        logger.info(f"Stream logk arrays to scratch file {scratchpath}")
+        self.scratch = h5py.File(scratchpath, mode='w')
+        try:
+            return self._write(args, outfolder, outfilename, **kwargs)
+        finally:
+            # the scratch file is dropped also if the writing failed
+            self.scratch.close()
+            self.scratch = None
+            os.remove(scratchpath)
+
+    def _write(self, 
         args,
         outfolder,
         outfilename,
@@ -201,6 +262,9 @@ class HDF5Writer(object):
             if len(dg.gen_axes) and not masked:
                 channel_info[chan]["gen_axes"] = dg.gen_axes
 
+            # input files of the channel, for the logk cache
+            infiles = [dg.infile]
+
             if not masked:                
                 # pseudodata
                 if chanInfo.pseudoData:
@@ -239,6 +303,7 @@ class HDF5Writer(object):
                     elif npseudodata != len(self.dict_pseudodata[chan]) or pseudoDataNames != pseudoDataNameList:
                         raise RuntimeError("Different pseudodata settings for different channels not supported!")
 
+                    infiles.append(chanInfo.pseudodata_datagroups.infile)
                     # release memory
                     del chanInfo.pseudodata_datagroups
                     for proc in chanInfo.datagroups.groups:
@@ -357,124 +422,54 @@ class HDF5Writer(object):
                 self.book_systematic(syst, var_name, masked=masked)
 
             # shape systematics
+            systematics = []
             for systKey, syst in chanInfo.systematics.items():
-                logger.info(f"Now in channel {chan} at shape systematic group {systKey}")
-
                 if chanInfo.isExcludedNuisance(systKey): 
                     continue
 
                 # some channels (e.g. xnorm) don't have all processes affected by the systematic
-                procs_syst = [p for p in syst["processes"] if p in procs_chan]
-                if len(procs_syst) == 0:
+                if not any(p in procs_chan for p in syst["processes"]):
                     continue
 
-                systName = systKey if not syst["name"] else syst["name"]
-
-                # Needed to avoid always reading the variation for the fakes, even for procs not specified
-                forceToNominal=[x for x in dg.getProcNames() if x not in 
-                    dg.getProcNames([p for g in procs_syst for p in chanInfo.expandProcesses(g) if p != dg.fakeName])]
-
-                dg.loadHistsForDatagroups(
-                    chanInfo.nominalName, systName, label="syst",
-                    procsToRead=procs_syst, 
-                    forceNonzero=forceNonzero and systName != "qcdScaleByHelicity",
-                    preOpMap=syst["preOpMap"], preOpArgs=syst["preOpArgs"], applySelection=syst["applySelection"],
-                    # Needed to avoid always reading the variation for the fakes, even for procs not specified
-                    forceToNominal=forceToNominal,
-                    scaleToNewLumi=chanInfo.lumiScale,
-                    nominalIfMissing=not chanInfo.xnorm, # for masked channels not all systematics exist (we can skip loading nominal since Fake does not exist)
-                    sumFakesPartial=not chanInfo.simultaneousABCD
-                )
-
-                for proc in procs_syst:
-                    logger.debug(f"Now at proc {proc}!")
-
-                    hvar = dg.groups[proc].hists["syst"]
-                    hnom = dg.groups[proc].hists[chanInfo.nominalName]
-
-                    var_map = chanInfo.systHists(hvar, systKey, hnom)
-
-                    var_names = [x[:-2] if "Up" in x[-2:] else (x[:-4] if "Down" in x[-4:] else x) 
-                        for x in filter(lambda x: x != "", var_map.keys())]
-                    # Deduplicate while keeping order
-                    var_names = list(dict.fromkeys(var_names))
-                    norm_proc = self.dict_norm[chan][proc]
-
-                    for var_name in var_names:
-                        kfac=syst["scale"]
-
-                        def get_logk(histname, var_type=""):
-                            _hist = var_map[histname+var_type]
-
-                            _syst = self.get_flat_values(_hist, chanInfo, axes, return_variances=False)
-
-                            if not np.all(np.isfinite(_syst)):
-                                raise RuntimeError(f"{len(_syst)-sum(np.isfinite(_syst))} NaN or Inf values encountered in systematic {var_name}!")
-
-                            # check if there is a sign flip between systematic and nominal
-                            _logk = kfac*np.log(_syst/norm_proc)
-                            _logk_view = np.where(np.equal(np.sign(norm_proc*_syst),1), _logk, self.logkepsilon*np.ones_like(_logk))
-                            _syst = None
-
-                            if self.clipSystVariations>0.:
-                                _logk = np.clip(_logk,-self.clip,self.clip)
-                            if self.clipSystVariationsSignal>0. and proc in signals:
-                                _logk = np.clip(_logk,-self.clipSig,self.clipSig)
-
-                            return _logk_view
-
-                        var_name_out = var_name
-
-                        if syst["mirror"]:
-                            logkavg_proc = get_logk(var_name)
-                        elif syst["symmetrize"] is not None:
-                            logkup_proc = get_logk(var_name, "Up")
-                            logkdown_proc = -get_logk(var_name, "Down")
+                systematics.append((systKey, syst))
 
-                            if syst["symmetrize"] == "conservative":
-                                # symmetrize by largest magnitude of up and down variations
-                                logkavg_proc = np.where(np.abs(logkup_proc) > np.abs(logkdown_proc), logkup_proc, logkdown_proc)
-                            elif syst["symmetrize"] == "average":
-                                # symmetrize by average of up and down variations
-                                logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
-                            elif syst["symmetrize"] in ["linear", "quadratic"]:
-                                # "linear" corresponds to a piecewise linear dependence of logk on theta
-                                # while "quadratic" corresponds to a quadratic dependence and leads
-                                # to a large variance
-                                diff_fact = np.sqrt(3.) if syst["symmetrize"]=="quadratic" else 1.
-
-                                # split asymmetric variation into two symmetric variations
-                                logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
-                                logkdiffavg_proc = 0.5*diff_fact*(logkup_proc - logkdown_proc)
-
-                                var_name_out = var_name + "SymAvg"
-                                var_name_out_diff = var_name + "SymDiff"
-
-                                #special case, book the extra systematic
-                                self.book_logk_avg(logkdiffavg_proc, chan, proc, var_name_out_diff)
-                                self.book_systematic(syst, var_name_out_diff, masked=masked)
-                        else:
-                            logkup_proc = get_logk(var_name, "Up")
-                            logkdown_proc = -get_logk(var_name, "Down")
-
-                            logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
-                            logkhalfdiff_proc = 0.5*(logkup_proc - logkdown_proc)
-
-                            logkup_proc = None
-                            logkdown_proc = None
-
-                            self.book_logk_halfdiff(logkhalfdiff_proc, chan, proc, var_name_out)
-
-                        self.book_logk_avg(logkavg_proc, chan, proc, var_name_out)
-                        self.book_systematic(syst, var_name_out, masked=masked)
-
-                    # free memory
-                    for var in var_map.keys():
-                        var_map[var] = None
-                    del dg.groups[proc].hists["syst"]
-
-                # release original histograms in the proxy objects
-                dg.release_results(f"{chanInfo.nominalName}_{systName}")
+            if self.logkCache:
+                self.logkCache.set_channel(args, chan, infiles, self.dict_norm[chan])
+                keys = [self.logkCache.key(systKey, syst) for systKey, syst in systematics]
+                missing = [i for i, key in enumerate(keys) if not self.logkCache.has(key)]
+                logger.info(f"Read {len(systematics)-len(missing)} shape systematic groups from the logk cache, recompute {len(missing)}")
+            else:
+                keys = [None]*len(systematics)
+                missing = list(range(len(systematics)))
+
+            def load_missing():
+                if self.nWorkers > 1 and len(missing) > 1:
+                    # load the systematics in forked processes which inherit the loaded nominal histograms, 
+                    #   the results are booked in the original order
+                    global _worker_args
+                    _worker_args = (self, chan, chanInfo, systematics, axes, forceNonzero, check_systs)
+                    logger.info(f"Load {len(missing)} shape systematic groups with {self.nWorkers} workers")
+                    with multiprocessing.get_context("fork").Pool(self.nWorkers) as pool:
+                        yield from pool.imap(_load_shape_systematic, missing)
+                    _worker_args = None
+                else:
+                    for i in missing:
+                        systKey, syst = systematics[i]
+                        yield self.load_shape_systematic(chan, chanInfo, systKey, syst, axes, forceNonzero, check_systs)
+
+            loaded = load_missing()
+            missing = set(missing)
+            for i, (systKey, syst) in enumerate(systematics):
+                if i in missing:
+                    bookings = next(loaded)
+                    if self.logkCache:
+                        self.logkCache.put(keys[i], bookings)
+                else:
+                    logger.debug(f"Read shape systematic group {systKey} from the logk cache")
+                    bookings = self.logkCache.get(keys[i])
+                self.book_shape_systematic(syst, bookings, chan, masked=masked)
+            # close the worker pool
+            next(loaded, None)
 
         procs = signals + bkgs
         nproc = len(procs)
@@ -511,6 +506,7 @@ class HDF5Writer(object):
         ibin = 0
         if self.sparse:
             logger.info(f"Write out sparse array")
+            time0 = time.time()
 
             idxdtype = 'int32'
             maxsparseidx = max(nbinsfull*nproc,2*nsyst)
@@ -518,175 +514,187 @@ class HDF5Writer(object):
                 logger.info("sparse array shapes are too large for index datatype, switching to int64")
                 idxdtype = 'int64'
 
-            norm_sparse_size = 0
-            norm_sparse_indices = np.zeros([norm_sparse_size,2],idxdtype)
-            norm_sparse_values = np.zeros([norm_sparse_size],self.dtype)
+            isysts = {syst: isyst for isyst, syst in enumerate(systs)}
 
+            # first pass: count the number of non-zero entries to allocate the output arrays only once
+            norm_sparse_size = 0
             logk_sparse_size = 0
-            logk_sparse_normindices = np.zeros([logk_sparse_size,1],idxdtype)
-            logk_sparse_systindices = np.zeros([logk_sparse_size,1],idxdtype)
-            logk_sparse_values = np.zeros([logk_sparse_size],self.dtype)
+            for chan in self.get_channels():
+                for proc, norm_proc in self.dict_norm[chan].items():
+                    if proc not in procs:
+                        continue
+                    norm_sparse_size += np.count_nonzero(norm_proc)
+                    for dict_logk_values in (self.dict_logkavg_values[chan], self.dict_logkhalfdiff_values[chan]):
+                        logk_values = dict_logk_values[proc]
+                        logk_sparse_size += sum(
+                            (logk_values.shape(s) if self.streaming else logk_values[s].shape)[0] 
+                            for s in logk_values.keys() if s in isysts)
+
+            if self.streaming:
+                # the sparse arrays are assembled in blocks of bins when writing the output
+                logger.info(f"Sparse arrays with {norm_sparse_size} norm and {logk_sparse_size} logk entries are written in blocks")
+            else:
+                logger.debug(f"Allocate sparse arrays with {norm_sparse_size} norm and {logk_sparse_size} logk entries")
+                norm_sparse_indices = np.empty([norm_sparse_size,2],idxdtype)
+                norm_sparse_values = np.empty([norm_sparse_size],self.storageDtype)
+
+                logk_sparse_normindices = np.empty([logk_sparse_size,1],idxdtype)
+                logk_sparse_systindices = np.empty([logk_sparse_size,1],idxdtype)
+                logk_sparse_values = np.empty([logk_sparse_size],self.storageDtype)
+
+                # second pass: fill the preallocated arrays at the running offsets
+                norm_offset = 0
+                logk_offset = 0
+                for nbinschan, chan in zip(ibins, self.get_channels()):
+                    dict_norm_chan = self.dict_norm[chan]
+                    dict_logkavg_chan_indices = self.dict_logkavg_indices[chan]
+                    dict_logkavg_chan_values = self.dict_logkavg_values[chan]
+                    dict_logkhalfdiff_chan_indices = self.dict_logkhalfdiff_indices[chan]
+                    dict_logkhalfdiff_chan_values = self.dict_logkhalfdiff_values[chan]
+
+                    for iproc, proc in enumerate(procs):
+                        if proc not in dict_norm_chan:
+                            continue
+                        norm_proc = dict_norm_chan[proc]
 
-            for nbinschan, chan in zip(ibins, self.get_channels()):
-                dict_norm_chan = self.dict_norm[chan]
-                dict_logkavg_chan_indices = self.dict_logkavg_indices[chan]
-                dict_logkavg_chan_values = self.dict_logkavg_values[chan]
-                dict_logkhalfdiff_chan_indices = self.dict_logkhalfdiff_indices[chan]
-                dict_logkhalfdiff_chan_values = self.dict_logkhalfdiff_values[chan]
+                        norm_indices = np.flatnonzero(norm_proc)
+                        nvals = len(norm_indices)
 
-                for iproc, proc in enumerate(procs):
-                    if proc not in dict_norm_chan:
-                        continue
-                    norm_proc = dict_norm_chan[proc]
+                        norm_sparse_indices[norm_offset:norm_offset+nvals, 0] = ibin + norm_indices
+                        norm_sparse_indices[norm_offset:norm_offset+nvals, 1] = iproc
+                        norm_sparse_values[norm_offset:norm_offset+nvals] = norm_proc[norm_indices]
+                        norm_indices = None
 
-                    norm_indices = np.transpose(np.nonzero(norm_proc))
-                    norm_values = np.reshape(norm_proc[norm_indices],[-1])
-                        
-                    nvals = len(norm_values)
-                    oldlength = norm_sparse_size
-                    norm_sparse_size = oldlength + nvals
-                    norm_sparse_indices.resize([norm_sparse_size,2])
-                    norm_sparse_values.resize([norm_sparse_size])
-                    
-                    out_indices = np.array([[ibin,iproc]]) + np.pad(norm_indices,((0,0),(0,1)),'constant')
-                    norm_indices = None
-                    
-                    norm_sparse_indices[oldlength:norm_sparse_size] = out_indices
-                    out_indices = None
-                    
-                    norm_sparse_values[oldlength:norm_sparse_size] = norm_values
-                    norm_values = None
-                    
-                    norm_idx_map = np.cumsum(np.not_equal(norm_proc, 0.)) - 1 + oldlength
-
-                    dict_logkavg_proc_indices = dict_logkavg_chan_indices[proc]
-                    dict_logkavg_proc_values = dict_logkavg_chan_values[proc]
-                    dict_logkhalfdiff_proc_indices = dict_logkhalfdiff_chan_indices[proc]
-                    dict_logkhalfdiff_proc_values = dict_logkhalfdiff_chan_values[proc]
-                    for isyst, syst in enumerate(systs):
-                        if syst not in dict_logkavg_proc_indices.keys():
-                            continue
+                        norm_idx_map = np.cumsum(np.not_equal(norm_proc, 0.)) - 1 + norm_offset
+                        norm_offset += nvals
+
+                        dict_logkavg_proc_indices = dict_logkavg_chan_indices[proc]
+                        dict_logkavg_proc_values = dict_logkavg_chan_values[proc]
+                        dict_logkhalfdiff_proc_indices = dict_logkhalfdiff_chan_indices[proc]
+                        dict_logkhalfdiff_proc_values = dict_logkhalfdiff_chan_values[proc]
+                        for isyst, syst in enumerate(systs):
+                            if syst not in dict_logkavg_proc_indices.keys():
+                                continue
 
-                        logkavg_proc_indices = dict_logkavg_proc_indices[syst]
-                        logkavg_proc_values = dict_logkavg_proc_values[syst]
-
-                        nvals_proc = len(logkavg_proc_values)
-                        oldlength = logk_sparse_size
-                        logk_sparse_size = oldlength + nvals_proc
-                        logk_sparse_normindices.resize([logk_sparse_size,1])
-                        logk_sparse_systindices.resize([logk_sparse_size,1])
-                        logk_sparse_values.resize([logk_sparse_size])
-
-                        #first dimension of output indices are NOT in the dense [nbin,nproc] space, but rather refer to indices in the norm_sparse vectors
-                        #second dimension is flattened in the [2,nsyst] space, where logkavg corresponds to [0,isyst] flattened to isyst
-                        #two dimensions are kept in separate arrays for now to reduce the number of copies needed later
-                        out_normindices = norm_idx_map[logkavg_proc_indices]
-                        logkavg_proc_indices = None
-                        
-                        logk_sparse_normindices[oldlength:logk_sparse_size] = out_normindices
-                        logk_sparse_systindices[oldlength:logk_sparse_size] = isyst
-                        out_normindices = None
-                        
-                        logk_sparse_values[oldlength:logk_sparse_size] = logkavg_proc_values
-                        logkavg_proc_values = None
-
-                        if syst in dict_logkhalfdiff_proc_indices:
-                            logkhalfdiff_proc_indices = dict_logkhalfdiff_proc_indices[syst]
-                            logkhalfdiff_proc_values = dict_logkhalfdiff_proc_values[syst]
-                            
-                            nvals_proc = len(logkhalfdiff_proc_values)
-                            oldlength = logk_sparse_size
-                            logk_sparse_size = oldlength + nvals_proc
-                            logk_sparse_normindices.resize([logk_sparse_size,1])
-                            logk_sparse_systindices.resize([logk_sparse_size,1])
-                            logk_sparse_values.resize([logk_sparse_size])
-                                    
-                            #out_indices = np.array([[ibin,iproc,isyst,1]]) + np.pad(logkhalfdiff_proc_indices,((0,0),(0,3)),'constant')
                             #first dimension of output indices are NOT in the dense [nbin,nproc] space, but rather refer to indices in the norm_sparse vectors
-                            #second dimension is flattened in the [2,nsyst] space, where logkhalfdiff corresponds to [1,isyst] flattened to nsyst + isyst
+                            #second dimension is flattened in the [2,nsyst] space, where logkavg corresponds to [0,isyst] flattened to isyst
+                            #and logkhalfdiff corresponds to [1,isyst] flattened to nsyst + isyst
                             #two dimensions are kept in separate arrays for now to reduce the number of copies needed later
-                            out_normindices = norm_idx_map[logkhalfdiff_proc_indices]
-                            logkhalfdiff_proc_indices = None
-                            
-                            logk_sparse_normindices[oldlength:logk_sparse_size] = out_normindices
-                            logk_sparse_systindices[oldlength:logk_sparse_size] = nsyst + isyst
-                            out_normindices = None
-                            
-                            logk_sparse_values[oldlength:logk_sparse_size] = logkhalfdiff_proc_values
-                            logkhalfdiff_proc_values = None
+                            for dict_logk_indices, dict_logk_values, systidx in (
+                                (dict_logkavg_proc_indices, dict_logkavg_proc_values, isyst),
+                                (dict_logkhalfdiff_proc_indices, dict_logkhalfdiff_proc_values, nsyst + isyst),
+                            ):
+                                if syst not in dict_logk_indices:
+                                    continue
+
+                                logk_proc_values = dict_logk_values[syst]
+                                nvals_proc = len(logk_proc_values)
+
+                                logk_sparse_normindices[logk_offset:logk_offset+nvals_proc] = norm_idx_map[dict_logk_indices[syst]]
+                                logk_sparse_systindices[logk_offset:logk_offset+nvals_proc] = systidx
+                                logk_sparse_values[logk_offset:logk_offset+nvals_proc] = logk_proc_values
+                                logk_proc_values = None
+
+                                logk_offset += nvals_proc
+
+                        # free memory
+                        dict_logkavg_proc_indices = None
+                        dict_logkavg_proc_values = None
+                        dict_logkhalfdiff_proc_indices = None
+                        dict_logkhalfdiff_proc_values = None
 
                     # free memory
-                    dict_logkavg_proc_indices = None
-                    dict_logkavg_proc_values = None
-                    dict_logkhalfdiff_proc_indices = None
-                    dict_logkhalfdiff_proc_values = None
+                    norm_proc = None
+                    norm_idx_map = None
 
-                # free memory
-                norm_proc = None
-                norm_idx_map = None
+                    ibin += nbinschan
 
-                ibin += nbinschan
-            
-            logger.info(f"Resize and sort sparse arrays into canonical order")
-            #resize sparse arrays to actual length
-            norm_sparse_indices.resize([norm_sparse_size,2])
-            norm_sparse_values.resize([norm_sparse_size])
-            logk_sparse_normindices.resize([logk_sparse_size,1])
-            logk_sparse_systindices.resize([logk_sparse_size,1])
-            logk_sparse_values.resize([logk_sparse_size])
+                if norm_offset != norm_sparse_size or logk_offset != logk_sparse_size:
+                    raise RuntimeError(f"Inconsistent sparse array sizes, expected ({norm_sparse_size}, {logk_sparse_size}) but filled ({norm_offset}, {logk_offset})")
+
+                logger.info(f"Sort sparse arrays into canonical order")
             
-            #straightforward sorting of norm_sparse into canonical order
-            norm_sparse_dense_shape = (nbinsfull, nproc)
-            norm_sort_indices = np.argsort(np.ravel_multi_index(np.transpose(norm_sparse_indices),norm_sparse_dense_shape))
-            norm_sparse_indices = norm_sparse_indices[norm_sort_indices]
-            norm_sparse_values = norm_sparse_values[norm_sort_indices]
+                #straightforward sorting of norm_sparse into canonical order
+                norm_sparse_dense_shape = (nbinsfull, nproc)
+                norm_sort_indices = np.argsort(np.ravel_multi_index(np.transpose(norm_sparse_indices),norm_sparse_dense_shape))
+                norm_sparse_indices = norm_sparse_indices[norm_sort_indices]
+                norm_sparse_values = norm_sparse_values[norm_sort_indices]
                 
-            #now permute the indices of the first dimension of logk_sparse corresponding to the resorting of norm_sparse
+                #now permute the indices of the first dimension of logk_sparse corresponding to the resorting of norm_sparse
             
-            #compute the inverse permutation from the sorting of norm_sparse
-            #since the final indices are filled from here, need to ensure it has the correct data type
-            logk_permute_indices = np.argsort(norm_sort_indices).astype(idxdtype)
-            norm_sort_indices = None
-            logk_sparse_normindices = logk_permute_indices[logk_sparse_normindices]
-            logk_permute_indices = None
-            logk_sparse_indices = np.concatenate([logk_sparse_normindices, logk_sparse_systindices],axis=-1)
-            logk_normindices = None
-
-            #now straightforward sorting of logk_sparse into canonical order
-            logk_sparse_dense_shape = (norm_sparse_indices.shape[0], 2*nsyst)
-            logk_sort_indices = np.argsort(np.ravel_multi_index(np.transpose(logk_sparse_indices),logk_sparse_dense_shape))
-            logk_sparse_indices = logk_sparse_indices[logk_sort_indices]
-            logk_sparse_values = logk_sparse_values[logk_sort_indices]
-            logk_sort_indices = None
+                #compute the inverse permutation from the sorting of norm_sparse
+                #since the final indices are filled from here, need to ensure it has the correct data type
+                logk_permute_indices = np.argsort(norm_sort_indices).astype(idxdtype)
+                norm_sort_indices = None
+                logk_sparse_normindices = logk_permute_indices[logk_sparse_normindices]
+                logk_permute_indices = None
+                logk_sparse_indices = np.concatenate([logk_sparse_normindices, logk_sparse_systindices],axis=-1)
+                logk_sparse_normindices = None
+                logk_sparse_systindices = None
+
+                #now straightforward sorting of logk_sparse into canonical order
+                logk_sparse_dense_shape = (norm_sparse_indices.shape[0], 2*nsyst)
+                logk_sort_indices = np.argsort(np.ravel_multi_index(np.transpose(logk_sparse_indices),logk_sparse_dense_shape))
+                logk_sparse_indices = logk_sparse_indices[logk_sort_indices]
+                logk_sparse_values = logk_sparse_values[logk_sort_indices]
+                logk_sort_indices = None
+
+                logger.info(f"Sparse array assembly: {time.time() - time0}")
 
         else:
             logger.info(f"Write out dense array")
             #initialize with zeros, i.e. no variation
-            norm = np.zeros([nbinsfull,nproc], self.dtype)
-            logk = np.zeros([nbinsfull,nproc,2,nsyst], self.dtype)
+            norm = np.zeros([nbinsfull,nproc], self.storageDtype)
+            logk = None
 
             for nbinschan, chan in zip(ibins, self.get_channels()):
                 dict_norm_chan = self.dict_norm[chan]
-                dict_logkavg_chan = self.dict_logkavg[chan]
-                dict_logkhalfdiff_chan = self.dict_logkhalfdiff[chan]
 
                 for iproc, proc in enumerate(procs):
                     if proc not in dict_norm_chan:
                         continue
                     norm[ibin:ibin+nbinschan, iproc] = dict_norm_chan[proc]
 
-                    dict_logkavg_proc = dict_logkavg_chan[proc]
-                    dict_logkhalfdiff_proc = dict_logkhalfdiff_chan[proc]
-                    for isyst, syst in enumerate(systs):
-                        if syst not in dict_logkavg_proc.keys():
-                            continue
-
-                        logk[ibin:ibin+nbinschan,iproc,0,isyst] = dict_logkavg_proc[syst]
-                        if syst in dict_logkhalfdiff_proc.keys():
-                            logk[ibin:ibin+nbinschan,iproc,1,isyst] = dict_logkhalfdiff_proc[syst]
-                        
                 ibin += nbinschan
 
+            def fill_logk(start, stop):
+                # logk for the bins [start, stop), only the overlapping part of the logk arrays is read
+                logk = np.zeros([stop-start,nproc,2,nsyst], self.storageDtype)
+
+                ibin = 0
+                for nbinschan, chan in zip(ibins, self.get_channels()):
+                    lo = max(start, ibin)
+                    hi = min(stop, ibin+nbinschan)
+                    if lo < hi:
+                        dict_norm_chan = self.dict_norm[chan]
+                        dict_logkavg_chan = self.dict_logkavg[chan]
+                        dict_logkhalfdiff_chan = self.dict_logkhalfdiff[chan]
+
+                        def get(values, syst):
+                            if isinstance(values, H5ArrayStore):
+                                return values.slice(syst, lo-ibin, hi-ibin)
+                            return values[syst][lo-ibin:hi-ibin]
+
+                        for iproc, proc in enumerate(procs):
+                            if proc not in dict_norm_chan:
+                                continue
+
+                            dict_logkavg_proc = dict_logkavg_chan[proc]
+                            dict_logkhalfdiff_proc = dict_logkhalfdiff_chan[proc]
+                            for isyst, syst in enumerate(systs):
+                                if syst not in dict_logkavg_proc.keys():
+                                    continue
+
+                                logk[lo-start:hi-start,iproc,0,isyst] = get(dict_logkavg_proc, syst)
+                                if syst in dict_logkhalfdiff_proc.keys():
+                                    logk[lo-start:hi-start,iproc,1,isyst] = get(dict_logkhalfdiff_proc, syst)
+
+                    ibin += nbinschan
+                return logk
+
+            if not self.denseBlocks:
+                logk = fill_logk(0, nbinsfull)
+
         #compute poisson parameter for Barlow-Beeston bin-by-bin statistical uncertainties
         kstat = np.square(sumw)/sumw2
         #numerical protection to avoid poorly defined constraint
@@ -694,16 +702,14 @@ class HDF5Writer(object):
         kstat = np.where(np.equal(sumw2,0.), 1., kstat)
 
         #write results to hdf5 file
-        procSize = nproc*np.dtype(self.dtype).itemsize
-        systSize = 2*nsyst*np.dtype(self.dtype).itemsize
+        procSize = nproc*np.dtype(self.storageDtype).itemsize
+        systSize = 2*nsyst*np.dtype(self.storageDtype).itemsize
         amax = np.max([procSize,systSize])
         if amax > self.chunkSize:
             logger.warning(f"Maximum chunk size in bytes was increased from {self.chunkSize} to {amax} to align with tensor sizes and allow more efficient reading/writing.")
             self.chunkSize = amax
 
         #create HDF5 file (chunk cache set to the chunk size since we can guarantee fully aligned writes
-        if not os.path.isdir(outfolder):
-            os.makedirs(outfolder)
         outpath = f"{outfolder}/{outfilename}.hdf5"
         logger.info(f"Write output file {outpath}")
         f = h5py.File(outpath, rdcc_nbytes=self.chunkSize, mode='w')
@@ -785,13 +791,13 @@ class HDF5Writer(object):
         nbytes = 0
 
         constraintweights = self.get_constraintweights(self.dtype)
-        nbytes += writeFlatInChunks(constraintweights, f, "hconstraintweights", maxChunkBytes = self.chunkSize)
+        nbytes += writeFlatInChunks(constraintweights, f, "hconstraintweights", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
         constraintweights = None
 
-        nbytes += writeFlatInChunks(data_obs, f, "hdata_obs", maxChunkBytes = self.chunkSize)
+        nbytes += writeFlatInChunks(data_obs, f, "hdata_obs", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
         data_obs = None
 
-        nbytes += writeFlatInChunks(pseudodata, f, "hpseudodata", maxChunkBytes = self.chunkSize)
+        nbytes += writeFlatInChunks(pseudodata, f, "hpseudodata", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
         pseudodata = None
 
         if self.theoryFitDataCov is not None:
@@ -799,29 +805,358 @@ class HDF5Writer(object):
             if data_cov.shape != (nbins,nbins):
                 raise RuntimeError(f"covariance matrix has incompatible shape of {data_cov.shape}, expected is {(nbins,nbins)}!")
             full_cov = np.add(data_cov,np.diag(sumw2)) if self.theoryFitMCStat else data_cov
-            nbytes += writeFlatInChunks(np.linalg.inv(full_cov), f, "hdata_cov_inv", maxChunkBytes = self.chunkSize)
+            if self.theoryFitCholesky:
+                cov_chol, cov_inv = self.factorize_covariance(full_cov)
+                if cov_chol is not None:
+                    nbytes += writeFlatInChunks(cov_chol, f, "hdata_cov_chol", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
+                    cov_chol = None
+                nbytes += writeFlatInChunks(cov_inv, f, "hdata_cov_inv", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
+                cov_inv = None
+            else:
+                nbytes += writeFlatInChunks(np.linalg.inv(full_cov), f, "hdata_cov_inv", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
             data_cov = None
             full_cov = None
 
-        nbytes += writeFlatInChunks(kstat, f, "hkstat", maxChunkBytes = self.chunkSize)
+        nbytes += writeFlatInChunks(kstat, f, "hkstat", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
         kstat = None
 
-        if self.sparse:
-            nbytes += writeSparse(norm_sparse_indices, norm_sparse_values, norm_sparse_dense_shape, f, "hnorm_sparse", maxChunkBytes = self.chunkSize)
+        if self.sparse and self.streaming:
+            time0 = time.time()
+            nbytes += self.write_sparse_in_blocks(f, procs, systs, ibins, idxdtype, norm_sparse_size, logk_sparse_size)
+            logger.info(f"Write sparse arrays in blocks: {time.time() - time0}")
+        elif self.sparse:
+            nbytes += writeSparse(norm_sparse_indices, norm_sparse_values, norm_sparse_dense_shape, f, "hnorm_sparse", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
             norm_sparse_indices = None
             norm_sparse_values = None
-            nbytes += writeSparse(logk_sparse_indices, logk_sparse_values, logk_sparse_dense_shape, f, "hlogk_sparse", maxChunkBytes = self.chunkSize)
+            nbytes += writeSparse(logk_sparse_indices, logk_sparse_values, logk_sparse_dense_shape, f, "hlogk_sparse", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
             logk_sparse_indices = None
             logk_sparse_values = None
         else:
-            nbytes += writeFlatInChunks(norm, f, "hnorm", maxChunkBytes = self.chunkSize)
+            nbytes += writeFlatInChunks(norm, f, "hnorm", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
             norm = None
-            nbytes += writeFlatInChunks(logk, f, "hlogk", maxChunkBytes = self.chunkSize)
-            logk = None
+            if self.denseBlocks:
+                time0 = time.time()
+                nbytes += writeFlatInBlocks([nbinsfull,nproc,2,nsyst], self.storageDtype, fill_logk, f, "hlogk", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
+                logger.info(f"Write logk in blocks: {time.time() - time0}")
+            else:
+                nbytes += writeFlatInChunks(logk, f, "hlogk", maxChunkBytes = self.chunkSize, codec = self.codec, nThreads = self.compressionThreads)
+                logk = None
 
         logger.info(f"Total raw bytes in arrays = {nbytes}")
 
 
+    def write_sparse_in_blocks(self, f, procs, systs, ibins, idxdtype, norm_sparse_size, logk_sparse_size, maxBlockEntries=2**24):
+        # sparse arrays in canonical order assembled from blocks of bins of each channel, the entries of a block are sorted
+        #   and appended to the output, such that only one block is in memory at a time
+        nproc = len(procs)
+        nsyst = len(systs)
+        isysts = {syst: isyst for isyst, syst in enumerate(systs)}
+
+        nblocks = max(1, math.ceil(max(norm_sparse_size, logk_sparse_size)/maxBlockEntries))
+        blocksize = max(1, math.ceil(sum(ibins)/nblocks))
+
+        norm_group = f.create_group("hnorm_sparse")
+        logk_group = f.create_group("hlogk_sparse")
+        opts = dict(maxChunkBytes=self.chunkSize, codec=self.codec)
+        norm_indices_out = H5FlatAppender(norm_group, "indices", idxdtype, **opts)
+        norm_values_out = H5FlatAppender(norm_group, "values", self.storageDtype, **opts)
+        logk_indices_out = H5FlatAppender(logk_group, "indices", idxdtype, **opts)
+        logk_values_out = H5FlatAppender(logk_group, "values", self.storageDtype, **opts)
+
+        norm_offset = 0
+        logk_offset = 0
+        ibin = 0
+        for nbinschan, chan in zip(ibins, self.get_channels()):
+            dict_norm_chan = self.dict_norm[chan]
+            bounds = np.append(np.arange(0, nbinschan, blocksize), nbinschan)
+
+            # the bin indices of each logk array are sorted, the offsets of the block boundaries are found reading one array at a time
+            logk_arrays = []
+            for iproc, proc in enumerate(procs):
+                if proc not in dict_norm_chan:
+                    continue
+                for dict_indices, dict_values, isystoffset in (
+                    (self.dict_logkavg_indices[chan][proc], self.dict_logkavg_values[chan][proc], 0),
+                    (self.dict_logkhalfdiff_indices[chan][proc], self.dict_logkhalfdiff_values[chan][proc], nsyst),
+                ):
+                    for syst in dict_indices.keys():
+                        if syst not in isysts:
+                            continue
+                        offsets = np.searchsorted(dict_indices[syst].reshape(-1), bounds)
+                        logk_arrays.append((iproc, isystoffset + isysts[syst], dict_indices, dict_values, syst, offsets))
+
+            for iblock in range(len(bounds)-1):
+                lo, hi = bounds[iblock], bounds[iblock+1]
+
+                # norm entries sorted by bin and process
+                norm_block = np.zeros([hi-lo, nproc], self.dtype)
+                for iproc, proc in enumerate(procs):
+                    if proc in dict_norm_chan:
+                        norm_block[:, iproc] = dict_norm_chan[proc][lo:hi]
+                bins, iprocs = np.nonzero(norm_block)
+                nvals = len(bins)
+                norm_indices_out.append(np.stack([ibin + lo + bins, iprocs], axis=-1))
+                norm_values_out.append(norm_block[bins, iprocs])
+                norm_block = None
+
+                # index of each (bin, process) in the norm arrays
+                norm_idx_map = np.full([hi-lo, nproc], -1, "int64")
+                norm_idx_map[bins, iprocs] = norm_offset + np.arange(nvals)
+                norm_offset += nvals
+
+                logk_normindices = []
+                logk_systindices = []
+                logk_values = []
+                for iproc, systidx, dict_indices, dict_values, syst, offsets in logk_arrays:
+                    start, stop = offsets[iblock], offsets[iblock+1]
+                    if start == stop:
+                        continue
+                    logk_normindices.append(norm_idx_map[dict_indices.slice(syst, start, stop) - lo, iproc])
+                    logk_systindices.append(np.full(stop-start, systidx, "int64"))
+                    logk_values.append(dict_values.slice(syst, start, stop))
+                norm_idx_map = None
+
+                if logk_values:
+                    logk_normindices = np.concatenate(logk_normindices)
+                    logk_systindices = np.concatenate(logk_systindices)
+                    logk_sort_indices = np.lexsort((logk_systindices, logk_normindices))
+                    logk_indices_out.append(np.stack([logk_normindices[logk_sort_indices], logk_systindices[logk_sort_indices]], axis=-1))
+                    logk_values_out.append(np.concatenate(logk_values)[logk_sort_indices])
+                    logk_offset += len(logk_sort_indices)
+                logk_normindices = None
+                logk_systindices = None
+                logk_values = None
+
+            ibin += nbinschan
+
+        if norm_offset != norm_sparse_size or logk_offset != logk_sparse_size:
+            raise RuntimeError(f"Inconsistent sparse array sizes, expected ({norm_sparse_size}, {logk_sparse_size}) but filled ({norm_offset}, {logk_offset})")
+
+        nbytes = 0
+        nbytes += norm_indices_out.close([norm_sparse_size, 2])
+        nbytes += norm_values_out.close([norm_sparse_size])
+        nbytes += logk_indices_out.close([logk_sparse_size, 2])
+        nbytes += logk_values_out.close([logk_sparse_size])
+        norm_group.attrs['dense_shape'] = np.array([sum(ibins), nproc], dtype='int64')
+        logk_group.attrs['dense_shape'] = np.array([norm_sparse_size, 2*nsyst], dtype='int64')
+
+        return nbytes
+
+    def factorize_covariance(self, cov):
+        # lower triangular Cholesky factor from LAPACK and the inverse computed from it,
+        #   falls back to the explicit inverse if the matrix is not positive definite
+        time0 = time.time()
+        chol, info = scipy.linalg.lapack.dpotrf(cov, lower=True, clean=True)
+        if info != 0:
+            eigvals = np.linalg.eigvalsh(cov)
+            cond = abs(eigvals[-1]/eigvals[0]) if eigvals[0] != 0 else np.inf
+            logger.warning(f"Cholesky factorization of the covariance matrix failed at row {info}, smallest eigenvalue is {eigvals[0]} and condition number is {cond}. Use the explicit inverse instead")
+            return None, np.linalg.inv(cov)
+
+        inv, info = scipy.linalg.lapack.dpotri(chol, lower=True)
+        if info != 0:
+            raise RuntimeError(f"Inversion of the covariance matrix from the Cholesky factor failed at row {info}")
+        # only the lower triangle is filled
+        inv = np.tril(inv) + np.tril(inv, -1).T
+
+        logger.info(f"Cholesky factorization of the covariance matrix: {time.time() - time0}")
+        return chol, inv
+
+    def load_shape_systematic(self, chan, chanInfo, systKey, syst, axes, forceNonzero=False, check_systs=False):
+        # load the histograms of one shape systematic group and compute the logk arrays, 
+        #   returns a list of (process, systematic name, logkavg, logkhalfdiff) to be booked
+        logger.info(f"Now in channel {chan} at shape systematic group {systKey}")
+
+        dg = chanInfo.datagroups
+        procs_chan = chanInfo.predictedProcesses()
+        signals = self.get_signals()
+
+        procs_syst = [p for p in syst["processes"] if p in procs_chan]
+
+        systName = systKey if not syst["name"] else syst["name"]
+
+        # Needed to avoid always reading the variation for the fakes, even for procs not specified
+        forceToNominal=[x for x in dg.getProcNames() if x not in 
+            dg.getProcNames([p for g in procs_syst for p in chanInfo.expandProcesses(g) if p != dg.fakeName])]
+
+        dg.loadHistsForDatagroups(
+            chanInfo.nominalName, systName, label="syst",
+            procsToRead=procs_syst, 
+            forceNonzero=forceNonzero and systName != "qcdScaleByHelicity",
+            preOpMap=syst["preOpMap"], preOpArgs=syst["preOpArgs"], applySelection=syst["applySelection"],
+            # Needed to avoid always reading the variation for the fakes, even for procs not specified
+            forceToNominal=forceToNominal,
+            scaleToNewLumi=chanInfo.lumiScale,
+            nominalIfMissing=not chanInfo.xnorm, # for masked channels not all systematics exist (we can skip loading nominal since Fake does not exist)
+            sumFakesPartial=not chanInfo.simultaneousABCD
+        )
+
+        bookings = []
+        for proc in procs_syst:
+            logger.debug(f"Now at proc {proc}!")
+
+            hvar = dg.groups[proc].hists["syst"]
+            hnom = dg.groups[proc].hists[chanInfo.nominalName]
+
+            if chanInfo.hasSystTensor(systKey):
+                bookings.extend(self.get_logk_tensor(chan, chanInfo, proc, systKey, syst, hvar, axes, check_systs))
+                del dg.groups[proc].hists["syst"]
+                continue
+
+            var_map = chanInfo.systHists(hvar, systKey, hnom)
+            if check_systs and not syst["mirror"]:
+                chanInfo.checkSysts(var_map, proc)
+
+            var_names = [x[:-2] if "Up" in x[-2:] else (x[:-4] if "Down" in x[-4:] else x) 
+                for x in filter(lambda x: x != "", var_map.keys())]
+            # Deduplicate while keeping order
+            var_names = list(dict.fromkeys(var_names))
+            norm_proc = self.dict_norm[chan][proc]
+
+            for var_name in var_names:
+                kfac=syst["scale"]
+
+                def get_logk(histname, var_type=""):
+                    _hist = var_map[histname+var_type]
+
+                    _syst = self.get_flat_values(_hist, chanInfo, axes, return_variances=False)
+
+                    if not np.all(np.isfinite(_syst)):
+                        raise RuntimeError(f"{len(_syst)-sum(np.isfinite(_syst))} NaN or Inf values encountered in systematic {var_name}!")
+
+                    # check if there is a sign flip between systematic and nominal
+                    _logk = kfac*np.log(_syst/norm_proc)
+                    _logk_view = np.where(np.equal(np.sign(norm_proc*_syst),1), _logk, self.logkepsilon*np.ones_like(_logk))
+                    _syst = None
+
+                    if self.clipSystVariations>0.:
+                        _logk = np.clip(_logk,-self.clip,self.clip)
+                    if self.clipSystVariationsSignal>0. and proc in signals:
+                        _logk = np.clip(_logk,-self.clipSig,self.clipSig)
+
+                    return _logk_view
+
+                var_name_out = var_name
+                logkhalfdiff_proc = None
+
+                if syst["mirror"]:
+                    logkavg_proc = get_logk(var_name)
+                elif syst["symmetrize"] is not None:
+                    logkup_proc = get_logk(var_name, "Up")
+                    logkdown_proc = -get_logk(var_name, "Down")
+
+                    if syst["symmetrize"] == "conservative":
+                        # symmetrize by largest magnitude of up and down variations
+                        logkavg_proc = np.where(np.abs(logkup_proc) > np.abs(logkdown_proc), logkup_proc, logkdown_proc)
+                    elif syst["symmetrize"] == "average":
+                        # symmetrize by average of up and down variations
+                        logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
+                    elif syst["symmetrize"] in ["linear", "quadratic"]:
+                        # "linear" corresponds to a piecewise linear dependence of logk on theta
+                        # while "quadratic" corresponds to a quadratic dependence and leads
+                        # to a large variance
+                        diff_fact = np.sqrt(3.) if syst["symmetrize"]=="quadratic" else 1.
+
+                        # split asymmetric variation into two symmetric variations
+                        logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
+                        logkdiffavg_proc = 0.5*diff_fact*(logkup_proc - logkdown_proc)
+
+                        var_name_out = var_name + "SymAvg"
+                        var_name_out_diff = var_name + "SymDiff"
+
+                        #special case, book the extra systematic
+                        bookings.append((proc, var_name_out_diff, logkdiffavg_proc, None))
+                else:
+                    logkup_proc = get_logk(var_name, "Up")
+                    logkdown_proc = -get_logk(var_name, "Down")
+
+                    logkavg_proc = 0.5*(logkup_proc + logkdown_proc)
+                    logkhalfdiff_proc = 0.5*(logkup_proc - logkdown_proc)
+
+                    logkup_proc = None
+                    logkdown_proc = None
+
+                bookings.append((proc, var_name_out, logkavg_proc, logkhalfdiff_proc))
+
+            # free memory
+            for var in var_map.keys():
+                var_map[var] = None
+            del dg.groups[proc].hists["syst"]
+
+        # release original histograms in the proxy objects
+        dg.release_results(f"{chanInfo.nominalName}_{systName}")
+
+        return bookings
+
+    def get_logk_tensor(self, chan, chanInfo, proc, systKey, syst, hvar, axes, check_systs=False):
+        # logk arrays of all variations of a systematic and process from a single array of the variations,
+        #   equivalent to the per variation computation in load_shape_systematic
+        names, values = chanInfo.systTensor(hvar, systKey, axes)
+        values = values.astype(self.dtype)
+        norm_proc = self.dict_norm[chan][proc]
+
+        if check_systs and not syst["mirror"]:
+            chanInfo.checkSystsTensor(names, values, norm_proc, proc)
+
+        index = {name : i for i, name in enumerate(names) if name}
+        finite = np.all(np.isfinite(values), axis=-1)
+        if not np.all(finite):
+            bad = [name for name, i in index.items() if not finite[i]]
+            raise RuntimeError(f"NaN or Inf values encountered in systematic {bad[0]} and {len(bad)-1} others!")
+
+        # check if there is a sign flip between systematic and nominal
+        with np.errstate(divide="ignore", invalid="ignore"):
+            logk = syst["scale"]*np.log(values/norm_proc)
+        logk = np.where(np.equal(np.sign(norm_proc*values), 1), logk, self.logkepsilon)
+        values = None
+
+        var_names = [x[:-2] if "Up" in x[-2:] else (x[:-4] if "Down" in x[-4:] else x) for x in index.keys()]
+        # Deduplicate while keeping order
+        var_names = list(dict.fromkeys(var_names))
+
+        bookings = []
+        if syst["mirror"]:
+            logkavg = logk[[index[n] for n in var_names]]
+            for var_name, logkavg_proc in zip(var_names, logkavg):
+                bookings.append((proc, var_name, logkavg_proc, None))
+            return bookings
+
+        logkup = logk[[index[n+"Up"] for n in var_names]]
+        logkdown = -logk[[index[n+"Down"] for n in var_names]]
+        logk = None
+
+        logkhalfdiff = None
+        logkdiffavg = None
+        if syst["symmetrize"] == "conservative":
+            # symmetrize by largest magnitude of up and down variations
+            logkavg = np.where(np.abs(logkup) > np.abs(logkdown), logkup, logkdown)
+        elif syst["symmetrize"] == "average":
+            # symmetrize by average of up and down variations
+            logkavg = 0.5*(logkup + logkdown)
+        elif syst["symmetrize"] in ["linear", "quadratic"]:
+            # split asymmetric variation into two symmetric variations
+            diff_fact = np.sqrt(3.) if syst["symmetrize"]=="quadratic" else 1.
+            logkavg = 0.5*(logkup + logkdown)
+            logkdiffavg = 0.5*diff_fact*(logkup - logkdown)
+        else:
+            logkavg = 0.5*(logkup + logkdown)
+            logkhalfdiff = 0.5*(logkup - logkdown)
+
+        for i, var_name in enumerate(var_names):
+            if logkdiffavg is not None:
+                bookings.append((proc, var_name + "SymDiff", logkdiffavg[i], None))
+                var_name = var_name + "SymAvg"
+            bookings.append((proc, var_name, logkavg[i], logkhalfdiff[i] if logkhalfdiff is not None else None))
+
+        return bookings
+
+    def book_shape_systematic(self, syst, bookings, chan, masked=False):
+        for proc, name, logkavg_proc, logkhalfdiff_proc in bookings:
+            if logkhalfdiff_proc is not None:
+                self.book_logk_halfdiff(logkhalfdiff_proc, chan, proc, name)
+            self.book_logk_avg(logkavg_proc, chan, proc, name)
+            self.book_systematic(syst, name, masked=masked)
+
     def book_logk_avg(self, *args):
         self.book_logk(self.dict_logkavg, self.dict_logkavg_indices, self.dict_logkavg_values, *args)
     
@@ -4,11 +4,15 @@ import pathlib
 
 ROOT.gInterpreter.AddIncludePath(f"{pathlib.Path(__file__).parent}/include/")
 
-narf.clingutils.Declare('#include "muonCorr.h"')
-narf.clingutils.Declare('#include "histoScaling.h"')
-narf.clingutils.Declare('#include "histHelpers.h"')
-narf.clingutils.Declare('#include "utils.h"')
-narf.clingutils.Declare('#include "csVariables.h"')
+# use the compiled headers and template instantiations if available, before any header is declared
+from wremnants import cling_cache
+cling_cache.load()
+
+cling_cache.declare("muonCorr.h")
+cling_cache.declare("histoScaling.h")
+cling_cache.declare("histHelpers.h")
+cling_cache.declare("utils.h")
+cling_cache.declare("csVariables.h")
 narf.clingutils.Declare('#include "EtaPtCorrelatedEfficiency.h"')
-narf.clingutils.Declare('#include "theoryTools.h"')
-narf.clingutils.Declare('#include "syst_helicity_utils_polvar.h"')
+cling_cache.declare("theoryTools.h")
+cling_cache.declare("syst_helicity_utils_polvar.h")
@@ -0,0 +1,161 @@
+import ROOT
+import narf
+import hashlib
+import os
+import pathlib
+import time
+from utilities import logging
+
+logger = logging.child_logger(__name__)
+
+# shared library with the wremnants headers and the template instantiations of the helpers compiled ahead of time,
+#   it is keyed on the hash of the wremnants and narf headers and the ROOT version, the cache is only used if a directory is given
+#   with the WREMNANTS_CLING_CACHE environment variable (it is loaded when wremnants is imported, before the arguments are parsed)
+cache_dir = os.environ.get("WREMNANTS_CLING_CACHE", "")
+include_dir = pathlib.Path(__file__).parent / "include"
+# the wremnants headers include the narf headers
+narf_dir = pathlib.Path(narf.__file__).parent
+
+cached_headers = [
+    "muonCorr.h",
+    "histoScaling.h",
+    "histHelpers.h",
+    "utils.h",
+    "csVariables.h",
+    "theoryTools.h",
+    "theory_corrections.h",
+    "syst_helicity_utils.h",
+    "syst_helicity_utils_polvar.h",
+    "muon_calibration.h",
+    "muon_prefiring.h",
+    "muon_efficiencies_binned.h",
+    "muon_efficiencies_smooth.h",
+    "muon_efficiencies_veto.h",
+    "pileup.h",
+    "vertex.h",
+]
+
+library_name = "libwremnants_cling_cache"
+# instantiations seen in the histmaker runs, they are compiled into the library by scripts/utilities/build_cling_cache.py
+recorded_instantiations_file = "instantiations.txt"
+
+# set by load(), the declarations of the cached headers are then provided by the dictionary of the library
+loaded = False
+
+def cache_key():
+    sha = hashlib.sha256(ROOT.gROOT.GetVersion().encode())
+    for base, headers in [(include_dir, include_dir.glob("*.h")), (narf_dir, narf_dir.rglob("*.h"))]:
+        for header in sorted(headers):
+            sha.update(str(header.relative_to(base)).encode())
+            sha.update(header.read_bytes())
+    return sha.hexdigest()[:16]
+
+def library_dir(key=None):
+    return f"{cache_dir}/{key if key else cache_key()}"
+
+def read_instantiations(filename):
+    if not os.path.isfile(filename):
+        return []
+    with open(filename) as f:
+        return [l.strip() for l in f if l.strip()]
+
+def write_instantiations(filename, names):
+    tmpname = f"{filename}.{os.getpid()}.tmp"
+    with open(tmpname, "w") as f:
+        f.write("\n".join(names) + "\n")
+    os.replace(tmpname, filename)
+
+def template_instantiations(objs):
+    # C++ names of the wremnants class templates of the helpers, nested dicts and lists are searched as well
+    res = set()
+    for obj in objs:
+        if isinstance(obj, dict):
+            res |= template_instantiations(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            res |= template_instantiations(obj)
+        else:
+            name = getattr(type(obj), "__cpp_name__", "")
+            if name.startswith("wrem::") and "<" in name:
+                res.add(name)
+    return res
+
+def record_instantiations(objs):
+    if not cache_dir:
+        return
+    names = template_instantiations(objs)
+    filename = f"{cache_dir}/{recorded_instantiations_file}"
+    recorded = read_instantiations(filename)
+    new = sorted(names - set(recorded))
+    if not new:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    write_instantiations(filename, [*recorded, *new])
+    logger.info(f"Recorded {len(new)} new template instantiations in {filename}, run scripts/utilities/build_cling_cache.py to compile them")
+
+def declare(header):
+    # to be used instead of including the header directly, the cached headers are not parsed again if the library is loaded
+    if loaded and header in cached_headers:
+        return
+    narf.clingutils.Declare(f'#include "{header}"')
+
+def declare_headers():
+    # muon_calibration.h needs the tflite include path and libraries
+    import narf.tfliteutils
+    for header in cached_headers:
+        narf.clingutils.Declare(f'#include "{header}"')
+
+def build(instantiations=None, force=False):
+    if instantiations is None:
+        instantiations = read_instantiations(f"{cache_dir}/{recorded_instantiations_file}")
+    outdir = library_dir()
+    os.makedirs(outdir, exist_ok=True)
+    src = f"{outdir}/wremnants_cling_cache.cxx"
+    with open(src, "w") as f:
+        for header in cached_headers:
+            f.write(f'#include "{header}"\n')
+        # the dictionary of the library provides the declarations of the headers when it is loaded
+        f.write("\n#ifdef __ROOTCLING__\n")
+        for header in cached_headers:
+            f.write(f'#pragma link C++ defined_in "{header}";\n')
+        f.write("#endif\n\n")
+        for name in instantiations:
+            f.write(f"template class {name};\n")
+
+    declare_headers()
+    ROOT.gSystem.AddIncludePath(f"-I{include_dir}")
+    ROOT.gSystem.AddIncludePath(ROOT.gInterpreter.GetIncludePath())
+
+    time0 = time.time()
+    logger.info(f"Compile {len(cached_headers)} headers and {len(instantiations)} template instantiations into {outdir}")
+    if not ROOT.gSystem.CompileMacro(src, "kOc" + ("f" if force else ""), library_name, outdir):
+        raise RuntimeError(f"Failed to compile {src}")
+    write_instantiations(f"{outdir}/{recorded_instantiations_file}", instantiations)
+    logger.info(f"Compilation time: {time.time() - time0}")
+
+def load():
+    # the declarations of the headers are read from the dictionary of the library instead of parsing the headers,
+    #   the explicit instantiations in the library are declared 'extern' such that cling uses the compiled code
+    #   instead of instantiating and compiling the templates again, it is called when wremnants is imported
+    global loaded
+    if loaded:
+        return True
+    if not cache_dir or os.environ.get("WREMNANTS_CLING_CACHE_LOAD", "1") == "0":
+        return False
+    outdir = library_dir()
+    lib = f"{outdir}/{library_name}.so"
+    if not os.path.isfile(lib):
+        logger.info(f"No compiled cache for the current headers in {cache_dir}, run scripts/utilities/build_cling_cache.py to create it")
+        return False
+
+    time0 = time.time()
+    # muon_calibration.h needs the tflite include path and libraries
+    import narf.tfliteutils
+    if ROOT.gSystem.Load(lib) < 0:
+        logger.warning(f"Failed to load {lib}, the headers are parsed and the templates compiled by cling")
+        return False
+    loaded = True
+    for name in read_instantiations(f"{outdir}/{recorded_instantiations_file}"):
+        if not ROOT.gInterpreter.Declare(f"extern template class {name};"):
+            logger.warning(f"Failed to declare the compiled instantiation {name}")
+    logger.info(f"Load compiled cache {lib}: {time.time() - time0}")
+    return True
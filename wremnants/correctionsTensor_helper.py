@@ -1,7 +1,8 @@
 import narf
 import ROOT
+from wremnants import cling_cache
 
-narf.clingutils.Declare('#include "theory_corrections.h"')
+cling_cache.declare("theory_corrections.h")
 
 def makeCorrectionsTensor(corrh, tensor=None, tensor_rank=1, weighted_corr=False):
     hist_dims = len(corrh.axes)-tensor_rank 
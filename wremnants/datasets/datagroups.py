@@ -1,5 +1,6 @@
 from utilities import boostHistHelpers as hh,common,logging
 from utilities.io_tools import input_tools
+from utilities.h5pyutils import H5MappedHistProxy
 from utilities.styles import styles
 import lz4.frame
 import pickle
@@ -20,6 +21,14 @@ from wremnants import histselections as sel
 
 logger = logging.child_logger(__name__)
 
+class SelectBins(object):
+    # member operation that selects single bins of some axes, it is applied while reading the histograms
+    def __init__(self, selection):
+        self.selection = selection
+
+    def __call__(self, h):
+        return h[self.selection]
+
 class Datagroups(object):
     mode_map = {
         "w_z_gen_dists.py" : "vgen",
@@ -31,6 +40,7 @@ class Datagroups(object):
     }
 
     def __init__(self, infile, mode=None, **kwargs):
+        self.infile = infile
         self.h5file = None
         self.rtfile = None
         if infile.endswith(".pkl.lz4"):
@@ -69,6 +79,7 @@ class Datagroups(object):
         self.dataName = "Data"
         self.gen_axes = {}
         self.fakerate_axes = ["pt", "eta", "charge"]
+        self.histselector_cache = None
 
         self.setGenAxes()
 
@@ -239,10 +250,10 @@ class Datagroups(object):
             if len(members) == 0:
                 raise RuntimeError(f"No member found for group {g}")
             base_member = members[0].name
-            h = self.results[base_member]["output"][histToRead].get()
+            h = input_tools.get_hist(self.results[base_member]["output"][histToRead], sum_axes=["charge"])
             if g in fake_processes:
                 self.groups[g].histselector = fakeselector(
-                    h[{"charge": hist.sum}],
+                    h,
                     global_scalefactor=scale,
                     fakerate_axes=self.fakerate_axes,
                     smoothing_mode=smoothing_mode,
@@ -260,7 +271,11 @@ class Datagroups(object):
                     hQCD = self.results["QCDmuEnrichPt15PostVFP"]["output"]["unweighted"].get()
                     self.groups[g].histselector.set_correction(hQCD, axes_names=mcCorr)
             else:
-                self.groups[g].histselector = signalselector(h[{"charge": hist.sum}], fakerate_axes=self.fakerate_axes, **kwargs)
+                self.groups[g].histselector = signalselector(h, fakerate_axes=self.fakerate_axes, **kwargs)
+
+    def set_histselector_cache(self, max_bytes):
+        # reuse the output of the fake histselectors for identical inputs, e.g. for systematics not affecting the fakes
+        self.histselector_cache = sel.HistselectorCache(max_bytes) if max_bytes > 0 else None
 
     def setGlobalAction(self, action):
         # To be used for applying a selection, rebinning, etc.
@@ -368,13 +383,19 @@ class Datagroups(object):
                 if member.name in forceToNominal:
                     read_syst = ""
                     logger.debug(f"Forcing group member {member.name} to read the nominal hist for syst {syst}")
+                # bin selections of the member and the summed gen axes are applied while reading if no other operation comes before,
+                #   such that only the needed part of memory mapped histograms is read
+                memberOp = group.memberOp[i] if group.memberOp else None
+                selection = memberOp.selection if isinstance(memberOp, SelectBins) else None
+                hasPreOp = preOpMap is not None and member.name in preOpMap
+                sum_axes = self.sum_gen_axes if not hasPreOp and (memberOp is None or selection is not None) else None
                 try:
-                    h = self.readHist(baseName, member, procName, read_syst)
+                    h = self.readHist(baseName, member, procName, read_syst, selection, sum_axes)
                     foundExact = True
                 except ValueError as e:
                     if nominalIfMissing:
                         logger.info(f"{str(e)}. Using nominal hist {self.nominalName} instead")
-                        h = self.readHist(self.nominalName, member, procName, "")
+                        h = self.readHist(self.nominalName, member, procName, "", selection, sum_axes)
                     else:
                         logger.warning(str(e))
                         continue
@@ -382,7 +403,7 @@ class Datagroups(object):
                 h_id = id(h)
                 logger.debug(f"Hist axes are {h.axes.name}")
 
-                if group.memberOp:
+                if group.memberOp and selection is None:
                     if group.memberOp[i] is not None:
                         logger.debug(f"Apply operation to member {i}: {member.name}/{procName}")
                         h = group.memberOp[i](h)
@@ -468,7 +489,24 @@ class Datagroups(object):
                 if not applySelection:
                     logger.warning(f"Selection requested for process {procName} but applySelection=False, thus it will be ignored")
                 elif label in group.hists.keys() and group.hists[label] is not None:
-                    group.hists[label] = group.histselector.get_hist(group.hists[label], is_nominal=(label==self.nominalName))
+                    is_nominal = label==self.nominalName
+                    if self.histselector_cache is not None and isinstance(group.histselector, sel.FakeSelectorSimpleABCD):
+                        cache = self.histselector_cache
+                        if is_nominal:
+                            # the selector output for variations depends on the nominal histogram
+                            cache.invalidate(group.histselector)
+                            group.hists[label] = group.histselector.get_hist(group.hists[label], is_nominal=is_nominal)
+                        else:
+                            key = cache.key(group.histselector, group.hists[label])
+                            hSel = cache.get(key)
+                            if hSel is None:
+                                hSel = group.histselector.get_hist(group.hists[label], is_nominal=is_nominal)
+                                cache.put(key, hSel)
+                            else:
+                                logger.debug(f"Reuse cached histselector output for process {procName}")
+                            group.hists[label] = hSel
+                    else:
+                        group.hists[label] = group.histselector.get_hist(group.hists[label], is_nominal=is_nominal)
                 else:
                     raise RuntimeError("Failed to apply selection")
 
@@ -622,7 +660,10 @@ class Datagroups(object):
 
         if histToReadAxes not in self.results[base_members[0].name]["output"]:
             raise ValueError(f"Results for member {base_members[0].name} does not include xnorm. Found {self.results[base_members[0].name]['output'].keys()}")
-        nominal_hist = self.results[base_members[0].name]["output"][histToReadAxes].get()
+        # only the gen axes are needed, a single bin of the other axes is read from memory mapped histograms
+        hproxy = self.results[base_members[0].name]["output"][histToReadAxes]
+        selection = {ax.name : 0 for ax in hproxy.axes if ax.name not in axesToRead} if isinstance(hproxy, H5MappedHistProxy) else None
+        nominal_hist = input_tools.get_hist(hproxy, selection)
 
         self.gen_axes[new_name] = [ax for ax in nominal_hist.axes if ax.name in axesToRead]
         logger.debug(f"New gen axes are: {self.gen_axes}")
@@ -644,7 +685,7 @@ class Datagroups(object):
 
             self.copyGroup(group_name, proc_name, member_filter=member_filter)
 
-            memberOp = lambda x, indices=indices, genvars=axesToRead: x[{var : i for var, i in zip(genvars, indices)}]
+            memberOp = SelectBins({var : i for var, i in zip(axesToRead, indices)})
             self.groups[proc_name].memberOp = [memberOp for m in base_members]
 
             self.unconstrainedProcesses.append(proc_name)
@@ -697,18 +738,14 @@ class Datagroups(object):
         for a in hh.get_rebin_actions(axes, ax_lim=ax_lim, ax_rebin=ax_rebin, ax_absval=ax_absval, rename=rename):
             self.setRebinOp(a)
 
-    def readHist(self, baseName, proc, group, syst):
+    def readHist(self, baseName, proc, group, syst, selection=None, sum_axes=None):
         output = self.results[proc.name]["output"]
         histname = self.histName(baseName, proc.name, syst)
         logger.debug(f"Reading hist {histname} for proc/group {proc.name}/{group} and syst '{syst}'")
         if histname not in output:
             raise ValueError(f"Histogram {histname} not found for process {proc.name}")
 
-        h = output[histname]
-        if isinstance(h, narf.ioutils.H5PickleProxy):
-            h = h.get()
-
-        return h
+        return input_tools.get_hist(output[histname], selection, sum_axes)
 
     def histName(self, baseName, procName="", syst=""):
         return Datagroups.histName(baseName, procName, syst, nominalName=self.nominalName)
@@ -257,3 +257,24 @@ def getDatasets(maxFiles=default_nfiles, filt=None, excl=None, mode=None, base_p
             logger.warning(f"Failed to find any files for sample {sample.name}!")
 
     return narf_datasets
+
+def shard_datasets(datasets, shard):
+    # deterministically split the files of each dataset into N subsets and keep the i-th one, 'shard' is given as "i/N"
+    try:
+        ishard, nshards = [int(x) for x in shard.split("/")]
+    except ValueError:
+        raise ValueError(f"Invalid shard '{shard}', expected 'i/N'")
+    if nshards < 1 or ishard < 0 or ishard >= nshards:
+        raise ValueError(f"Invalid shard '{shard}', expected 0 <= i < N")
+
+    sharded = []
+    for dataset in datasets:
+        # sort to be independent of the order of the file listing
+        dataset.filepaths = sorted(dataset.filepaths)[ishard::nshards]
+        if not dataset.filepaths:
+            logger.warning(f"No files for dataset {dataset.name} in shard {shard}. Skipping!")
+            continue
+        logger.debug(f"Shard {shard} has {len(dataset.filepaths)} files for dataset {dataset.name}")
+        sharded.append(dataset)
+
+    return sharded
@@ -0,0 +1,126 @@
+import ROOT
+import narf
+import re
+from utilities import logging
+
+narf.clingutils.Declare('#include "graph_profiler.h"')
+
+logger = logging.child_logger(__name__)
+
+class GraphProfiler(object):
+    # timers and counters for the column definitions, filters and histogram fills of the event loop,
+    #   the RDF nodes are wrapped such that the booked operations call the C++ timers in graph_profiler.h
+    def __init__(self):
+        self.ids = {}
+        self.helpers = []
+
+    def register(self, category, name):
+        key = (category, name)
+        if key not in self.ids:
+            self.ids[key] = len(self.ids)
+        return self.ids[key]
+
+    def wrap(self, df):
+        return ProfiledNode(df, self)
+
+    def wrap_build_graph(self, build_graph):
+        def profiled_build_graph(df, dataset):
+            # the first filter of each event closes the timer of the last histogram fill of the previous event
+            df = df.Filter("wrem::profiler::end_event()")
+            return build_graph(self.wrap(df), dataset)
+        return profiled_build_graph
+
+    def wrap_expression(self, id, expr):
+        body = expr if re.search(r"\breturn\b", expr) else f"return {expr};"
+        return f"const auto wrem_profiler_t0 = wrem::profiler::now(); auto wrem_profiler_res = [&]() {{ {body} }}(); wrem::profiler::record({id}, wrem_profiler_t0); return wrem_profiler_res;"
+
+    def wrap_helper(self, id, helper, cols):
+        # the helper is accessed from the jitted expression through a global reference
+        try:
+            cpp_name = type(helper).__cpp_name__
+            address = ROOT.addressof(helper)
+        except (AttributeError, TypeError):
+            return None
+        hname = f"helper_{len(self.helpers)}"
+        if not ROOT.gInterpreter.Declare(f"namespace wrem::profiler {{ {cpp_name} &{hname} = *reinterpret_cast<{cpp_name}*>({address}); }}"):
+            return None
+        self.helpers.append(helper)
+        return f"return wrem::profiler::call({id}, wrem::profiler::{hname}, {', '.join(cols)});"
+
+    def results(self):
+        n = len(self.ids)
+        times = ROOT.wrem.profiler.total_time(n)
+        calls = ROOT.wrem.profiler.total_calls(n)
+        res = [{"category": category, "name": name, "time": times[id]*1e-9, "calls": int(calls[id])}
+            for (category, name), id in self.ids.items()]
+        return sorted(res, key=lambda x: x["time"], reverse=True)
+
+    def report(self, nmax=None):
+        res = self.results()
+        total = sum(r["time"] for r in res)
+        lines = [f"{'category':<10} {'name':<60} {'time [s]':>10} {'fraction':>9} {'calls':>12} {'time/call [us]':>15}"]
+        for r in res[:nmax]:
+            per_call = r["time"]/r["calls"]*1e6 if r["calls"] else 0.
+            fraction = r["time"]/total if total else 0.
+            lines.append(f"{r['category']:<10} {r['name']:<60} {r['time']:>10.3f} {fraction:>9.3f} {r['calls']:>12} {per_call:>15.3f}")
+        logger.info("Event loop profile (summed over threads):\n" + "\n".join(lines))
+        return res
+
+class ProfiledNode(object):
+    # forwards everything to the RDF node, and wraps the returned nodes again
+    def __init__(self, node, profiler):
+        self._node = node
+        self._profiler = profiler
+
+    def __getattr__(self, name):
+        attr = getattr(self._node, name)
+        if not callable(attr):
+            return attr
+
+        def forward(*args, **kwargs):
+            res = attr(*args, **kwargs)
+            return self._wrap(res)
+        return forward
+
+    def _wrap(self, res):
+        if hasattr(res, "GetColumnNames") and hasattr(res, "Define"):
+            return ProfiledNode(res, self._profiler)
+        return res
+
+    def _define(self, method, name, expr, cols=None):
+        id = self._profiler.register("column", name)
+        if isinstance(expr, str) and cols is None:
+            wrapped = self._profiler.wrap_expression(id, expr)
+        elif cols is not None:
+            wrapped = self._profiler.wrap_helper(id, expr, cols)
+        else:
+            wrapped = None
+
+        if wrapped is None:
+            logger.debug(f"Column {name} is not profiled")
+            args = (name, expr) if cols is None else (name, expr, cols)
+            return self._wrap(getattr(self._node, method)(*args))
+        return self._wrap(getattr(self._node, method)(name, wrapped))
+
+    def Define(self, name, expr, cols=None):
+        return self._define("Define", name, expr, cols)
+
+    def Redefine(self, name, expr, cols=None):
+        return self._define("Redefine", name, expr, cols)
+
+    def Filter(self, expr, *args):
+        if not isinstance(expr, str) or len(args) > 1:
+            return self._wrap(self._node.Filter(expr, *args))
+        id = self._profiler.register("filter", args[0] if args else expr)
+        return self._wrap(self._node.Filter(self._profiler.wrap_expression(id, expr), *args))
+
+    def HistoBoost(self, name, axes, cols, *args, **kwargs):
+        # one input of the fill is passed through the profiler to start the timer of the fill, the defined column
+        #   holds a copy of the value so the last scalar input is used and the others (e.g. tensors) are read directly
+        id = self._profiler.register("histogram", name)
+        scalars = [i for i, col in enumerate(cols) if "<" not in str(self._node.GetColumnType(col))]
+        i = scalars[-1] if scalars else len(cols)-1
+        profiled_col = f"wrem_profiler_{id}"
+        node = self._node.Define(profiled_col, f"return wrem::profiler::fill_input({id}, {cols[i]});")
+        profiled_cols = [*cols[:i], profiled_col, *cols[i+1:]]
+        return node.HistoBoost(name, axes, profiled_cols, *args, **kwargs)
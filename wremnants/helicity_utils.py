@@ -16,10 +16,11 @@ import numpy as np
 import h5py
 import hdf5plugin
 import narf
+from wremnants import cling_cache
 
 logger = logging.child_logger(__name__)
 
-narf.clingutils.Declare('#include "syst_helicity_utils.h"')
+cling_cache.declare("syst_helicity_utils.h")
 
 data_dir = f"{pathlib.Path(__file__).parent}/data/"
 
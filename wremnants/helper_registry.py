@@ -0,0 +1,75 @@
+import time
+from utilities import logging
+
+logger = logging.child_logger(__name__)
+
+# descriptions of the built helpers by their id, the helpers are kept alive such that the ids are not reused
+_descriptions = {}
+
+def describe(obj):
+    # description of a helper built by a registry from its factory and arguments, None for other objects,
+    #   helpers built by the same factory with the same arguments (e.g. in different configurations) have the same description
+    entry = _descriptions.get(id(obj))
+    return entry[1] if entry is not None and entry[0] is obj else None
+
+class HelperRegistry(object):
+    # helpers are only built when they are accessed for the first time (usually from build_graph), and then memoized,
+    #   such that the startup only costs what the chosen configuration needs
+    def __init__(self):
+        self._factories = {}
+        self._helpers = {}
+        self._times = {}
+
+    def register(self, names, factory, *args, **kwargs):
+        # 'names' is a single name, or a list of names for a factory that returns a tuple of helpers
+        if isinstance(names, str):
+            names = [names]
+        for name in names:
+            if name in self._factories:
+                raise ValueError(f"Helper {name} is already registered")
+            self._factories[name] = (names, factory, args, kwargs)
+
+    def build(self, name):
+        names, factory, args, kwargs = self._factories[name]
+        time0 = time.time()
+        res = factory(*args, **kwargs)
+        dt = time.time() - time0
+        if len(names) == 1:
+            res = [res]
+        elif len(res) != len(names):
+            raise RuntimeError(f"Helper factory for {names} returned {len(res)} instead of {len(names)} objects")
+        for i, (n, helper) in enumerate(zip(names, res)):
+            self._helpers[n] = helper
+            _descriptions[id(helper)] = (helper, (factory.__module__, factory.__qualname__, repr(args), repr(sorted(kwargs.items())), i))
+        self._times[tuple(names)] = dt
+        logger.info(f"Build helper {', '.join(names)}: {dt:.2f}s")
+
+    def __getitem__(self, name):
+        if name not in self._helpers:
+            if name not in self._factories:
+                raise KeyError(f"Helper {name} is not registered")
+            self.build(name)
+        return self._helpers[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError as e:
+            raise AttributeError(str(e))
+
+    def built_helpers(self):
+        return dict(self._helpers)
+
+    def __contains__(self, name):
+        return name in self._factories
+
+    def report(self):
+        lines = [f"{', '.join(names):<80} {dt:>8.2f}" for names, dt in sorted(self._times.items(), key=lambda x: x[1], reverse=True)]
+        lines.append(f"{'total':<80} {sum(self._times.values()):>8.2f}")
+        not_built = sorted(set(tuple(v[0]) for v in self._factories.values()) - set(self._times.keys()))
+        logger.info("Time to build the helpers [s]:\n" + "\n".join(lines))
+        if not_built:
+            logger.info(f"Helpers not needed in this configuration: {', '.join(n for names in not_built for n in names)}")
+        return self._times
@@ -4,15 +4,16 @@ from utilities import logging
 
 logger = logging.child_logger(__name__)
 
-def scale_to_data(result_dict):
-    # scale histograms by lumi*xsec/sum(gen weights)
+def scale_to_data(result_dict, lumi=None):
+    # scale histograms by lumi*xsec/sum(gen weights), the lumi is taken from the data in the results if not given
     time0 = time.time()
 
-    lumi = [result["lumi"] for result in result_dict.values() if result["dataset"]["is_data"]]
-    if len(lumi) == 0:
-        lumi = 1
-    else:
-        lumi = sum(lumi)
+    if lumi is None:
+        lumi = [result["lumi"] for result in result_dict.values() if result["dataset"]["is_data"]]
+        if len(lumi) == 0:
+            lumi = 1
+        else:
+            lumi = sum(lumi)
 
     logger.warning(f"Scale histograms with luminosity = {lumi} /fb")
     for d_name, result in result_dict.items():
@@ -36,6 +37,12 @@ def scale_to_data(result_dict):
     logger.info(f"Scale to data: {time.time() - time0}")
 
 
+def add_dataset_groups(datasets, result_dict):
+    # store the group of each dataset in the results, needed to aggregate the groups when merging partial outputs
+    for dataset in datasets:
+        if dataset.name in result_dict:
+            result_dict[dataset.name]["dataset"]["group"] = dataset.group
+
 def aggregate_groups(datasets, result_dict, groups_to_aggregate):
     # add members of groups together
     time0 = time.time()
@@ -1,8 +1,10 @@
 import hist
 import numpy as np
+import collections
+import hashlib
 from utilities import boostHistHelpers as hh
 from utilities import common, logging
-from utilities.fnnls import fnnls
+from utilities.fnnls import fnnls, nnls_batched
 from scipy.optimize import nnls
 from scipy.special import comb
 import pdb
@@ -171,11 +173,15 @@ def solve_leastsquare(X, XTY):
     params = np.einsum('...ij,...j->...i', XTXinv, XTY)
     return params, XTXinv
 
-def solve_nonnegative_leastsquare(X, XTY):
+def solve_nonnegative_leastsquare(X, XTY, batched=True):
     XT = np.transpose(X, axes=(*np.arange(X.ndim-2), X.ndim-1, X.ndim-2))
     XTX = XT @ X
     XTXinv = np.linalg.inv(XTX.reshape(-1,*XTX.shape[-2:]))
     XTXinv = XTXinv.reshape((*XT.shape[:-2],*XTXinv.shape[-2:])) 
+    if batched and XTX.shape[-1] <= 10:
+        # solve all bins at once, for many parameters the sequential solver is faster
+        params = nnls_batched(XTX, XTY)
+        return params, XTXinv
     orig_shape = XTY.shape
     nBins = np.prod(orig_shape[:-1])
     XTY_flat = XTY.reshape(nBins, XTY.shape[-1])
@@ -250,6 +256,53 @@ def divide_arrays(num, den, cutoff=1):
     r[abs(den) < cutoff] = 0 # if denumerator is close to 0 set ratio to zero to avoid large negative/positive values
     return r
 
+class HistselectorCache(object):
+    # in-memory least recently used cache of histselector outputs, keyed on the selector and a content hash of the input histogram
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def content_hash(h):
+        hasher = hashlib.blake2b(digest_size=16)
+        for ax in h.axes:
+            hasher.update(ax.name.encode())
+            hasher.update(np.ascontiguousarray(ax.edges).tobytes() if not isinstance(ax, hist.axis.StrCategory) else str(list(ax)).encode())
+        hasher.update(np.ascontiguousarray(h.view(flow=True)).tobytes())
+        return hasher.hexdigest()
+
+    def key(self, selector, h):
+        return (id(selector), self.content_hash(h))
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        # return a copy such that the cached histogram can't be modified downstream
+        return self.entries[key].copy()
+
+    def put(self, key, h):
+        nbytes = h.view(flow=True).nbytes
+        if nbytes > self.max_bytes:
+            return
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key).view(flow=True).nbytes
+        self.entries[key] = h.copy()
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, hold = self.entries.popitem(last=False)
+            self.nbytes -= hold.view(flow=True).nbytes
+
+    def invalidate(self, selector):
+        # drop all entries of a selector, e.g. when its nominal histogram changes
+        for key in [k for k in self.entries.keys() if k[0] == id(selector)]:
+            self.nbytes -= self.entries.pop(key).view(flow=True).nbytes
+
 class HistselectorABCD(object):
     def __init__(self, h, name_x=None, name_y=None,
         fakerate_axes=["eta","pt","charge"], 
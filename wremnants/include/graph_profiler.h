@@ -0,0 +1,136 @@
+#ifndef WREMNANTS_GRAPH_PROFILER_H
+#define WREMNANTS_GRAPH_PROFILER_H
+
+#include <algorithm>
+#include <chrono>
+#include <memory>
+#include <mutex>
+#include <utility>
+#include <vector>
+
+namespace wrem::profiler {
+
+using clock = std::chrono::steady_clock;
+
+struct Entry {
+  double ns = 0.;
+  unsigned long long calls = 0;
+};
+
+// timers and counters are accumulated per thread without locking and summed up after the event loop
+struct ThreadBuffer {
+  std::vector<Entry> entries;
+  // histogram fill which is currently timed
+  long open_id = -1;
+  clock::time_point open_t0;
+  // last histogram fill in this event, to count each fill once
+  long last_fill_id = -1;
+};
+
+inline std::mutex &buffers_mutex() {
+  static std::mutex mutex;
+  return mutex;
+}
+
+inline std::vector<std::shared_ptr<ThreadBuffer>> &buffers() {
+  static std::vector<std::shared_ptr<ThreadBuffer>> bufs;
+  return bufs;
+}
+
+inline ThreadBuffer &buffer() {
+  thread_local std::shared_ptr<ThreadBuffer> buf = []() {
+    auto b = std::make_shared<ThreadBuffer>();
+    std::lock_guard<std::mutex> lock(buffers_mutex());
+    buffers().push_back(b);
+    return b;
+  }();
+  return *buf;
+}
+
+inline clock::time_point now() { return clock::now(); }
+
+inline Entry &entry(ThreadBuffer &buf, long id) {
+  if (id >= long(buf.entries.size())) {
+    buf.entries.resize(id + 1);
+  }
+  return buf.entries[id];
+}
+
+inline void close(ThreadBuffer &buf, clock::time_point t) {
+  if (buf.open_id >= 0) {
+    entry(buf, buf.open_id).ns += std::chrono::duration<double, std::nano>(t - buf.open_t0).count();
+    buf.open_id = -1;
+  }
+}
+
+// time of a column definition or filter which started at t0
+inline void record(long id, clock::time_point t0) {
+  const auto t = now();
+  auto &buf = buffer();
+  close(buf, t0);
+  auto &e = entry(buf, id);
+  e.ns += std::chrono::duration<double, std::nano>(t - t0).count();
+  ++e.calls;
+}
+
+template <typename H, typename... Args>
+auto call(long id, H &helper, Args &&...args) {
+  const auto t0 = now();
+  auto res = helper(std::forward<Args>(args)...);
+  record(id, t0);
+  return res;
+}
+
+// passes through an input of a histogram fill without copying it, the fill is timed from the
+// evaluation of the input until the next profiled operation in the same thread
+template <typename T>
+decltype(auto) fill_input(long id, T &&value) {
+  const auto t = now();
+  auto &buf = buffer();
+  if (buf.open_id != id) {
+    close(buf, t);
+    buf.open_id = id;
+  }
+  buf.open_t0 = t;
+  if (buf.last_fill_id != id) {
+    buf.last_fill_id = id;
+    ++entry(buf, id).calls;
+  }
+  return std::forward<T>(value);
+}
+
+// evaluated as the first filter of each event
+inline bool end_event() {
+  auto &buf = buffer();
+  close(buf, now());
+  buf.last_fill_id = -1;
+  return true;
+}
+
+inline std::vector<double> total_time(long n) {
+  std::vector<double> res(n, 0.);
+  std::lock_guard<std::mutex> lock(buffers_mutex());
+  for (auto &buf : buffers()) {
+    // drop the timer that is still open at the end of the event loop
+    buf->open_id = -1;
+    for (long i = 0; i < std::min(n, long(buf->entries.size())); ++i) {
+      res[i] += buf->entries[i].ns;
+    }
+  }
+  return res;
+}
+
+inline std::vector<unsigned long long> total_calls(long n) {
+  std::vector<unsigned long long> res(n, 0);
+  std::lock_guard<std::mutex> lock(buffers_mutex());
+  for (auto &buf : buffers()) {
+    for (long i = 0; i < std::min(n, long(buf->entries.size())); ++i) {
+      res[i] += buf->entries[i].calls;
+    }
+  }
+  return res;
+}
+
+}
+
+#endif
@@ -1,3 +1,6 @@
+#ifndef WREMNANTS_MUON_CALIBRATION_H
+#define WREMNANTS_MUON_CALIBRATION_H
+
 #include <ROOT/RVec.hxx>
 #include "Math/GenVector/PtEtaPhiM4D.h"
 #include "TFile.h"
@@ -2036,3 +2039,5 @@ private:
 };
 
 }
+
+#endif
@@ -0,0 +1,151 @@
+import functools
+import hashlib
+import hist
+import numpy as np
+import os
+import pathlib
+import re
+import types
+from utilities import logging
+
+logger = logging.child_logger(__name__)
+
+logk_cache_version = 1
+
+# arguments of setupCombine.py which don't change the logk arrays of the systematics
+ignored_args = ["outfolder", "postfix", "verbose", "noColorLogger", "sparse", "streaming", "nWorkers", "codec", "denseBlocks",
+    "float32", "excludeNuisances", "keepNuisances", "absolutePathInCard", "noHist", "logkCache"]
+
+# source directories involved in loading the systematics, any change of the code invalidates the cache
+source_dirs = ["wremnants", "utilities"]
+
+class UncacheableError(Exception):
+    # the content of the object can't be hashed reliably
+    pass
+
+def update_hash(sha, obj, depth=0):
+    # hash of the content of an object, including the code and closures of functions,
+    #   objects without known content are hashed by their representation without memory addresses
+    if depth > 20:
+        sha.update(b"<max depth>")
+        return
+    update = lambda x: update_hash(sha, x, depth+1)
+    sha.update(type(obj).__name__.encode())
+    if isinstance(obj, dict):
+        for k in sorted(obj.keys(), key=str):
+            update(k)
+            update(obj[k])
+    elif isinstance(obj, (list, tuple)):
+        for x in obj:
+            update(x)
+    elif isinstance(obj, (set, frozenset)):
+        for x in sorted(obj, key=repr):
+            update(x)
+    elif isinstance(obj, np.ndarray):
+        update(obj.shape)
+        sha.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, hist.Hist):
+        update(repr(obj.axes))
+        update(np.asarray(obj.view(flow=True)))
+    elif isinstance(obj, functools.partial):
+        update(obj.func)
+        update(obj.args)
+        update(obj.keywords)
+    elif isinstance(obj, types.MethodType):
+        # the result depends on the state of the instance (e.g. the datagroups), which is not hashed
+        raise UncacheableError(f"Bound method {obj.__qualname__}")
+    elif isinstance(obj, types.FunctionType):
+        update(obj.__qualname__)
+        update(obj.__code__)
+        update(obj.__defaults__)
+        update(obj.__kwdefaults__)
+        if obj.__closure__:
+            for cell in obj.__closure__:
+                try:
+                    update(cell.cell_contents)
+                except ValueError:
+                    # empty cell
+                    update(None)
+    elif isinstance(obj, types.CodeType):
+        sha.update(obj.co_code)
+        update(obj.co_consts)
+        update(obj.co_names)
+    elif isinstance(obj, bytes):
+        sha.update(obj)
+    else:
+        sha.update(re.sub(r" at 0x[0-9a-fA-F]+", "", repr(obj)).encode())
+
+def hash_objects(*objs):
+    sha = hashlib.sha256()
+    for obj in objs:
+        update_hash(sha, obj)
+    return sha.hexdigest()
+
+def file_fingerprint(filename):
+    # the input files are large, they are identified by their path, size and modification time instead of their content
+    stat = os.stat(filename)
+    return (os.path.realpath(filename), stat.st_size, stat.st_mtime_ns)
+
+def input_fingerprints(args, infiles):
+    # the given input files and all files passed in the arguments (e.g. fit results or theory corrections)
+    files = set(f for f in infiles if f)
+    for v in vars(args).values():
+        for x in (v if isinstance(v, (list, tuple)) else [v]):
+            if isinstance(x, str) and os.path.isfile(x):
+                files.add(x)
+    return sorted(file_fingerprint(f) for f in files)
+
+@functools.lru_cache(maxsize=None)
+def source_hash():
+    base = pathlib.Path(__file__).parent.parent
+    files = sorted(f for d in source_dirs for f in (base / d).rglob("*.py"))
+    return hash_objects([(str(f.relative_to(base)), f.read_bytes()) for f in files])
+
+class LogkCache(object):
+    # on disk cache of the logk arrays of each (channel, systematic),
+    #   keyed on the input files, the arguments, the nominal predictions of the channel and the systematic configuration
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.base_key = None
+
+    def set_channel(self, args, chan, infiles, norms):
+        fingerprints = input_fingerprints(args, infiles)
+        args = {k: v for k, v in vars(args).items() if k not in ignored_args}
+        self.base_key = hash_objects(logk_cache_version, source_hash(), args, chan, fingerprints, norms)
+
+    def key(self, systKey, syst):
+        # returns None for systematics that can't be cached
+        try:
+            return hash_objects(self.base_key, systKey, syst)
+        except UncacheableError as e:
+            logger.debug(f"Shape systematic group {systKey} is not cached: {e}")
+            return None
+
+    def path(self, key):
+        return f"{self.cache_dir}/{key}.npz"
+
+    def has(self, key):
+        return key is not None and os.path.isfile(self.path(key))
+
+    def get(self, key):
+        # returns the bookings as a list of (process, systematic name, logkavg, logkhalfdiff)
+        with np.load(self.path(key)) as f:
+            return [(str(proc), str(name), f[f"avg_{i}"], f[f"halfdiff_{i}"] if f"halfdiff_{i}" in f.files else None)
+                for i, (proc, name) in enumerate(zip(f["procs"], f["names"]))]
+
+    def put(self, key, bookings):
+        if key is None:
+            return
+        arrays = {
+            "procs": np.array([b[0] for b in bookings], dtype=str),
+            "names": np.array([b[1] for b in bookings], dtype=str),
+        }
+        for i, (proc, name, logkavg, logkhalfdiff) in enumerate(bookings):
+            arrays[f"avg_{i}"] = logkavg
+            if logkhalfdiff is not None:
+                arrays[f"halfdiff_{i}"] = logkhalfdiff
+        # write to a temporary file first such that concurrent jobs don't read incomplete entries
+        tmpname = f"{self.cache_dir}/{key}.{os.getpid()}.tmp.npz"
+        np.savez(tmpname, **arrays)
+        os.replace(tmpname, self.path(key))
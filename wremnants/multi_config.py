@@ -0,0 +1,226 @@
+import narf
+import itertools
+import runpy
+import shlex
+import sys
+from utilities import logging
+from wremnants import helper_registry
+
+logger = logging.child_logger(__name__)
+
+# Several named configurations of a histmaker processed in a single event loop per dataset.
+#   The histmaker script is executed once per configuration, one after the other, with its own arguments, helpers and output file.
+#   The histmakers call build_and_run of this module instead of narf.build_and_run, which only collects the graph and the
+#   post-processing of each configuration. The graphs of all configurations are then built on the same RDataFrame and run together,
+#   and the post-processing of each configuration is called with its results.
+
+# separator of the configuration name and the histogram name in the combined results
+separator = ":"
+
+# (datasets, build_graph, postprocess) of each call of build_and_run by the configuration that is set up, None if not collecting
+_collected = None
+# arguments of the configuration that is set up
+_argv = None
+# numbers of the bookings of nodes which are not shared
+_unique = itertools.count()
+
+def parse_configs(configs):
+    # configurations given as 'name=flags'
+    parsed = {}
+    for config in configs:
+        name, sep, flags = config.partition("=")
+        if not sep or not name:
+            raise ValueError(f"Invalid configuration '{config}', expected 'name=flags'")
+        if separator in name:
+            raise ValueError(f"Invalid configuration name '{name}', it can't contain '{separator}'")
+        if name in parsed:
+            raise ValueError(f"Duplicate configuration name '{name}'")
+        parsed[name] = shlex.split(flags)
+    return parsed
+
+def strip_configs_arg(argv):
+    # command line without the --configs option and its values
+    stripped = []
+    skip = False
+    for arg in argv:
+        if arg == "--configs":
+            skip = True
+            continue
+        if skip and not arg.startswith("-"):
+            continue
+        skip = False
+        if arg.startswith("--configs="):
+            continue
+        stripped.append(arg)
+    return stripped
+
+def parse_args(parser):
+    # the arguments of the configuration that is set up, the command line otherwise
+    return parser.parse_args(_argv)
+
+def build_and_run(datasets, build_graph, postprocess):
+    # to be called by the histmakers instead of narf.build_and_run, 'postprocess(datasets, resultdict)' is called with the results
+    if _collected is not None:
+        _collected.append((datasets, build_graph, postprocess))
+        return
+    postprocess(datasets, narf.build_and_run(datasets, build_graph))
+
+class Identity(object):
+    # key of an object which is only equal to itself, the object is kept alive such that its id is not reused
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __hash__(self):
+        return id(self.obj)
+
+    def __eq__(self, other):
+        return isinstance(other, Identity) and other.obj is self.obj
+
+def canonical(arg):
+    # description of an argument of a booking which is equal for equivalent arguments of different configurations
+    if isinstance(arg, str):
+        # expressions that only differ by white space are the same
+        return " ".join(arg.split())
+    if isinstance(arg, (list, tuple)):
+        return tuple(canonical(a) for a in arg)
+    if arg is None or isinstance(arg, (bool, int, float)):
+        return arg
+    cpp_name = getattr(type(arg), "__cpp_name__", "")
+    if "vector<" in cpp_name and "string" in cpp_name:
+        return tuple(canonical(str(a)) for a in arg)
+    # helpers built by a registry are described by their factory and its arguments,
+    #   other objects are only shared if the configurations use the same object
+    description = helper_registry.describe(arg)
+    if description is not None:
+        return ("helper", description)
+    return ("object", Identity(arg))
+
+class ConfigNode(object):
+    # proxy of the RDF node for one configuration, identical column definitions and filters of the configurations
+    #   on the same node are booked once and the histogram names are prefixed with the configuration name,
+    #   the nodes are identified by the chain of bookings from the input node
+    def __init__(self, node, config, booked, path=()):
+        self._node = node
+        self._config = config
+        self._booked = booked
+        self._path = path
+
+    def __getattr__(self, name):
+        attr = getattr(self._node, name)
+        if not callable(attr):
+            return attr
+
+        def forward(*args, **kwargs):
+            # nodes from other bookings are not shared
+            return self._wrap(attr(*args, **kwargs), (name, ("unique", next(_unique))))
+        return forward
+
+    def _wrap(self, res, booking):
+        if hasattr(res, "GetColumnNames") and hasattr(res, "Define"):
+            return ConfigNode(res, self._config, self._booked, (*self._path, booking))
+        return res
+
+    def _book(self, method, *args):
+        booking = (method, canonical(args))
+        key = (*self._path, booking)
+        if key not in self._booked:
+            self._booked[key] = getattr(self._node, method)(*args)
+        return self._wrap(self._booked[key], booking)
+
+    def Define(self, *args):
+        return self._book("Define", *args)
+
+    def DefinePerSample(self, *args):
+        return self._book("DefinePerSample", *args)
+
+    def Redefine(self, *args):
+        return self._book("Redefine", *args)
+
+    def Alias(self, *args):
+        return self._book("Alias", *args)
+
+    def Filter(self, *args):
+        return self._book("Filter", *args)
+
+    def HistoBoost(self, name, *args, **kwargs):
+        return self._node.HistoBoost(f"{self._config}{separator}{name}", *args, **kwargs)
+
+def sum_and_count(res):
+    # value of the sum of weights and number of events returned by build_graph
+    value = res.GetValue() if hasattr(res, "GetValue") else res
+    if hasattr(value, "first"):
+        return float(value.first), float(value.second)
+    return float(value), None
+
+def run_event_loop(configs, datasets):
+    # 'configs' are tuples of (name, datasets, build_graph)
+    for name, other, _ in configs[1:]:
+        if [(d.name, sorted(d.filepaths)) for d in other] != [(d.name, sorted(d.filepaths)) for d in datasets]:
+            raise ValueError(f"Configurations {configs[0][0]} and {name} process different datasets, they can't be run in the same event loop")
+
+    weightsums = {}
+    def build_graph(df, dataset):
+        idataset = next(i for i, d in enumerate(datasets) if d is dataset)
+        booked = {}
+        results = []
+        for name, config_datasets, config_build_graph in configs:
+            res, wsum = config_build_graph(ConfigNode(df, name, booked), config_datasets[idataset])
+            results.extend(res)
+            weightsums[(name, dataset.name)] = wsum
+        # the event loop is triggered with the weights of the first configuration, the others are read after the loop
+        return results, weightsums[(configs[0][0], dataset.name)]
+
+    logger.info(f"Run configurations {[c[0] for c in configs]} in a single event loop")
+    resultdict = narf.build_and_run(datasets, build_graph)
+
+    # split the results by configuration
+    resultdicts = {name: {} for name, _, _ in configs}
+    for d_name, result in resultdict.items():
+        outputs = {name: {} for name in resultdicts}
+        for h_name, h in result["output"].items():
+            config, _, name = h_name.partition(separator)
+            obj = h.get() if isinstance(h, narf.ioutils.H5PickleProxy) else h
+            if hasattr(obj, "name"):
+                obj.name = name
+            outputs[config][name] = h
+        for config in resultdicts:
+            resultdicts[config][d_name] = {**result, "output": outputs[config]}
+            if config == configs[0][0] or (config, d_name) not in weightsums:
+                continue
+            # the sum of weights of each configuration, computed in the same event loop
+            weight_sum, event_count = sum_and_count(weightsums[(config, d_name)])
+            resultdicts[config][d_name]["weight_sum"] = weight_sum
+            if event_count is not None and "event_count" in result:
+                resultdicts[config][d_name]["event_count"] = event_count
+    return resultdicts
+
+def run_configs(script, configs, args):
+    global _collected, _argv
+
+    configs = parse_configs(configs)
+    argv = strip_configs_arg(sys.argv[1:])
+
+    # set up the configurations one after the other, up to the event loop
+    collected = {}
+    try:
+        for name, flags in configs.items():
+            postfix = f"{args.postfix}_{name}" if args.postfix else name
+            _argv = [*argv, *flags, "--postfix", postfix]
+            _collected = collected[name] = []
+            logger.info(f"Setting up configuration {name}: {' '.join(_argv)}")
+            runpy.run_path(script, run_name="__main__")
+    finally:
+        _collected = None
+        _argv = None
+
+    nloops = set(len(c) for c in collected.values())
+    if len(nloops) > 1:
+        raise ValueError(f"The configurations run different numbers of event loops, they can't be run together")
+
+    for iloop in range(nloops.pop()):
+        loops = {name: c[iloop] for name, c in collected.items()}
+        datasets = next(iter(loops.values()))[0]
+        resultdicts = run_event_loop([(name, loop[0], loop[1]) for name, loop in loops.items()], datasets)
+        for name, (config_datasets, _, postprocess) in loops.items():
+            logger.info(f"Post-processing of configuration {name}")
+            postprocess(config_datasets, resultdicts[name])
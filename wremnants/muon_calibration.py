@@ -14,10 +14,11 @@ import narf.tfliteutils
 import time
 import lz4.frame
 import pickle
+from wremnants import cling_cache
 
 logger = logging.child_logger(__name__)
 
-narf.clingutils.Declare('#include "muon_calibration.h"')
+cling_cache.declare("muon_calibration.h")
 narf.clingutils.Declare('#include "lowpu_utils.h"')
 
 data_dir = common.data_dir
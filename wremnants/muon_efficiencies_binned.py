@@ -9,8 +9,9 @@ import pickle
 import lz4.frame
 
 from utilities import common
+from wremnants import cling_cache
 
-narf.clingutils.Declare('#include "muon_efficiencies_binned.h"')
+cling_cache.declare("muon_efficiencies_binned.h")
 
 data_dir = common.data_dir
 
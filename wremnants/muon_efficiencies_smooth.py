@@ -13,9 +13,10 @@ import os.path
 from utilities import boostHistHelpers as hh
 from utilities import common, logging
 from utilities.io_tools import input_tools
+from wremnants import cling_cache
 logger = logging.child_logger(__name__)
 
-narf.clingutils.Declare('#include "muon_efficiencies_smooth.h"')
+cling_cache.declare("muon_efficiencies_smooth.h")
 
 data_dir = common.data_dir
 
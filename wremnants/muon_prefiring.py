@@ -3,8 +3,9 @@ import pathlib
 import hist
 import narf.clingutils
 from utilities import common
+from wremnants import cling_cache
 
-narf.clingutils.Declare('#include "muon_prefiring.h"')
+cling_cache.declare("muon_prefiring.h")
 
 data_dir = common.data_dir
 
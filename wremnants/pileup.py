@@ -5,10 +5,11 @@ import narf
 import numpy as np
 import boost_histogram as bh
 from utilities import common, logging
+from wremnants import cling_cache
 
 logger = logging.child_logger(__name__)
 
-narf.clingutils.Declare('#include "pileup.h"')
+cling_cache.declare("pileup.h")
 
 data_dir = common.data_dir
 
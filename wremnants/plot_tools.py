@@ -17,23 +17,37 @@ import datetime
 import json
 import narf 
 import socket
+import multiprocessing
+import contextlib
 
 hep.style.use(hep.style.ROOT)
 
 logger = logging.child_logger(__name__)
 
+# if set, new figures reuse (and clear) the figure with this label instead of creating a new one each time
+figure_template = None
+# plot tasks shared with forked worker processes
+_plot_tasks = None
+
+def newFigure(figsize):
+    if figure_template is None:
+        return plt.figure(figsize=figsize)
+    fig = plt.figure(num=figure_template, clear=True)
+    fig.set_size_inches(figsize)
+    return fig
+
 def cfgFigure(href, xlim=None, bin_density = 300,  width_scale=1, automatic_scale=True):
     hax = href.axes[0]
     if not xlim:
         xlim = [hax.edges[0], hax.edges[-1]]
     if not automatic_scale:
-        return plt.figure(figsize=(width_scale*8,8)), xlim
+        return newFigure(figsize=(width_scale*8,8)), xlim
     xlim_range = float(xlim[1] - xlim[0])
     original_xrange = float(hax.edges[-1] - hax.edges[0])
     raw_width = (hax.size/float(bin_density)) * (xlim_range / original_xrange)
     width = math.ceil(raw_width)
 
-    return plt.figure(figsize=(width_scale*8*width,8)), xlim
+    return newFigure(figsize=(width_scale*8*width,8)), xlim
 
 def figure(href, xlabel, ylabel, ylim=None, xlim=None,
     grid = False, plot_title = None, title_padding = 0,
@@ -48,7 +62,7 @@ def figure(href, xlabel, ylabel, ylim=None, xlim=None,
             width = math.ceil(raw_width)
         else:
             width = 1
-        fig = plt.figure(figsize=(width_scale*height*width,height))
+        fig = newFigure(figsize=(width_scale*height*width,height))
 
     ax1 = fig.add_subplot() 
     if cms_label: hep.cms.text(cms_label)
@@ -572,6 +586,79 @@ def save_pdf_and_png(outdir, basename, fig=None):
         plt.savefig(fname.replace(".pdf", ".png"), bbox_inches='tight')
     logger.info(f"Wrote file(s) {fname}(.png)")
 
+def close_figure():
+    # the reused figure is kept open for the next plot
+    if figure_template is None:
+        plt.close()
+
+@contextlib.contextmanager
+def reuse_figure():
+    # new figures reuse a single figure within this context, the previous behaviour is restored afterwards
+    global figure_template
+    if figure_template is not None:
+        yield
+        return
+    figure_template = "plot_template"
+    try:
+        yield
+    finally:
+        plt.close(figure_template)
+        figure_template = None
+
+def _init_plot_worker():
+    # only called in the forked worker processes
+    global figure_template
+    figure_template = "plot_template"
+
+def _run_plot_task(i):
+    func, args, kwargs = _plot_tasks[i]
+    return func(*args, **kwargs)
+
+def run_plot_tasks(tasks, jobs=1):
+    # run independent plot tasks, each a tuple (func, args, kwargs), and return their results in order,
+    #   with jobs > 1 the tasks are run by forked worker processes which inherit the (sliced) histograms of the tasks,
+    #   each worker reuses a single figure
+    global _plot_tasks
+    if jobs <= 1 or len(tasks) <= 1:
+        with reuse_figure():
+            return [func(*args, **kwargs) for func, args, kwargs in tasks]
+    logger.info(f"Make {len(tasks)} plots with {jobs} workers")
+    _plot_tasks = tasks
+    try:
+        with multiprocessing.get_context("fork").Pool(jobs, initializer=_init_plot_worker) as pool:
+            results = pool.map(_run_plot_task, range(len(tasks)), chunksize=1)
+    finally:
+        _plot_tasks = None
+    return results
+
+class PlotTasks(object):
+    # independent plots, which are made right away with jobs <= 1 (reusing a single figure until run() is called),
+    #   otherwise they are collected and made in parallel by run(), which returns the results of all plots in order
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+        self.tasks = []
+        self.results = []
+        self.figure = contextlib.ExitStack()
+
+    def add(self, func, *args, **kwargs):
+        if self.jobs > 1:
+            self.tasks.append((func, args, kwargs))
+            return
+        if figure_template is None:
+            self.figure.enter_context(reuse_figure())
+        try:
+            self.results.append(func(*args, **kwargs))
+        except Exception:
+            self.figure.close()
+            raise
+
+    def run(self):
+        self.figure.close()
+        if self.tasks:
+            self.results.extend(run_plot_tasks(self.tasks, self.jobs))
+            self.tasks = []
+        return self.results
+
 def write_index_and_log(outpath, logname, template_dir=f"{pathlib.Path(__file__).parent}/Templates", 
         yield_tables=None, analysis_meta_info=None, args={}, nround=2):
     indexnamesave = "index.php"
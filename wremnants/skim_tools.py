@@ -0,0 +1,282 @@
+import ROOT
+import json
+import os
+import re
+from utilities import logging
+
+logger = logging.child_logger(__name__)
+
+# event skims written at a fixed point of build_graph (after the calibration, the selections and the trigger matching),
+#   the histogramming stage of the histmakers can then be rerun from the skims instead of the full NanoAOD
+
+# only columns of these types can be written, others (e.g. 4-vectors or helper outputs) are recomputed from the saved ones
+basic_types = ["bool", "char", "short", "int", "long", "long long", "float", "double", "size_t", "std::size_t",
+    "Bool_t", "Char_t", "UChar_t", "Short_t", "UShort_t", "Int_t", "UInt_t", "Long64_t", "ULong64_t", "Float_t", "Double_t"]
+basic_type_regex = re.compile(r"^(ROOT::(VecOps::)?RVec<\s*)?(unsigned |signed )?(" + "|".join(re.escape(t) for t in basic_types) + r")\s*>?$")
+
+# names in the expressions and column lists of the bookings, which can refer to columns
+identifier_regex = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+# bookings which define a column from other columns
+define_methods = ["Define", "DefinePerSample", "Redefine", "Alias"]
+
+def column_references(obj, refs):
+    # add the names which can refer to columns in the arguments of a booking to 'refs',
+    #   this is a superset of the columns which are read
+    if isinstance(obj, str):
+        refs.update(identifier_regex.findall(obj))
+    elif isinstance(obj, (list, tuple, set)):
+        for x in obj:
+            column_references(x, refs)
+    elif isinstance(obj, dict):
+        for x in obj.values():
+            column_references(x, refs)
+    elif type(obj).__name__.startswith("vector<") and "string" in type(obj).__name__:
+        refs.update(str(x) for x in obj)
+    return refs
+
+def is_action(method):
+    # bookings which read columns without defining a column or selecting events, or only inspecting the node
+    return method not in define_methods and method != "Filter" and not method.startswith(("Get", "Has", "Describe"))
+
+# options that can differ between writing and reading the skims without affecting the saved columns
+ignored_args = ["skim", "skimDir", "skimDropBranches", "outfolder", "postfix", "appendOutputFile", "verbose", "noColorLogger",
+    "nThreads", "theoryCorrCacheDir", "profileGraph", "sequentialEventLoops", "mmapHists", "shard", "maxFiles", "filterProcs", "excludeProcs"]
+
+class SkimColumns(object):
+    # columns of one dataset when writing a skim
+    def __init__(self):
+        # columns referenced by the definitions before the skim point
+        self.inputs = {}
+        # columns at the skim point and the ones which can be written
+        self.node = None
+        self.available = None
+        self.writable = None
+        # columns referenced after the skim point
+        self.reads = set()
+
+    def record(self, method, args, kwargs):
+        if self.node is not None or is_action(method):
+            # actions before the skim point (e.g. the sum of weights) are also booked when reading the skim
+            column_references(args, self.reads)
+            column_references(kwargs, self.reads)
+        elif method in define_methods and args:
+            # a redefined column depends on the inputs of all its definitions
+            inputs = self.inputs.setdefault(str(args[0]), set())
+            column_references(args[1:], inputs)
+            column_references(kwargs, inputs)
+
+    def needed(self):
+        # columns to write and definitions to recompute when reading to provide the columns read after the skim point
+        columns = set()
+        recompute = set()
+        missing = set()
+        stack = [c for c in self.reads if c in self.available]
+        while stack:
+            col = stack.pop()
+            if col in columns or col in recompute or col in missing:
+                continue
+            if col in self.writable:
+                columns.add(col)
+            elif col in self.inputs:
+                recompute.add(col)
+                stack.extend(c for c in self.inputs[col] if c in self.available)
+            else:
+                missing.add(col)
+        return columns, recompute, missing
+
+class ColumnRecorder(object):
+    # proxy of the RDF node when writing a skim, records the columns which are referenced by each booking
+    def __init__(self, node, columns):
+        self._node = node
+        self._columns = columns
+
+    def __getattr__(self, name):
+        attr = getattr(self._node, name)
+        if not callable(attr):
+            return attr
+
+        def forward(*args, **kwargs):
+            self._columns.record(name, args, kwargs)
+            return self._wrap(attr(*args, **kwargs))
+        return forward
+
+    def _wrap(self, res):
+        if hasattr(res, "GetColumnNames") and hasattr(res, "Define"):
+            return ColumnRecorder(res, self._columns)
+        return res
+
+class SkimNode(object):
+    # proxy of the RDF node before the skim point when reading a skim, the events in the skim passed all filters
+    #   and the saved columns are read from the file instead of being defined again,
+    #   of the other columns only the ones needed after the skim point are defined ('recompute', all if None)
+    def __init__(self, node, columns, recompute=None):
+        self._node = node
+        self._columns = columns
+        self._recompute = recompute
+
+    def __getattr__(self, name):
+        if name.startswith("Histo"):
+            raise RuntimeError(f"Histograms can not be booked before the skim point when reading from a skim, run without '--skim read' or disable the histograms before the skim point")
+        attr = getattr(self._node, name)
+        if not callable(attr):
+            return attr
+
+        def forward(*args, **kwargs):
+            return self._wrap(attr(*args, **kwargs))
+        return forward
+
+    def _wrap(self, res):
+        if hasattr(res, "GetColumnNames") and hasattr(res, "Define"):
+            return SkimNode(res, self._columns, self._recompute)
+        return res
+
+    def _define(self, method, name, *args):
+        if name in self._columns or (self._recompute is not None and name not in self._recompute):
+            return self
+        return self._wrap(getattr(self._node, method)(name, *args))
+
+    def Define(self, name, *args):
+        return self._define("Define", name, *args)
+
+    def DefinePerSample(self, name, *args):
+        return self._define("DefinePerSample", name, *args)
+
+    def Redefine(self, name, *args):
+        # the saved column already holds the final value at the skim point
+        return self._define("Redefine", name, *args)
+
+    def Alias(self, name, *args):
+        return self._define("Alias", name, *args)
+
+    def Filter(self, *args):
+        return self
+
+class EventSkims(object):
+    def __init__(self, args):
+        self.mode = getattr(args, "skim", None)
+        self.skim_dir = getattr(args, "skimDir", None)
+        self.drop = [re.compile(x) for x in getattr(args, "skimDropBranches", [])]
+        # round trip through json to compare with the options stored with the skims
+        self.args = json.loads(json.dumps({k: v for k, v in vars(args).items() if k not in ignored_args}, default=str))
+        self.shard = getattr(args, "shard", None)
+        # meta data of the skims by dataset name
+        self.meta = {}
+        self.snapshots = {}
+        # recorded columns by dataset name when writing
+        self.columns = {}
+
+        if self.mode is None:
+            return
+        if getattr(args, "analysisMode", None) is not None:
+            # the unfolding and theory agnostic modes book histograms before the selection
+            raise ValueError(f"Skims are not supported for --analysisMode {args.analysisMode}")
+        if not self.skim_dir:
+            raise ValueError("A directory for the skims has to be given with --skimDir")
+        if self.mode == "write":
+            os.makedirs(self.skim_dir, exist_ok=True)
+
+    def path(self, name):
+        tag = "" if self.shard is None else "_shard{}of{}".format(*self.shard.split("/"))
+        return f"{self.skim_dir}/{name}{tag}.root"
+
+    def meta_path(self, name):
+        return self.path(name).replace(".root", ".json")
+
+    def use_skims(self, datasets):
+        # replace the input files of the datasets by their skims, datasets without a skim are read from the original files
+        if self.mode != "read":
+            return datasets
+        for dataset in datasets:
+            meta_file = self.meta_path(dataset.name)
+            if not os.path.isfile(meta_file):
+                logger.warning(f"No skim found for dataset {dataset.name} in {self.skim_dir}, it is processed from the original files")
+                continue
+            with open(meta_file) as f:
+                meta = json.load(f)
+
+            if sorted(meta["filepaths"]) != sorted(dataset.filepaths):
+                logger.warning(f"The skim of dataset {dataset.name} was written from a different set of files ({len(meta['filepaths'])} instead of {len(dataset.filepaths)})")
+            diffs = [k for k, v in meta["args"].items() if k in self.args and self.args[k] != v]
+            if diffs:
+                logger.warning(f"The skim of dataset {dataset.name} was written with different options {diffs}, "
+                    "make sure they don't affect the columns before the skim point")
+
+            logger.info(f"Read dataset {dataset.name} from skim {self.path(dataset.name)}")
+            dataset.filepaths = [self.path(dataset.name)]
+            self.meta[dataset.name] = meta
+        return datasets
+
+    def wrap(self, df, dataset):
+        # to be called at the start of build_graph
+        if self.mode == "write":
+            self.columns[dataset.name] = SkimColumns()
+            return ColumnRecorder(df, self.columns[dataset.name])
+        if self.mode != "read" or dataset.name not in self.meta:
+            return df
+        meta = self.meta[dataset.name]
+        recompute = set(meta["recompute"]) if "recompute" in meta else None
+        return SkimNode(df, set(meta["columns"]), recompute)
+
+    def checkpoint(self, df, dataset):
+        # to be called at the skim point of build_graph with the selected events
+        if isinstance(df, SkimNode):
+            return df._node
+        if self.mode != "write":
+            return df
+
+        skim_columns = self.columns[dataset.name]
+        node = df._node
+        skim_columns.available = set(str(col) for col in node.GetColumnNames())
+        skim_columns.writable = set(col for col in skim_columns.available
+            if not (col.startswith("rdf") or "#" in col or any(r.fullmatch(col) for r in self.drop))
+            and basic_type_regex.match(str(node.GetColumnType(col))))
+        skim_columns.node = node
+        # the columns referenced after the skim point are recorded until the skim is booked
+        return df
+
+    def book(self, dataset):
+        # to be called at the end of build_graph, the columns read after the skim point are written
+        if self.mode != "write" or dataset.name not in self.columns:
+            return
+        skim_columns = self.columns.pop(dataset.name)
+        if skim_columns.node is None:
+            return
+        columns, recompute, missing = skim_columns.needed()
+        columns = sorted(columns)
+        if missing:
+            logger.warning(f"Columns {sorted(missing)} of dataset {dataset.name} are read after the skim point but can't be written or recomputed")
+        logger.debug(f"Columns of dataset {dataset.name} that are not written to the skim and recomputed when reading: {sorted(recompute)}")
+
+        opts = ROOT.RDF.RSnapshotOptions()
+        opts.fLazy = True
+        opts.fMode = "RECREATE"
+        opts.fCompressionAlgorithm = ROOT.ROOT.RCompressionSetting.EAlgorithm.kZSTD
+        opts.fCompressionLevel = 5
+
+        # the snapshot is filled in the same event loop as the histograms
+        self.snapshots[dataset.name] = skim_columns.node.Snapshot("Events", self.path(dataset.name), columns, opts)
+        self.meta[dataset.name] = {
+            "dataset": dataset.name,
+            "filepaths": list(dataset.filepaths),
+            "args": self.args,
+            "columns": columns,
+            "recompute": sorted(recompute),
+        }
+        logger.info(f"Write {len(columns)} columns of dataset {dataset.name} to skim {self.path(dataset.name)}")
+
+    def finalize(self, resultdict):
+        # the sum of weights and number of events before the selection are stored with the skims,
+        #   needs to be called before the histograms are scaled
+        for name, meta in self.meta.items():
+            if name not in resultdict:
+                continue
+            if self.mode == "write":
+                meta["weight_sum"] = float(resultdict[name]["weight_sum"])
+                meta["event_count"] = float(resultdict[name]["event_count"])
+                with open(self.meta_path(name), "w") as f:
+                    json.dump(meta, f, indent=1)
+            elif self.mode == "read":
+                resultdict[name]["weight_sum"] = meta["weight_sum"]
+                resultdict[name]["event_count"] = meta["event_count"]
+        self.snapshots = {}
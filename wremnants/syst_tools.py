@@ -24,14 +24,22 @@ def syst_transform_map(base_hist, hist_name):
         return unc if base_hist == "nominal" else f"{base_hist}_{unc}"
 
     transforms = {}
-    transforms.update({pdf+"Up" : {"action" : lambda h,p=pdf: pdfUnc(h, p)[0] if "pdfVar" in h.axes.name else h} for pdf in pdfNames})
-    transforms.update({pdf+"Down" : {"action" : lambda h,p=pdf: pdfUnc(h, p)[1] if "pdfVar" in h.axes.name else h} for pdf in pdfNames})
-    transforms["scetlib_dyturboMSHT20Up"] = {"action" : lambda h: pdfUnc(h, "pdfMSHT20", "vars")[0], "procs" : common.vprocs_all}
-    transforms["scetlib_dyturboMSHT20Down"] = {"action" : lambda h: pdfUnc(h, "pdfMSHT20", "vars")[1], "procs" : common.vprocs_all}
-    transforms["scetlib_dyturboCT18ZUp"] = {"action" : lambda h: pdfUnc(h, "pdfCT18Z", "vars")[0], "procs" : common.vprocs_all}
-    transforms["scetlib_dyturboCT18ZDown"] = {"action" : lambda h: pdfUnc(h, "pdfCT18Z", "vars")[1], "procs" : common.vprocs_all}
-    transforms["scetlib_dyturboMSHT20an3loUp"] = {"action" : lambda h: pdfUnc(h, "pdfMSHT20", "vars")[0], "procs" : common.zprocs_all}
-    transforms["scetlib_dyturboMSHT20an3loDown"] = {"action" : lambda h: pdfUnc(h, "pdfMSHT20", "vars")[1], "procs" : common.zprocs_all}
+
+    def addPdfTransforms(name, pdfName, axis_name="pdfVar", procs=None):
+        # the up and down variations are computed together by 'variations', 
+        #   such that a caller that needs both can compute them from a single load of the histogram
+        variations = lambda h: pdfUnc(h, pdfName, axis_name) if axis_name in h.axes.name else (h, h)
+        pair = (name+"Up", name+"Down")
+        for i, var in enumerate(pair):
+            transforms[var] = {"action" : lambda h,i=i: variations(h)[i], "variations" : variations, "pair" : pair}
+            if procs is not None:
+                transforms[var]["procs"] = procs
+
+    for pdf in pdfNames:
+        addPdfTransforms(pdf, pdf)
+    addPdfTransforms("scetlib_dyturboMSHT20", "pdfMSHT20", "vars", common.vprocs_all)
+    addPdfTransforms("scetlib_dyturboCT18Z", "pdfCT18Z", "vars", common.vprocs_all)
+    addPdfTransforms("scetlib_dyturboMSHT20an3lo", "pdfMSHT20", "vars", common.zprocs_all)
     transforms["ewUp"] = {"action" : lambda h,**args: h if "systIdx" not in h.axes.name else h[{"systIdx" : 0}]}
     transforms["ewDown"] = {"requiresNominal" : True, "action" : lambda h,**args: h if "systIdx" not in h.axes.name else hh.mirrorHist(h[{"systIdx" : 0}], **args)}
     transforms["muonScaleUp"] = {"action" : lambda h: h if "unc" not in h.axes.name else hh.rssHistsMid(h, "unc")[1]}
@@ -9,6 +9,8 @@ import pickle
 import re
 import glob
 import h5py
+import hashlib
+import time
 from wremnants.correctionsTensor_helper import makeCorrectionsTensor
 from utilities import boostHistHelpers as hh, common, logging
 from utilities.io_tools import input_tools
@@ -26,8 +28,54 @@ def valid_ew_theory_corrections():
     matches = [re.match("(^.*)Corr[W|Z]\.pkl\.lz4", os.path.basename(c)) for c in corr_files]
     return [m[1] for m in matches if m]+["none"]
 
-def load_corr_helpers(procs, generators, make_tensor=True, base_dir=f"{common.data_dir}/TheoryCorrections/"):
+# postprocessed correction histograms can be cached as raw arrays to skip the decompression and postprocessing,
+#   the cache is only used if a directory is given with the WREMNANTS_CORR_CACHE environment variable or --theoryCorrCacheDir
+corr_cache_dir = os.environ.get("WREMNANTS_CORR_CACHE", "")
+# increase when the postprocessing changes to invalidate the cache
+corr_cache_version = 1
+
+def corr_cache_key(fname, proc, generator):
+    stat = os.stat(fname)
+    key = f"{os.path.realpath(fname)}:{stat.st_mtime_ns}:{stat.st_size}:{proc}:{generator}:{corr_cache_version}"
+    return f"{generator}Corr{proc}_{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+
+def load_corr_hist_cached(fname, proc, generator, cache_dir=None):
+    # returns the postprocessed correction histogram, the storage is read from a memory mapped array if it was cached before
+    if cache_dir is None:
+        cache_dir = corr_cache_dir
+    if not cache_dir:
+        return postprocess_corr_hist(load_corr_hist(fname, proc, get_corr_name(generator)))
+
+    key = corr_cache_key(fname, proc, generator)
+    cache_path = f"{cache_dir}/{key}"
+    if os.path.isfile(f"{cache_path}.npy") and os.path.isfile(f"{cache_path}.pkl"):
+        with open(f"{cache_path}.pkl", "rb") as f:
+            axes, storage_type = pickle.load(f)
+        corrh = hist.Hist(*axes, storage=storage_type())
+        corrh.view(flow=True)[...] = np.load(f"{cache_path}.npy", mmap_mode="r")
+        return corrh
+
+    corrh = postprocess_corr_hist(load_corr_hist(fname, proc, get_corr_name(generator)))
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to temporary files first such that concurrent jobs never read incomplete files
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(f"{tmp_path}.npy", "wb") as f:
+            np.save(f, corrh.view(flow=True))
+        with open(f"{tmp_path}.pkl", "wb") as f:
+            pickle.dump((list(corrh.axes), corrh.storage_type), f)
+        os.replace(f"{tmp_path}.npy", f"{cache_path}.npy")
+        os.replace(f"{tmp_path}.pkl", f"{cache_path}.pkl")
+    except OSError as e:
+        logger.warning(f"Could not write theory correction cache {cache_path}: {e}")
+
+    return corrh
+
+def load_corr_helpers(procs, generators, make_tensor=True, base_dir=f"{common.data_dir}/TheoryCorrections/", cache_dir=None):
     corr_helpers = {}
+    # the corrections only depend on the boson, the helpers are shared between the processes
+    loaded = {}
     for proc in procs:
         corr_helpers[proc] = {}
         for generator in generators:
@@ -35,15 +83,24 @@ def load_corr_helpers(procs, generators, make_tensor=True, base_dir=f"{common.da
             if not os.path.isfile(fname):
                 logger.warning(f"Did not find correction file for process {proc}, generator {generator}. No correction will be applied for this process!")
                 continue
+            if (fname, generator) in loaded:
+                helper = loaded[(fname, generator)]
+                corr_helpers[proc][generator] = helper.copy() if not make_tensor else helper
+                continue
+
             logger.debug(f"Make theory correction helper for file: {fname}")
-            corrh = load_corr_hist(fname, proc[0], get_corr_name(generator))
-            corrh = postprocess_corr_hist(corrh)
+            time0 = time.time()
+            corrh = load_corr_hist_cached(fname, proc[0], generator, cache_dir)
+            time1 = time.time()
             if not make_tensor:
-                corr_helpers[proc][generator] = corrh
+                helper = corrh
             elif "Helicity" in generator:
-                corr_helpers[proc][generator] = makeCorrectionsTensor(corrh, ROOT.wrem.CentralCorrByHelicityHelper, tensor_rank=3)
+                helper = makeCorrectionsTensor(corrh, ROOT.wrem.CentralCorrByHelicityHelper, tensor_rank=3)
             else:
-                corr_helpers[proc][generator] = makeCorrectionsTensor(corrh, weighted_corr=generator in theory_tools.theory_corr_weight_map)
+                helper = makeCorrectionsTensor(corrh, weighted_corr=generator in theory_tools.theory_corr_weight_map)
+            logger.info(f"Theory correction helper {generator} for {proc[0]}: load {time1 - time0:.2f}s, conversion {time.time() - time1:.2f}s")
+            loaded[(fname, generator)] = helper
+            corr_helpers[proc][generator] = helper
     for generator in generators:
         if not any([generator in corr_helpers[proc] for proc in procs]):
             logger.warning(f"Did not find correction for generator {generator} for any processes!")
@@ -8,9 +8,10 @@ from wremnants import theory_corrections
 from scipy import ndimage
 import narf.clingutils
 from math import sqrt
+from wremnants import cling_cache
 
 logger = logging.child_logger(__name__)
-narf.clingutils.Declare('#include "theoryTools.h"')
+cling_cache.declare("theoryTools.h")
 
 # this puts the bin centers at 0.5, 1.0, 2.0
 axis_muRfact = hist.axis.Variable(
@@ -786,17 +787,75 @@ def pdfAsymmetricShifts(hdiff, axis_name):
     downshift = shiftHist(downvals, hdiff, axis_name)
     return upshift, downshift 
 
+def hessianPdfShiftIndices(ax, symmetric):
+    # indices of the error sets along the flow view of the pdf axis, consistent with pdfSymmetricShifts and pdfAsymmetricShifts
+    underflow = int(ax.traits.underflow)
+    if symmetric:
+        # all entries, the difference of the central set and the overflow is zero
+        return None, None
+    if type(ax) == hist.axis.StrCategory and all(["Up" in x or "Down" in x for x in ax][1:]):
+        end = int((ax.size-1)/2)
+        upidx = [i for i, x in enumerate(ax) if "Up" in x][:end]
+        downidx = [i for i, x in enumerate(ax) if "Down" in x][:end]
+        if len(upidx) != len(downidx):
+            raise ValueError("Malformed PDF uncertainty hist! Expect equal number of up and down vars")
+    else:
+        # The error sets are ordered up,down,up,down...
+        end = ax.size+underflow
+        upidx = list(range(1+underflow, end, 2))
+        downidx = list(range(2+underflow, end, 2))
+    return upidx, downidx
+
 def hessianPdfUnc(h, axis_name="pdfVar", uncType="symHessian", scale=1.):
-    underflow = h.axes[axis_name].traits.underflow
-    symmetric = uncType == "symHessian"
-    diff = hh.addHists(h, -1*h[{axis_name : 0}])*scale
-    if diff.axes[axis_name].traits.overflow:
-        diff[...,hist.overflow] = np.zeros_like(diff[{axis_name : 0}].view(flow=True))
-    shiftFunc = pdfSymmetricShifts if symmetric else pdfAsymmetricShifts
-    rssUp, rssDown = shiftFunc(diff, axis_name)
-    hUp = hh.addHists(h[{axis_name : 0}], 1*rssUp)
-    hDown = hh.addHists(h[{axis_name : 0}], -1*rssDown)
-    return hUp, hDown
+    # up and down variations in one pass over the storage view, reducing along the pdf axis,
+    #   the values and variances are the same as from the sequence of hist operations in pdfSymmetricShifts and pdfAsymmetricShifts
+    ax = h.axes[axis_name]
+    iax = h.axes.name.index(axis_name)
+    underflow = int(ax.traits.underflow)
+    with_variance = h.storage_type == hist.storage.Weight
+    upidx, downidx = hessianPdfShiftIndices(ax, uncType == "symHessian")
+
+    vals = np.moveaxis(h.values(flow=True), iax, -1)
+    nomvals = vals[..., underflow]
+    diff = vals - nomvals[..., np.newaxis]
+    diff *= scale
+    if ax.traits.overflow:
+        diff[..., -1] = 0.
+    if with_variance:
+        varis = np.moveaxis(h.variances(flow=True), iax, -1)
+        nomvars = varis[..., underflow]
+        diffvars = varis + nomvars[..., np.newaxis]
+        diffvars *= scale*scale
+        if ax.traits.overflow:
+            diffvars[..., -1] = 0.
+
+    def rss(idx):
+        d = diff if idx is None else np.take(diff, idx, axis=-1)
+        sq = d*d
+        ss = np.sum(sq, axis=-1)
+        root = np.sqrt(ss)
+        if not with_variance:
+            return root, None
+        dvars = diffvars if idx is None else np.take(diffvars, idx, axis=-1)
+        # variance of the squares and of the square root of the sum as in hh.multiplyHists and hh.sqrtHist
+        sqvars = sq*sq*(2*hh.relVariance(d, dvars))
+        rootvars = 0.5*root*root*hh.relVariance(ss, np.sum(sqvars, axis=-1))
+        return root, rootvars
+
+    def make_hist(shift, shiftvars):
+        hout = hist.Hist(*[a for a in h.axes if a.name != axis_name], storage=h.storage_type())
+        if with_variance:
+            hout.view(flow=True)[...] = np.stack((nomvals + shift, nomvars + shiftvars), axis=-1)
+        else:
+            hout.view(flow=True)[...] = nomvals + shift
+        return hout
+
+    upshift, upvars = rss(upidx)
+    if upidx is None:
+        downshift, downvars = upshift, upvars
+    else:
+        downshift, downvars = rss(downidx)
+    return make_hist(upshift, upvars), make_hist(-1*downshift, downvars)
 
 def pdfBugfixMSHT20(df , tensorPDFName):
     # There is a known bug in MSHT20 where member 15 and 16 are identical
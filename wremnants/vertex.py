@@ -5,8 +5,9 @@ import narf
 import numpy as np
 import boost_histogram as bh
 from utilities import common, logging
+from wremnants import cling_cache
 
-narf.clingutils.Declare('#include "vertex.h"')
+cling_cache.declare("vertex.h")
 
 logger = logging.child_logger(__name__)
 